@@ -16,11 +16,11 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
-from django.conf.urls.static import static
+from register.views import MediaView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('register.urls')),
+    # メディアファイルはアクセスを確認してから返す（本番ではWebサーバーが送信する）
+    path(settings.MEDIA_URL.lstrip('/') + '<path:name>', MediaView.as_view(), name='media'),
 ]
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
@@ -2,7 +2,7 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.forms import UserChangeForm, UserCreationForm
 from django.utils.translation import ugettext_lazy as _
-from .models import User, Video, Subject, Comment, Lecturer
+from .models import User, Video, Subject, Comment, Lecturer, OutgoingMail
 
 
 class MyUserChangeForm(UserChangeForm):
@@ -47,3 +47,4 @@ admin.site.register(Video)
 admin.site.register(Subject)
 admin.site.register(Comment)
 admin.site.register(Lecturer)
+admin.site.register(OutgoingMail)
@@ -1,5 +1,15 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.core.signals import request_started
 
 
 class RegisterConfig(AppConfig):
     name = 'register'
+
+    def ready(self):
+        # シグナルの登録
+        from . import signals  # noqa: F401
+        from .db import close_unusable_connections
+
+        if getattr(settings, 'DATABASE_HEALTH_CHECKS', False):
+            request_started.connect(close_unusable_connections, dispatch_uid='register_db_health_checks')
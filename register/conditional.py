@@ -0,0 +1,50 @@
+"""一覧・再生ページの条件付きGET（ETag / Last-Modified と 304 Not Modified）
+
+ページを描画せずに、表示内容が変わったかどうかだけを調べる。
+一覧はキャッシュに置いたバージョン（page_cache.py）だけから作り、動画の表は読まない。
+再生ページは動画の行とコメント欄のバージョンから作る。
+
+ページにはログイン中のユーザーの情報（ナビゲーション）も含まれるので、ETagにはユーザーも含める。
+CSRFトークンは含めない。描画のたびに変わる値だが、同じCookieのあいだは古いページのフォームも送信できる。
+一覧にはLast-Modifiedを付けない。再生ページのコメントの追加はupdated_atを変えないため、
+Last-ModifiedよりETagの方が正確。ブラウザは両方を送ってくるが、その場合はIf-None-Matchが優先される。
+"""
+import hashlib
+
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+from . import reference
+
+
+def make_etag(request, *parts):
+    user = request.user
+    parts += (
+        user.pk, user.is_superuser,
+        # ナビゲーションの科目一覧
+        reference.get_version('subjects'),
+    )
+    return '"{0}"'.format(hashlib.md5(repr(parts).encode()).hexdigest())
+
+
+def not_modified(request, etag, last_modified):
+    """変わっていなければ304のレスポンス、変わっていればNone"""
+    timestamp = last_modified.timestamp() if last_modified else None
+    return get_conditional_response(request, etag=etag, last_modified=timestamp)
+
+
+def set_headers(request, response, etag, last_modified, admin=False):
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    if not request.user.is_authenticated:
+        # ログインしていなければ誰にでも同じページ。再生回数を数えるため毎回確認させる
+        patch_cache_control(response, public=True, no_cache=True)
+    elif admin:
+        # 管理者用のページは共有キャッシュに置かず、毎回確認させる
+        patch_cache_control(response, private=True, no_cache=True, must_revalidate=True)
+    else:
+        # ユーザーごとのページ。ブラウザには置いてよいが、使う前に確認させる
+        patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ('Cookie',))
+    return response
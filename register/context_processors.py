@@ -1,9 +1,12 @@
-from .models import Subject
+from .page_cache import TIMEOUT as PAGE_CACHE_TIMEOUT
+from .reference import get_subjects
 
 
 def common(request):
     """this is the date which is gonna be passsed """
     context = {
-        'subject_list': Subject.objects.all(),
+        'subject_list': get_subjects(),
+        # テンプレートの{% cache %}の秒数
+        'page_cache_timeout': PAGE_CACHE_TIMEOUT,
     }
     return context
@@ -0,0 +1,194 @@
+"""再生回数のバッファリング
+
+再生のたびにVideoの行をsave()するのではなく、増分をキャッシュに溜めておき、
+一定時間ごと・一定件数ごとに F('count') + n でまとめてDBに書き込む。
+リクエスト処理中はキャッシュへの加算だけで、DBへの書き込みは行わない。
+
+増分はsettings.CACHESの'counters'の動画ごとのキーにincrで加算する。incrがアトミックな
+バックエンド（memcachedか、プロセスごとのLocMemCache）を使い、DBの表のキャッシュは使わない。
+各プロセスは自分が加算した動画のIDを覚えておき、スレッドがその動画のキーだけを書き込む。
+共有の未反映一覧は持たないので、同時に加算されても動画が漏れない。
+flush_view_countsコマンドは動画のIDを順に読んでキーを確認する（memcachedのときだけ意味がある）。
+"""
+import atexit
+import logging
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.db.models import F
+
+KEY_PREFIX = 'register:viewcount:'
+LOCK_KEY = KEY_PREFIX + 'lock'
+
+# 何秒ごとにDBへ書き込むか
+FLUSH_INTERVAL = getattr(settings, 'VIEW_COUNT_FLUSH_INTERVAL', 10)
+# このプロセスで何回加算したら間隔を待たずに書き込むか
+FLUSH_THRESHOLD = getattr(settings, 'VIEW_COUNT_FLUSH_THRESHOLD', 100)
+# 他プロセスとflushが重ならないようにするロックの有効期限
+LOCK_TIMEOUT = 60
+# 1回のget_manyで確認する動画の数
+BATCH_SIZE = 500
+CACHE_ALIAS = 'counters' if 'counters' in settings.CACHES else 'default'
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_wakeup = threading.Event()
+_flusher = None
+_since_flush = 0
+# このプロセスで加算し、まだ書き込んでいない動画のID
+_touched = set()
+
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+
+def _counter_key(video_pk):
+    return '{0}{1}'.format(KEY_PREFIX, video_pk)
+
+
+def pending_count(video_pk):
+    """まだDBに書き込まれていない再生回数"""
+    return get_cache().get(_counter_key(video_pk), 0)
+
+
+def increment(video_pk):
+    """再生回数を1増やし、バッファ中の未反映分を返す"""
+    global _since_flush
+    cache = get_cache()
+    key = _counter_key(video_pk)
+    try:
+        value = cache.incr(key)
+    except ValueError:
+        # キーが無いときだけaddする。同時にaddされた場合はincrし直す
+        if cache.add(key, 1, timeout=None):
+            value = 1
+        else:
+            value = cache.incr(key)
+
+    with _lock:
+        _touched.add(video_pk)
+        _since_flush += 1
+        if _since_flush >= FLUSH_THRESHOLD:
+            _wakeup.set()
+    ensure_flusher()
+    return value
+
+
+def _all_video_pks():
+    from .models import Video
+
+    video_pks = Video.objects.order_by('pk').values_list('pk', flat=True)
+    last_pk = 0
+    while True:
+        batch = list(video_pks.filter(pk__gt=last_pk)[:BATCH_SIZE])
+        if not batch:
+            return
+        last_pk = batch[-1]
+        yield batch
+
+
+def flush(video_pks=None):
+    """バッファ中の再生回数をDBへまとめて書き込み、更新した動画の数を返す
+
+    video_pksを省略すると全ての動画のキーを確認する。
+    """
+    from .models import Video
+
+    cache = get_cache()
+    if not cache.add(LOCK_KEY, 1, timeout=LOCK_TIMEOUT):
+        # 他のプロセスがflush中。このプロセスの分は次回書き込む
+        if video_pks:
+            with _lock:
+                _touched.update(video_pks)
+        return 0
+    try:
+        if video_pks is None:
+            batches = _all_video_pks()
+        else:
+            video_pks = sorted(video_pks)
+            batches = (video_pks[i:i + BATCH_SIZE] for i in range(0, len(video_pks), BATCH_SIZE))
+
+        by_amount = defaultdict(list)
+        for batch in batches:
+            keys = {_counter_key(video_pk): video_pk for video_pk in batch}
+            for key, amount in cache.get_many(keys).items():
+                if amount:
+                    by_amount[amount].append(keys[key])
+
+        # 同じ増分の動画はUPDATE 1回にまとめる
+        flushed = {}
+        for amount, pks in by_amount.items():
+            Video.objects.filter(pk__in=pks).update(count=F('count') + amount)
+            for video_pk in pks:
+                flushed[video_pk] = amount
+                try:
+                    # 書き込み中に増えた分は残すため、deleteではなくdecrする
+                    cache.decr(_counter_key(video_pk), amount)
+                except ValueError:
+                    # キャッシュから追い出された。残りの動画の処理は続ける
+                    logger.warning('view count key for video %s disappeared during flush', video_pk)
+
+        # 日ごとの集計（stats.py）にも加え、一覧の再生回数を表示し直させる
+        from . import page_cache, stats
+        stats.add_views(flushed)
+        page_cache.invalidate_listings(list(flushed))
+        return len(flushed)
+    finally:
+        cache.delete(LOCK_KEY)
+
+
+def flush_touched():
+    """このプロセスで加算した動画の分だけ書き込む。他プロセスの分はそれぞれが書き込む"""
+    global _since_flush, _touched
+    with _lock:
+        video_pks, _touched = _touched, set()
+        _since_flush = 0
+    if not video_pks:
+        return 0
+    try:
+        return flush(video_pks)
+    except Exception:
+        # 書き込めなかった分は次回に回す
+        with _lock:
+            _touched.update(video_pks)
+        raise
+
+
+def _run_flusher():
+    while True:
+        _wakeup.wait(FLUSH_INTERVAL)
+        _wakeup.clear()
+        try:
+            flush_touched()
+        except Exception:
+            logger.exception('failed to flush view counts')
+        try:
+            # 視聴位置（progress.py）も同じスレッドで書き込む
+            from . import progress
+            progress.flush()
+        except Exception:
+            logger.exception('failed to flush watch progress')
+        finally:
+            # このスレッド用に開いた接続を閉じる
+            connections.close_all()
+
+
+def ensure_flusher():
+    """DBへ書き込むスレッドが無ければ起動する"""
+    global _flusher
+    if _flusher is not None and _flusher.is_alive():
+        return
+    with _lock:
+        if _flusher is None:
+            from . import progress
+            # 終了時に残っている分を書き込む
+            atexit.register(flush_touched)
+            atexit.register(progress.flush)
+        if _flusher is None or not _flusher.is_alive():
+            _flusher = threading.Thread(target=_run_flusher, name='view-count-flusher', daemon=True)
+            _flusher.start()
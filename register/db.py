@@ -0,0 +1,17 @@
+"""データベース接続の管理
+
+CONN_MAX_AGEで接続を使い回していると、DBの再起動やプーラーの切断で
+切れた接続を次のリクエストでそのまま使ってしまい、そのリクエストがエラーになる。
+DATABASE_HEALTH_CHECKSが有効なら、リクエストの最初に使い回す接続を確認し、
+切れていれば閉じて接続し直させる。
+"""
+from django.db import connections
+
+
+def close_unusable_connections(**kwargs):
+    for connection in connections.all():
+        # 接続していないか、使い回さない設定なら確認しなくてよい
+        if connection.connection is None or not connection.settings_dict['CONN_MAX_AGE']:
+            continue
+        if not connection.is_usable():
+            connection.close()
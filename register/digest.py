@@ -0,0 +1,81 @@
+"""コメント通知のまとめ送信
+
+COMMENT_DIGEST_WINDOW_SECONDSが0より大きいときは、コメントごとにメールを送らず
+宛先ごとにCommentNotificationを溜めておく。宛先の一番古い通知が
+その秒数だけ経ったら、溜まっているコメントを1通のメールにまとめて送信キューに入れる。
+
+まとめるのはsend_comment_digestsコマンドで、send_queued_mailと同じく
+--loopを付けてワーカーとして常駐させる（--intervalは窓の秒数より短くする）。
+ワーカーが複数あっても、通知は条件付きのUPDATEで1つのワーカーだけが取るので二重に送らない。
+"""
+import uuid
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Min
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .mail import enqueue_mail
+
+WINDOW_SECONDS = getattr(settings, 'COMMENT_DIGEST_WINDOW_SECONDS', 0)
+
+
+def is_enabled():
+    return WINDOW_SECONDS > 0
+
+
+def queue_comment(comment, recipients, site_url):
+    """コメントの通知を宛先ごとに溜める"""
+    from .models import CommentNotification
+
+    CommentNotification.objects.bulk_create([
+        CommentNotification(recipient=recipient, comment=comment, site_url=site_url)
+        # 同じアドレスが複数回指定されても1通にする
+        for recipient in OrderedDict.fromkeys(recipients)
+    ])
+
+
+def send_due(now=None, force=False):
+    """まとめる時間を過ぎた宛先にダイジェストを送り、送った通数を返す"""
+    from .models import CommentNotification
+
+    now = now or timezone.now()
+    pending = CommentNotification.objects.filter(sent_at__isnull=True)
+    recipients = pending.values('recipient').annotate(oldest=Min('created_at'))
+    if not force:
+        recipients = recipients.filter(oldest__lte=now - timedelta(seconds=WINDOW_SECONDS))
+    recipients = [row['recipient'] for row in recipients]
+    if not recipients:
+        return 0
+
+    token = uuid.uuid4().hex
+    with transaction.atomic():
+        # まだ送っていない通知だけを自分の分にする。同時に動いた他のワーカーが取った通知は
+        # sent_atが入っているので更新されない。送信キューへの登録に失敗したら取り消される
+        claimed = pending.filter(recipient__in=recipients).update(sent_at=now, claim_token=token)
+        if not claimed:
+            return 0
+        # sent_atとrecipientは索引（commentnotif_pending_idx）で引ける
+        notifications = CommentNotification.objects.filter(
+            sent_at=now, recipient__in=recipients, claim_token=token,
+        ).select_related(
+            'comment__video__user', 'comment__lecturer'
+        ).order_by('recipient', 'comment__video', 'created_at')
+
+        by_recipient = OrderedDict()
+        for notification in notifications:
+            by_recipient.setdefault(notification.recipient, []).append(notification)
+
+        for recipient, items in by_recipient.items():
+            context = {
+                'recipient': recipient,
+                'notifications': items,
+                'site_url': items[0].site_url,
+            }
+            subject = render_to_string('register/mail_template/comment_digest/subject.txt', context)
+            message = render_to_string('register/mail_template/comment_digest/message.txt', context)
+            enqueue_mail(subject, message, [recipient])
+    return len(by_recipient)
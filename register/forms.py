@@ -4,11 +4,53 @@ from django.contrib.auth.forms import (
     PasswordResetForm, SetPasswordForm
 )
 from django.contrib.auth import get_user_model
-from .models import Video, Subject, Comment
+from django.core.exceptions import ValidationError
+from django.forms.models import ModelChoiceIterator
+from django.template import loader
+from .mail import enqueue_mail
+from . import uploads
+from .models import Video, Subject, Comment, Lecturer, UploadSession
+from .reference import get_lecturers, get_subjects
 
 User = get_user_model()
 
 
+class CachedChoiceIterator(ModelChoiceIterator):
+    """querysetではなくキャッシュされた一覧から選択肢を作る"""
+
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ('', self.field.empty_label)
+        for obj in self.field.loader():
+            yield self.choice(obj)
+
+    def __len__(self):
+        return len(self.field.loader()) + (self.field.empty_label is not None)
+
+    def __bool__(self):
+        return self.field.empty_label is not None or bool(self.field.loader())
+
+
+class CachedModelChoiceField(forms.ModelChoiceField):
+    """選択肢をreference.pyのキャッシュから作るModelChoiceField
+
+    表示時も入力チェック時もDBに問い合わせない。
+    """
+    iterator = CachedChoiceIterator
+
+    def __init__(self, loader, *args, **kwargs):
+        self.loader = loader
+        super().__init__(*args, **kwargs)
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        for obj in self.loader():
+            if str(obj.pk) == str(value):
+                return obj
+        raise ValidationError(self.error_messages['invalid_choice'], code='invalid_choice')
+
+
 class EmailChangeForm(forms.ModelForm):
     """メールアドレス変更フォーム"""
 
@@ -83,6 +125,13 @@ class MyPasswordResetForm(PasswordResetForm):
         for field in self.fields.values():
             field.widget.attrs['class'] = 'form-control'
 
+    def send_mail(self, subject_template_name, email_template_name,
+                  context, from_email, to_email, html_email_template_name=None):
+        """その場で送信せず、送信キューに登録する"""
+        subject = loader.render_to_string(subject_template_name, context)
+        body = loader.render_to_string(email_template_name, context)
+        enqueue_mail(subject, body, [to_email], from_email)
+
 
 class MySetPasswordForm(SetPasswordForm):
     """パスワード再設定用フォーム(パスワード忘れて再設定)"""
@@ -93,7 +142,56 @@ class MySetPasswordForm(SetPasswordForm):
             field.widget.attrs['class'] = 'form-control'
 
 
-class VideoCreateForm(forms.ModelForm):
+class ChunkedUploadFormMixin:
+    """分割アップロード（uploads.py）で送り終えたファイルを受け付ける
+
+    ファイル欄の代わりにupload_sessionにUploadSessionのIDが入っていれば、
+    そのファイルをファイル欄に紐づける。
+    """
+    chunked_file_field = None
+    chunked_target = None
+
+    def __init__(self, *args, uploader=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.uploader = uploader
+        self.fields['upload_session'] = forms.UUIDField(required=False, widget=forms.HiddenInput)
+        file_field = self.fields[self.chunked_file_field]
+        self.file_required = file_field.required
+        file_field.required = False
+        # static/register/chunked_upload.js が目印にする
+        file_field.widget.attrs['data-chunked-upload'] = self.chunked_target
+
+    def clean(self):
+        cleaned_data = super().clean()
+        session_pk = cleaned_data.get('upload_session')
+        if session_pk:
+            session = None
+            if self.uploader is not None and self.uploader.is_authenticated:
+                session = UploadSession.objects.filter(
+                    pk=session_pk, user=self.uploader, target=self.chunked_target
+                ).exclude(file_name='').first()
+            if session is None:
+                self.add_error('upload_session', 'アップロードが完了していません。もう一度送信してください。')
+            cleaned_data['upload_session'] = session
+        elif self.file_required and not cleaned_data.get(self.chunked_file_field):
+            self.add_error(self.chunked_file_field, self.fields[self.chunked_file_field].error_messages['required'])
+        return cleaned_data
+
+    def save(self, commit=True):
+        instance = super().save(commit=False)
+        session = self.cleaned_data.get('upload_session')
+        if session is not None:
+            uploads.attach(session, instance)
+        if commit:
+            instance.save()
+            self._save_m2m()
+        return instance
+
+
+class VideoCreateForm(ChunkedUploadFormMixin, forms.ModelForm):
+    chunked_file_field = 'upload'
+    chunked_target = UploadSession.VIDEO
+
     class Meta:
         model = Video
         fields = ('title', 'description', 'thumbnail', 'upload','subject', 'user')
@@ -114,7 +212,10 @@ class VideoCreateForm(forms.ModelForm):
         }
 
 
-class CommentCreateForm(forms.ModelForm):
+class CommentCreateForm(ChunkedUploadFormMixin, forms.ModelForm):
+    chunked_file_field = 'reply_video'
+    chunked_target = UploadSession.REPLY_VIDEO
+    lecturer = CachedModelChoiceField(get_lecturers, queryset=Lecturer.objects.all(), label='講師')
 
     class Meta:
         model = Comment
@@ -143,6 +244,6 @@ class CommentCreateForm(forms.ModelForm):
 
 
 class SearchForm(forms.Form):
-    subject = forms.ModelChoiceField(
-        queryset=Subject.objects, label='科目', required=False
+    subject = CachedModelChoiceField(
+        get_subjects, queryset=Subject.objects.all(), label='科目', required=False
     )
\ No newline at end of file
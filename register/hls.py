@@ -0,0 +1,160 @@
+"""アップロードされた動画のHLS（複数画質）への変換
+
+package_hlsコマンド（ワーカー）がffmpegで動画をHLS_LADDERの各画質に変換し、
+hls/<動画のID>/ に画質ごとのプレイリストとセグメント、全画質をまとめた
+マスタープレイリスト（master.m3u8）を書き出す。プレイヤーは回線の速さに合わせて
+画質を切り替えられる。変換はアップロードとは別に行うので、アップロードは待たされない。
+"""
+import json
+import os
+import shutil
+import subprocess
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.utils import timezone
+
+from . import page_cache
+
+FFMPEG = getattr(settings, 'FFMPEG_BINARY', 'ffmpeg')
+FFPROBE = getattr(settings, 'FFPROBE_BINARY', 'ffprobe')
+# (高さ, 映像のビットレートkbps)。元の動画より高い画質は作らない
+LADDER = getattr(settings, 'HLS_LADDER', ((1080, 5000), (720, 2800), (480, 1400), (360, 800)))
+AUDIO_KBPS = 128
+SEGMENT_SECONDS = 6
+# 1つの画質の変換にかけてよい秒数
+TIMEOUT_SECONDS = 60 * 60
+
+# 変換結果は元の動画から作り直せるので、参照数を数えずに普通に保存する
+storage = FileSystemStorage()
+
+
+class PackagingError(Exception):
+    pass
+
+
+def is_available():
+    return shutil.which(FFMPEG) is not None and shutil.which(FFPROBE) is not None
+
+
+def probe(path):
+    """動画の幅・高さと、音声があるかを調べる"""
+    result = subprocess.run(
+        [FFPROBE, '-v', 'error', '-print_format', 'json', '-show_streams', path],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=120,
+    )
+    if result.returncode != 0:
+        raise PackagingError(result.stderr.decode(errors='replace'))
+    streams = json.loads(result.stdout.decode()).get('streams', [])
+    video = next((stream for stream in streams if stream.get('codec_type') == 'video'), None)
+    if video is None:
+        raise PackagingError('映像がありません')
+    has_audio = any(stream.get('codec_type') == 'audio' for stream in streams)
+    return int(video['width']), int(video['height']), has_audio
+
+
+def ladder_for(width, height):
+    """元の動画の大きさに合わせた[(幅, 高さ, kbps)]"""
+    rungs = [(h, kbps) for h, kbps in LADDER if h <= height]
+    if not rungs:
+        # 一番小さい画質より小さい動画は拡大せず、元の高さの1画質だけにする。
+        # 高さも偶数にし、ビットレートは高さに比例して下げる
+        smallest_height, smallest_kbps = min(LADDER)
+        h = max(height // 2 * 2, 2)
+        rungs = [(h, max(int(smallest_kbps * h / smallest_height), 100))]
+    # 幅はH.264のため偶数にする
+    return [(int(round(width * h / height / 2)) * 2, h, kbps) for h, kbps in rungs]
+
+
+def encode(path, out_dir, height, kbps, has_audio):
+    """1つの画質を変換して out_dir/index.m3u8 を作る"""
+    os.makedirs(out_dir, exist_ok=True)
+    command = [
+        FFMPEG, '-v', 'error', '-y', '-i', path,
+        '-map', '0:v:0', '-vf', 'scale=-2:{0}'.format(height),
+        '-c:v', 'libx264', '-preset', 'veryfast', '-profile:v', 'main',
+        '-b:v', '{0}k'.format(kbps), '-maxrate', '{0}k'.format(int(kbps * 1.07)),
+        '-bufsize', '{0}k'.format(kbps * 2),
+        # セグメントの境目をキーフレームにそろえる
+        '-g', '48', '-keyint_min', '48', '-sc_threshold', '0',
+    ]
+    if has_audio:
+        command += ['-map', '0:a:0', '-c:a', 'aac', '-b:a', '{0}k'.format(AUDIO_KBPS), '-ac', '2']
+    command += [
+        '-f', 'hls', '-hls_time', str(SEGMENT_SECONDS), '-hls_playlist_type', 'vod',
+        '-hls_segment_filename', os.path.join(out_dir, 'seg_%04d.ts'),
+        os.path.join(out_dir, 'index.m3u8'),
+    ]
+    result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=TIMEOUT_SECONDS)
+    if result.returncode != 0:
+        raise PackagingError(result.stderr.decode(errors='replace'))
+
+
+def write_master(out_dir, renditions, has_audio):
+    lines = ['#EXTM3U', '#EXT-X-VERSION:3']
+    for width, height, kbps in renditions:
+        bandwidth = (kbps + (AUDIO_KBPS if has_audio else 0)) * 1000
+        lines.append('#EXT-X-STREAM-INF:BANDWIDTH={0},RESOLUTION={1}x{2}'.format(bandwidth, width, height))
+        lines.append('{0}p/index.m3u8'.format(height))
+    with open(os.path.join(out_dir, 'master.m3u8'), 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def package(video):
+    """動画をHLSに変換し、マスタープレイリストのファイル名を返す"""
+    try:
+        path = video.upload.path
+    except NotImplementedError:
+        raise PackagingError('ローカルに無いファイルは変換できません')
+    width, height, has_audio = probe(path)
+    renditions = ladder_for(width, height)
+
+    name = 'hls/{0}'.format(video.pk)
+    out_dir = storage.path(name)
+    # 前回の変換の残りを消してから作る
+    shutil.rmtree(out_dir, ignore_errors=True)
+    for _, rendition_height, kbps in renditions:
+        encode(path, os.path.join(out_dir, '{0}p'.format(rendition_height)), rendition_height, kbps, has_audio)
+    write_master(out_dir, renditions, has_audio)
+    return name + '/master.m3u8'
+
+
+def claim_next():
+    """変換待ちの動画を1件変換中にして返す。他のワーカーと取り合わない"""
+    from .models import Video
+
+    for pk in Video.objects.filter(hls_status=Video.HLS_PENDING).order_by('pk').values_list('pk', flat=True)[:10]:
+        if Video.objects.filter(pk=pk, hls_status=Video.HLS_PENDING).update(hls_status=Video.HLS_PROCESSING):
+            return Video.objects.get(pk=pk)
+    return None
+
+
+def process_next():
+    """変換待ちの動画を1件変換する。変換待ちが無ければNone、あれば成功したかを返す"""
+    from .models import Video
+
+    video = claim_next()
+    if video is None:
+        return None
+    try:
+        playlist = package(video)
+    except (PackagingError, OSError, subprocess.TimeoutExpired, ValueError, KeyError):
+        Video.objects.filter(pk=video.pk, hls_status=Video.HLS_PROCESSING).update(
+            hls_status=Video.HLS_FAILED, hls_playlist='', updated_at=timezone.now()
+        )
+        page_cache.invalidate_listings([video.pk])
+        return False
+    # 変換中に動画が差し替えられていたら変換待ちのままにする。
+    # updated_atも変えて、条件付きGET（conditional.py）が新しいプレイヤーを返すようにする
+    Video.objects.filter(pk=video.pk, hls_status=Video.HLS_PROCESSING).update(
+        hls_status=Video.HLS_READY, hls_playlist=playlist, updated_at=timezone.now()
+    )
+    page_cache.invalidate_listings([video.pk])
+    return True
+
+
+def reset_stale():
+    """ワーカーが落ちて変換中のまま残った動画を変換待ちに戻す（package_hls --reset-stale）"""
+    from .models import Video
+
+    return Video.objects.filter(hls_status=Video.HLS_PROCESSING).update(hls_status=Video.HLS_PENDING)
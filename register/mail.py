@@ -0,0 +1,127 @@
+"""メールの送信キュー
+
+ビューではOutgoingMailに登録するだけにして、SMTPとのやり取りは
+send_queued_mailコマンド（ワーカー）で行う。ワーカーはスレッドごとに
+SMTP接続を1本だけ開いてまとめて送信し、失敗したメールは間隔を空けて再送する。
+"""
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import connections, transaction
+from django.utils import timezone
+
+# 何回失敗したら諦めるか
+MAX_ATTEMPTS = getattr(settings, 'MAIL_QUEUE_MAX_ATTEMPTS', 5)
+# 再送までの秒数。失敗するたびに倍にする
+RETRY_BASE_SECONDS = getattr(settings, 'MAIL_QUEUE_RETRY_BASE_SECONDS', 60)
+# 送信中のまま止まったメールを送信待ちに戻すまでの秒数
+SENDING_TIMEOUT_SECONDS = 10 * 60
+
+
+def enqueue_mail(subject, message, recipient_list, from_email=None):
+    """メールを送信キューに登録する"""
+    from .models import OutgoingMail
+
+    return OutgoingMail.objects.create(
+        # 件名に改行が入るとヘッダが壊れるのでsend_mailと同じく取り除く
+        subject=''.join(subject.splitlines()),
+        message=message,
+        from_email=from_email or '',
+        recipients='\n'.join(recipient_list),
+    )
+
+
+def retry_delay(attempts):
+    return timedelta(seconds=RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+
+
+def _claim(batch_size, token):
+    """送信対象をtokenの送信中にして取得する。他のワーカーと同じメールを取り合わない"""
+    from .models import OutgoingMail
+
+    now = timezone.now()
+    # ワーカーが途中で落ちて送信中のまま残ったメールを戻す
+    OutgoingMail.objects.filter(
+        status=OutgoingMail.SENDING, next_attempt_at__lte=now
+    ).update(status=OutgoingMail.QUEUED, claim_token='')
+
+    # 送信中の間はnext_attempt_atを取り戻し期限として使う
+    lease = now + timedelta(seconds=SENDING_TIMEOUT_SECONDS)
+    with transaction.atomic():
+        queryset = OutgoingMail.objects.filter(status=OutgoingMail.QUEUED, next_attempt_at__lte=now)
+        if connections[queryset.db].features.has_select_for_update_skip_locked:
+            # PostgreSQLなどでは他のワーカーが取ったメールを待たずに飛ばす
+            queryset = queryset.select_for_update(skip_locked=True)
+        pks = list(queryset.order_by('next_attempt_at', 'pk').values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return []
+        OutgoingMail.objects.filter(pk__in=pks, status=OutgoingMail.QUEUED).update(
+            status=OutgoingMail.SENDING, next_attempt_at=lease, claim_token=token,
+        )
+    # 同時に取り合ったメールのうち、自分が送信中にしたものだけを送る
+    return list(OutgoingMail.objects.filter(pk__in=pks, status=OutgoingMail.SENDING, claim_token=token))
+
+
+def _send_batch(mails):
+    """1本のSMTP接続でmailsを送信し、[(pk, エラー文字列またはNone)]を返す"""
+    results = []
+    try:
+        connection = get_connection()
+        connection.open()
+    except Exception as e:
+        return [(mail.pk, str(e)) for mail in mails]
+    try:
+        for mail in mails:
+            message = EmailMessage(
+                mail.subject, mail.message, mail.from_email or None,
+                mail.recipients.splitlines(), connection=connection,
+            )
+            try:
+                message.send()
+            except Exception as e:
+                results.append((mail.pk, str(e)))
+            else:
+                results.append((mail.pk, None))
+    finally:
+        connection.close()
+    return results
+
+
+def send_queued(batch_size=100, workers=4):
+    """送信待ちのメールを送り、(送信数, 失敗数)を返す"""
+    from .models import OutgoingMail
+
+    token = uuid.uuid4().hex
+    mails = _claim(batch_size, token)
+    if not mails:
+        return 0, 0
+
+    # スレッドごとに分けて送る。DBの更新はこのスレッドでまとめて行う
+    chunks = [mails[i::workers] for i in range(workers) if mails[i::workers]]
+    with ThreadPoolExecutor(max_workers=len(chunks)) as executor:
+        results = [result for chunk in executor.map(_send_batch, chunks) for result in chunk]
+
+    errors = {pk: error for pk, error in results if error is not None}
+    sent_pks = [pk for pk, error in results if error is None]
+    now = timezone.now()
+    # 送信に時間がかかって期限切れで他のワーカーに取り戻された行は書き換えない
+    claimed = OutgoingMail.objects.filter(status=OutgoingMail.SENDING, claim_token=token)
+    claimed.filter(pk__in=sent_pks).update(
+        status=OutgoingMail.SENT, sent_at=now, last_error='', claim_token='',
+    )
+    for mail in mails:
+        if mail.pk not in errors:
+            continue
+        attempts = mail.attempts + 1
+        if attempts >= MAX_ATTEMPTS:
+            status, next_attempt_at = OutgoingMail.FAILED, mail.next_attempt_at
+        else:
+            status, next_attempt_at = OutgoingMail.QUEUED, now + retry_delay(attempts)
+        claimed.filter(pk=mail.pk).update(
+            attempts=attempts, last_error=errors[mail.pk], status=status,
+            next_attempt_at=next_attempt_at, claim_token='',
+        )
+    return len(sent_pks), len(errors)
@@ -0,0 +1,171 @@
+import json
+import os
+import random
+import tempfile
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from register.models import Lecturer, Subject, Video
+
+User = get_user_model()
+
+SCENARIOS = ('all_videos', 'index', 'play', 'comment', 'upload')
+
+
+def percentile(values, q):
+    """nearest-rank法のパーセンタイル"""
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, int(round(q * len(values) + 0.5)) - 1))]
+
+
+class Command(BaseCommand):
+    help = '主なページに繰り返しリクエストし、スループット・レイテンシ・SQL数をJSONに保存します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenarios', nargs='*', help='{0}から選ぶ。省略すると全て'.format('・'.join(SCENARIOS)))
+        parser.add_argument('--requests', type=int, default=200, help='シナリオごとのリクエスト数')
+        parser.add_argument('--warmup', type=int, default=10, help='計測前に捨てるリクエスト数')
+        parser.add_argument('--write', action='store_true',
+                            help='comment・uploadで実際に投稿する（データが増える）。指定しなければフォームの表示だけ')
+        parser.add_argument('--output', help='結果を保存するJSONファイル（省略時は一時ディレクトリ）')
+        parser.add_argument('--compare', help='比較する前回の結果のJSONファイル')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        unknown = set(options['scenarios']) - set(SCENARIOS)
+        if unknown:
+            raise CommandError('不明なシナリオです: {0}'.format(', '.join(sorted(unknown))))
+        self.rng = random.Random(options['seed'])
+        self.write = options['write']
+        admin = User.objects.filter(is_superuser=True, is_active=True).first()
+        # 動画が一番多いユーザーの一覧を見る
+        owner = User.objects.filter(is_active=True).annotate(videos=Count('video')).order_by('-videos').first()
+        self.video_pks = list(Video.objects.values_list('pk', flat=True))
+        if admin is None or owner is None or not self.video_pks:
+            raise CommandError('スーパーユーザーと動画が必要です（generate_fake_dataで作れます）')
+        self.admin_client = self.make_client(admin)
+        self.owner_client = self.make_client(owner)
+        self.owner = owner
+
+        results = {}
+        for name in options['scenarios'] or SCENARIOS:
+            request = getattr(self, 'request_' + name)
+            for _ in range(options['warmup']):
+                request()
+            results[name] = self.run(request, options['requests'])
+            self.stdout.write('{0:<12} {1[throughput_rps]:>8} req/s  p50 {1[latency_ms][p50]:>8} ms  '
+                              'p99 {1[latency_ms][p99]:>8} ms  SQL {1[queries][mean]:>6}'.format(name, results[name]))
+
+        report = {
+            'created_at': timezone.now().isoformat(),
+            'requests': options['requests'],
+            'write': self.write,
+            'videos': len(self.video_pks),
+            'scenarios': results,
+        }
+        # 省略時はリポジトリを汚さないように一時ディレクトリに書く
+        output = options['output'] or os.path.join(
+            tempfile.gettempdir(), 'benchmark-{0}.json'.format(timezone.now().strftime('%Y%m%d-%H%M%S'))
+        )
+        with open(output, 'w') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        self.stdout.write('結果を{0}に保存しました'.format(output))
+        if options['compare']:
+            self.compare(options['compare'], results)
+
+    def make_client(self, user):
+        # ALLOWED_HOSTSで受け付けられるホスト名にする。空ならDEBUG=Trueで使えるlocalhost
+        host = next((host.lstrip('.') for host in settings.ALLOWED_HOSTS if host != '*'), 'localhost')
+        client = Client(HTTP_HOST=host)
+        client.force_login(user)
+        return client
+
+    def run(self, request, count):
+        latencies = []
+        queries = []
+        statuses = {}
+        started = time.perf_counter()
+        for _ in range(count):
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                status = request()
+                latencies.append((time.perf_counter() - start) * 1000)
+            queries.append(len(captured.captured_queries))
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        elapsed = time.perf_counter() - started
+        return {
+            'throughput_rps': round(count / elapsed, 1),
+            'latency_ms': {
+                'mean': round(sum(latencies) / count, 2),
+                'p50': round(percentile(latencies, 0.5), 2),
+                'p90': round(percentile(latencies, 0.9), 2),
+                'p99': round(percentile(latencies, 0.99), 2),
+                'max': round(max(latencies), 2),
+            },
+            'queries': {
+                'mean': round(sum(queries) / count, 2),
+                'max': max(queries),
+            },
+            'status': statuses,
+        }
+
+    def request_all_videos(self):
+        return self.admin_client.get(reverse('register:all_videos')).status_code
+
+    def request_index(self):
+        return self.owner_client.get(reverse('register:second_index')).status_code
+
+    def request_play(self):
+        pk = self.rng.choice(self.video_pks)
+        return self.owner_client.get(reverse('register:play', kwargs={'pk': pk})).status_code
+
+    def request_comment(self):
+        pk = self.rng.choice(self.video_pks)
+        url = reverse('register:comment', kwargs={'video_pk': pk})
+        if not self.write:
+            return self.owner_client.get(url).status_code
+        lecturer = Lecturer.objects.order_by('?').first()
+        return self.owner_client.post(url, {
+            'title': 'benchmark', 'text': 'benchmark', 'lecturer': lecturer.pk,
+        }).status_code
+
+    def request_upload(self):
+        url = reverse('register:upload')
+        if not self.write:
+            return self.admin_client.get(url).status_code
+        return self.admin_client.post(url, {
+            'title': 'benchmark', 'description': '',
+            'upload': SimpleUploadedFile('benchmark.mp4', b'\x00' * 1024, content_type='video/mp4'),
+            'subject': Subject.objects.order_by('?').values_list('pk', flat=True).first(),
+            'user': self.owner.pk,
+        }).status_code
+
+    def compare(self, path, results):
+        """前回の結果からの変化（%）を表示する"""
+        with open(path) as f:
+            previous = json.load(f)['scenarios']
+        self.stdout.write('{0}との比較'.format(path))
+        for name, result in results.items():
+            if name not in previous:
+                continue
+            changes = []
+            for label, old, new in (
+                ('p50', previous[name]['latency_ms']['p50'], result['latency_ms']['p50']),
+                ('p99', previous[name]['latency_ms']['p99'], result['latency_ms']['p99']),
+                ('SQL', previous[name]['queries']['mean'], result['queries']['mean']),
+            ):
+                change = (new - old) / old * 100 if old else 0
+                changes.append('{0} {1:+.1f}%'.format(label, change))
+            self.stdout.write('{0:<12} {1}'.format(name, '  '.join(changes)))
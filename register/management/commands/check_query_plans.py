@@ -0,0 +1,137 @@
+import re
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.http import urlencode
+
+from register.models import Video
+
+User = get_user_model()
+
+# PostgreSQLの索引を読むノード（逆順に読む場合も含む）
+INDEX_SCAN_RE = re.compile(r'Index (Only )?Scan (Backward )?using ')
+
+# 行数が少なく、全件読んでも問題ない表
+SMALL_TABLES = ('register_subject', 'register_lecturer', 'django_content_type', 'auth_permission')
+
+
+class Command(BaseCommand):
+    help = '主なページのSQLをEXPLAINし、表を全件読むものがあれば失敗します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--allow-table', action='append', default=list(SMALL_TABLES),
+                            help='全件読んでもよい表（複数指定可）')
+        parser.add_argument('--verbose-plans', action='store_true', help='全てのクエリの実行計画を表示する')
+
+    def handle(self, *args, **options):
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            raise CommandError('{0}には対応していません'.format(connection.vendor))
+        self.allowed = set(options['allow_table'])
+        self.verbose_plans = options['verbose_plans']
+
+        admin = User.objects.filter(is_superuser=True, is_active=True).first()
+        owner = User.objects.filter(is_active=True).annotate(videos=Count('video')).order_by('-videos').first()
+        video = Video.objects.filter(user=owner).first() if owner else None
+        if admin is None or video is None:
+            raise CommandError('スーパーユーザーと動画が必要です（generate_fake_dataで作れます）')
+
+        keyword = video.title.split()[0] if video.title.split() else video.title
+        pages = [
+            (admin, reverse('register:all_videos')),
+            (admin, reverse('register:all_videos') + '?' + urlencode({'master_keyword': keyword})),
+            (owner, reverse('register:index')),
+            (owner, reverse('register:second_index')),
+            (owner, reverse('register:second_index') + '?' + urlencode({'keyword': keyword})),
+            (owner, reverse('register:subject', kwargs={'pk': video.subject_id})),
+            (owner, reverse('register:play', kwargs={'pk': video.pk})),
+            (owner, reverse('register:comment', kwargs={'video_pk': video.pk})),
+        ]
+        failures = 0
+        for user, url in pages:
+            failures += self.check_page(user, url)
+        failures += self.check_queries('clean_email', lambda: list(
+            User.objects.filter(email=owner.email, is_active=False).values_list('pk', flat=True)
+        ))
+        if failures:
+            raise CommandError('全件読むクエリが{0}件ありました'.format(failures))
+        self.stdout.write('全件読むクエリはありません')
+
+    def check_page(self, user, url):
+        host = next((host.lstrip('.') for host in settings.ALLOWED_HOSTS if host != '*'), 'localhost')
+        client = Client(HTTP_HOST=host)
+        client.force_login(user)
+        # 1回目はキャッシュを作るための書き込みが入るので、2回目のクエリを調べる
+        client.get(url)
+        return self.check_queries(url, lambda: client.get(url))
+
+    def check_queries(self, label, func):
+        with CaptureQueriesContext(connection) as captured:
+            func()
+        failures = 0
+        for query in captured.captured_queries:
+            sql = query['sql']
+            if not sql.lstrip().upper().startswith('SELECT'):
+                continue
+            plan = self.explain(sql)
+            scans = self.full_scans(plan, sql)
+            if scans or self.verbose_plans:
+                self.stdout.write('{0}\n  {1}\n  {2}'.format(label, sql, '\n  '.join(plan)))
+            for table in scans:
+                self.stdout.write(self.style.ERROR('  全件読み込み: {0}'.format(table)))
+                failures += 1
+        return failures
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                return [row[-1] for row in cursor.fetchall()]
+            # 行数が少ないと索引があっても全件読む計画になるので、索引を使える場合は使わせる
+            cursor.execute('SET enable_seqscan = off')
+            try:
+                cursor.execute('EXPLAIN ' + sql)
+                return [row[0] for row in cursor.fetchall()]
+            finally:
+                cursor.execute('RESET enable_seqscan')
+
+    def full_scans(self, plan, sql):
+        """実行計画から、表や索引を全件読んでいる表の名前を探す
+
+        索引を順に読むだけ（条件で範囲を絞らない）の場合も全件読むのと同じなので失敗にする。
+        ただしLIMITがあり、並べ替えも索引の順で済む場合は、必要な件数を読んだところで止まるので許す
+        （キーセットのページ分割）。
+        """
+        limited = ' LIMIT ' in sql.upper()
+        tables = []
+        if connection.vendor == 'sqlite':
+            # "SCAN t" は全件、"SCAN t USING (COVERING) INDEX i" は索引を全件、"SEARCH t ..." は範囲を絞る
+            bounded = limited and not any('USE TEMP B-TREE' in line for line in plan)
+            for line in plan:
+                words = line.strip().split()
+                if words[:1] != ['SCAN'] or len(words) < 2:
+                    continue
+                table = words[2] if words[1] == 'TABLE' else words[1]
+                if 'USING' not in words or not bounded:
+                    tables.append(table)
+        else:
+            bounded = limited and not any(line.strip().lstrip('->').strip().startswith('Sort') for line in plan)
+            for i, line in enumerate(plan):
+                if 'Seq Scan on' in line:
+                    tables.append(line.split('Seq Scan on', 1)[1].split()[0])
+                elif INDEX_SCAN_RE.search(line):
+                    # ノードの下の行に"Index Cond"が無ければ索引を全件読んでいる
+                    indent = len(line) - len(line.lstrip())
+                    details = []
+                    for detail in plan[i + 1:]:
+                        if detail.strip().startswith('->') or len(detail) - len(detail.lstrip()) <= indent:
+                            break
+                        details.append(detail)
+                    if not bounded and not any('Index Cond' in detail for detail in details):
+                        tables.append(line.split(' on ', 1)[1].split()[0])
+        return [table for table in tables if table not in self.allowed]
@@ -0,0 +1,35 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+
+from register.media_gc import Collector
+
+
+class Command(BaseCommand):
+    help = 'どの動画・コメントからも参照されていないメディアファイルを消します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='消さずに対象を表示する')
+        parser.add_argument('--batch-size', type=int, default=500, help='1回のDB問い合わせで確認するファイル数')
+        parser.add_argument('--min-age-hours', type=float, default=24,
+                            help='これより新しいファイルは消さない（保存中のアップロードを守るため）')
+        parser.add_argument('--limit', type=int, help='1回の実行で消す最大のファイル数')
+
+    def handle(self, *args, **options):
+        collector = Collector(
+            batch_size=options['batch_size'],
+            min_age=timedelta(hours=options['min_age_hours']),
+            dry_run=options['dry_run'],
+            limit=options['limit'],
+            report=self.stdout.write if options['verbosity'] >= 2 or options['dry_run'] else None,
+        )
+        collector.collect_uploads()
+        collector.collect_renditions()
+        collector.collect_hls()
+        collector.collect_upload_sessions()
+
+        self.stdout.write('{0}: {1}件 ({2})'.format(
+            '削除対象' if options['dry_run'] else '削除しました',
+            collector.count, filesizeformat(collector.bytes),
+        ))
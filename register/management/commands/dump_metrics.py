@@ -0,0 +1,33 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from register import metrics
+
+
+class Command(BaseCommand):
+    help = 'ページごとの処理時間・SQL数の集計を表示します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--json', action='store_true', help='JSONで出力する')
+        parser.add_argument('--reset', action='store_true', help='表示した後に集計を消す')
+
+    def handle(self, *args, **options):
+        report = metrics.report()
+        if options['json']:
+            self.stdout.write(json.dumps(report, ensure_ascii=False, indent=2))
+        else:
+            self.stdout.write('サンプリング率: {0}'.format(report['sample_rate']))
+            self.stdout.write('{0:<40} {1:>8} {2:>9} {3:>9} {4:>7} {5:>7} {6:>9} {7:>10}'.format(
+                'URL名', '件数', '時間p50', '時間p99', 'SQL平均', 'SQLp99', '描画p50', 'サイズ平均'
+            ))
+            for view_name, entry in report['views'].items():
+                self.stdout.write('{0:<40} {1:>8} {2:>9} {3:>9} {4:>7} {5:>7} {6:>9} {7:>10}'.format(
+                    view_name, entry['requests'],
+                    entry['wall_ms']['p50'], entry['wall_ms']['p99'],
+                    entry['sql_count']['mean'], entry['sql_count']['p99'],
+                    entry['template_ms']['p50'], int(entry['response_bytes']['mean']),
+                ))
+        if options['reset']:
+            metrics.reset()
+            self.stdout.write('集計を消しました')
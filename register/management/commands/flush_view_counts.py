@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from register import counters
+
+
+class Command(BaseCommand):
+    # LocMemCacheに溜めている場合（memcachedが無い場合）は、各プロセスのスレッドが書き込むので不要
+    help = 'memcachedに溜まっている再生回数をDBへ書き込みます'
+
+    def handle(self, *args, **options):
+        updated = counters.flush()
+        self.stdout.write('{0}件の動画の再生回数を更新しました'.format(updated))
@@ -0,0 +1,176 @@
+import io
+import random
+from collections import Counter
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from PIL import Image
+
+from register.models import Comment, Lecturer, StoredBlob, Subject, Video
+
+User = get_user_model()
+
+SUBJECTS = ('数学', '英語', '物理', '化学', '生物', '現代文', '古文', '日本史', '世界史', '地理')
+TOPICS = ('入門', '基礎', '標準', '応用', '演習', '過去問解説', 'まとめ', '復習', '質問回答', '発展')
+WORDS = ('微分', '積分', '文法', '長文読解', '力学', '電磁気', '有機化学', '遺伝', '評論', '和歌', '鎌倉時代', '産業革命', '気候')
+LECTURERS = ('佐藤', '鈴木', '高橋', '田中', '伊藤', '渡辺', '山本', '中村', '小林', '加藤')
+COMMENTS = (
+    'この問題の解き方がわかりません。', '途中の式変形について質問です。',
+    '解説ありがとうございました。よく理解できました。', '別の解法はありますか？',
+    'ここの説明をもう一度お願いします。',
+)
+
+BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = '負荷試験用に、ユーザー・動画・コメントなどのダミーデータを作ります'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--videos', type=int, default=2000)
+        parser.add_argument('--subjects', type=int, default=len(SUBJECTS))
+        parser.add_argument('--lecturers', type=int, default=len(LECTURERS))
+        parser.add_argument('--comments', type=int, default=5, help='1つの動画あたりの最大コメント数')
+        parser.add_argument('--days', type=int, default=365, help='投稿日を散らばらせる日数')
+        parser.add_argument('--password', default='password', help='作るユーザーのパスワード')
+        parser.add_argument(
+            '--admin-email', default='admin@example.com',
+            help='benchmark・check_query_plansで使う管理者。無ければ--passwordで作る',
+        )
+        parser.add_argument('--media', action='store_true', help='ダミーの動画・サムネイルのファイルも作る')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        with transaction.atomic():
+            subjects = self.create_subjects(options['subjects'])
+            lecturers = self.create_lecturers(options['lecturers'])
+            users = self.create_users(options['users'], options['password'])
+            self.create_admin(options['admin_email'], options['password'])
+            media = self.create_media(rng) if options['media'] else None
+            videos = self.create_videos(rng, options['videos'], users, subjects, options['days'], media)
+            comments = self.create_comments(rng, videos, users, lecturers, options['comments'])
+
+        # bulk_createではシグナルが送られないので、コメント数・検索インデックス・集計をまとめて作る
+        call_command('recount_comments', stdout=self.stdout)
+        call_command('rebuild_search_index', stdout=self.stdout)
+        call_command('rebuild_stats', stdout=self.stdout)
+        self.stdout.write('ユーザー{0}人、動画{1}件、コメント{2}件を作りました'.format(
+            len(users), len(videos), comments
+        ))
+
+    def create_subjects(self, count):
+        names = [SUBJECTS[i % len(SUBJECTS)] + ('' if i < len(SUBJECTS) else str(i)) for i in range(count)]
+        existing = set(Subject.objects.filter(subject__in=names).values_list('subject', flat=True))
+        Subject.objects.bulk_create([Subject(subject=name) for name in names if name not in existing])
+        return list(Subject.objects.filter(subject__in=names))
+
+    def create_lecturers(self, count):
+        rows = [
+            Lecturer(
+                lecture_name='{0}{1}'.format(LECTURERS[i % len(LECTURERS)], i // len(LECTURERS) or ''),
+                lecture_email='lecturer{0}@example.com'.format(i),
+            )
+            for i in range(count)
+        ]
+        existing = set(Lecturer.objects.values_list('lecture_email', flat=True))
+        Lecturer.objects.bulk_create([row for row in rows if row.lecture_email not in existing])
+        return list(Lecturer.objects.filter(lecture_email__in=[row.lecture_email for row in rows]))
+
+    def create_users(self, count, password):
+        # ハッシュの計算は遅いので、全員同じパスワードのハッシュを使い回す
+        hashed = make_password(password)
+        emails = ['user{0}@example.com'.format(i) for i in range(count)]
+        existing = set(User.objects.filter(email__in=emails).values_list('email', flat=True))
+        User.objects.bulk_create(
+            [User(email=email, password=hashed) for email in emails if email not in existing],
+            batch_size=BATCH_SIZE,
+        )
+        return list(User.objects.filter(email__in=emails))
+
+    def create_admin(self, email, password):
+        admin = User.objects.filter(email=email).first()
+        if admin is None:
+            return User.objects.create_superuser(email, password)
+        if not (admin.is_superuser and admin.is_active):
+            raise CommandError('{0}は有効な管理者ではありません。--admin-emailで別のアドレスを指定してください'.format(email))
+        return admin
+
+    def create_media(self, rng):
+        """動画は1つのファイルを共有し、サムネイルは色違いの画像を数枚作る"""
+        upload = default_storage.save('uploads/fake/video.mp4', ContentFile(b'\x00' * 64 * 1024))
+        thumbnails = []
+        for i in range(8):
+            color = tuple(rng.randrange(256) for _ in range(3))
+            buffer = io.BytesIO()
+            Image.new('RGB', (1280, 720), color).save(buffer, 'JPEG')
+            thumbnails.append(
+                default_storage.save('thumbnails/fake_{0}.jpg'.format(i), ContentFile(buffer.getvalue()))
+            )
+        return upload, thumbnails
+
+    def create_videos(self, rng, count, users, subjects, days, media):
+        start = Video.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+        rows = []
+        for i in range(count):
+            subject = rng.choice(subjects)
+            video = Video(
+                title='{0} {1} {2} 第{3}回'.format(subject.subject, rng.choice(WORDS), rng.choice(TOPICS), i + 1),
+                description='{0}の{1}を解説します。'.format(subject.subject, rng.choice(WORDS)),
+                subject=subject,
+                user=rng.choice(users),
+                upload=media[0] if media else 'uploads/fake/video.mp4',
+                count=int(rng.paretovariate(1.2)) * 10,
+            )
+            if media and rng.random() < 0.8:
+                video.thumbnail = rng.choice(media[1])
+            rows.append(video)
+        Video.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+        videos = list(Video.objects.filter(pk__gt=start).order_by('pk'))
+        if media:
+            # 同じファイルを共有しているので、ContentAddressedStorageの参照数を合わせる
+            references = Counter(video.upload.name for video in videos)
+            references.update(video.thumbnail.name for video in videos if video.thumbnail)
+            for name, count in references.items():
+                StoredBlob.objects.filter(name=name).update(refcount=F('refcount') + count - 1)
+
+        # created_atはauto_now_addなので、作った後に投稿日を過去に散らばらせる。
+        # 同じ投稿日時の動画もできるので、一覧のページ分割の確認にもなる
+        now = timezone.now()
+        for offset in range(0, len(videos), 20):
+            created_at = now - timedelta(seconds=rng.randrange(days * 24 * 60 * 60))
+            pks = [video.pk for video in videos[offset:offset + 20]]
+            Video.objects.filter(pk__in=pks).update(created_at=created_at, updated_at=created_at)
+            for video in videos[offset:offset + 20]:
+                video.created_at = created_at
+        return videos
+
+    def create_comments(self, rng, videos, users, lecturers, max_comments):
+        rows = []
+        total = 0
+        for video in videos:
+            # コメントは一部の動画に偏らせる
+            for _ in range(min(int(rng.expovariate(1.5) * max_comments / 2), max_comments)):
+                rows.append(Comment(
+                    title='質問',
+                    text=rng.choice(COMMENTS),
+                    video=video,
+                    user=rng.choice(users),
+                    lecturer=rng.choice(lecturers),
+                    created_at=video.created_at + timedelta(hours=rng.randrange(1, 24 * 7)),
+                ))
+            if len(rows) >= BATCH_SIZE:
+                Comment.objects.bulk_create(rows)
+                total += len(rows)
+                rows = []
+        Comment.objects.bulk_create(rows)
+        return total + len(rows)
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from register import renditions
+
+
+class Command(BaseCommand):
+    help = 'サムネイル・コメント画像の縮小版と、サムネイルの無い動画の1コマを作成します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--loop', action='store_true', help='終了せずに新しいファイルを監視し続ける')
+        parser.add_argument('--interval', type=float, default=30, help='--loopのときの確認間隔（秒）')
+
+    def handle(self, *args, **options):
+        while True:
+            created, failed = renditions.process_pending(options['batch_size'])
+            if created or failed:
+                self.stdout.write('作成: {0}件 失敗: {1}件'.format(created, failed))
+            if not options['loop']:
+                break
+            if created + failed < options['batch_size']:
+                time.sleep(options['interval'])
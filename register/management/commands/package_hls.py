@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from register import hls
+
+
+class Command(BaseCommand):
+    help = '変換待ちの動画をHLS（複数画質）に変換します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='終了せずに変換待ちを監視し続ける')
+        parser.add_argument('--interval', type=float, default=30, help='--loopのときの確認間隔（秒）')
+        parser.add_argument('--reset-stale', action='store_true',
+                            help='変換中のまま残っている動画を変換待ちに戻してから始める')
+
+    def handle(self, *args, **options):
+        if not hls.is_available():
+            raise CommandError('ffmpeg/ffprobeが見つかりません')
+        if options['reset_stale']:
+            self.stdout.write('{0}件を変換待ちに戻しました'.format(hls.reset_stale()))
+        while True:
+            result = hls.process_next()
+            if result is not None:
+                self.stdout.write('変換しました' if result else '変換に失敗しました')
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
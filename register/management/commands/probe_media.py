@@ -0,0 +1,61 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from register import media_info, page_cache
+from register.models import Comment, Video
+
+
+def probe_name(storage, name):
+    try:
+        with storage.open(name, 'rb') as f:
+            return media_info.probe(f, storage.size(name))
+    except OSError:
+        return None
+
+
+class Command(BaseCommand):
+    help = '動画・コメントの動画ファイルのヘッダーを読み、再生時間・解像度などを保存します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='読み込み済みの行も読み直す')
+        parser.add_argument('--workers', type=int, default=4, help='同時にファイルを読む数')
+        parser.add_argument('--batch-size', type=int, default=200)
+
+    def handle(self, *args, **options):
+        # ファイルを読むのはスレッドで並列に行い、DBの更新はこのスレッドでまとめて行う
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            for label, model in (('動画', Video), ('コメント', Comment)):
+                found, probed = self.backfill(model, executor, options['all'], options['batch_size'])
+                self.stdout.write('{0}: {1}件中{2}件読み込みました'.format(label, found, probed))
+
+    def backfill(self, model, executor, everything, batch_size):
+        field, prefix = media_info.TARGETS[model.__name__]
+        storage = model._meta.get_field(field).storage
+        queryset = model.objects.exclude(**{field: ''}).exclude(**{field + '__isnull': True})
+        if not everything:
+            # 読めなかったファイルも次回また試す
+            queryset = queryset.filter(**{prefix + 'codec': ''})
+        found = probed = 0
+        last_pk = 0
+        while True:
+            rows = list(queryset.filter(pk__gt=last_pk).order_by('pk').values_list('pk', field)[:batch_size])
+            if not rows:
+                break
+            last_pk = rows[-1][0]
+            results = executor.map(lambda row: probe_name(storage, row[1]), rows)
+            with transaction.atomic():
+                for (pk, _), info in zip(rows, results):
+                    values = media_info.values(info, prefix)
+                    if model is Video:
+                        # 一覧の条件付きGET（conditional.py）が新しい表示を返すように
+                        values['updated_at'] = timezone.now()
+                    model.objects.filter(pk=pk).update(**values)
+                    probed += info is not None
+            found += len(rows)
+            if model is Video:
+                page_cache.invalidate(*[page_cache.video_scope(pk) for pk, _ in rows])
+                page_cache.invalidate_listings([pk for pk, _ in rows])
+        return found, probed
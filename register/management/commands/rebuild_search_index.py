@@ -0,0 +1,34 @@
+from django.db import transaction
+from django.core.management.base import BaseCommand
+
+from register import search
+from register.models import Video, VideoSearchText, VideoSearchToken
+
+
+class Command(BaseCommand):
+    help = '動画検索用のインデックスを全件作り直します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        videos = Video.objects.select_related('user').order_by('pk')
+        total = 0
+        with transaction.atomic():
+            VideoSearchToken.objects.all().delete()
+            VideoSearchText.objects.all().delete()
+            rows = []
+            texts = []
+            for video in videos.iterator(chunk_size=batch_size):
+                rows.extend(search.build_tokens(video))
+                texts.append(search.build_text(video))
+                total += 1
+                if len(rows) >= batch_size:
+                    VideoSearchToken.objects.bulk_create(rows)
+                    VideoSearchText.objects.bulk_create(texts)
+                    rows = []
+                    texts = []
+            VideoSearchToken.objects.bulk_create(rows)
+            VideoSearchText.objects.bulk_create(texts)
+        self.stdout.write('{0}件の動画をインデックスしました'.format(total))
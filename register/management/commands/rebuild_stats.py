@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from register import stats
+
+
+class Command(BaseCommand):
+    help = '日ごとの集計の動画数・コメント数を数え直します（再生回数はそのまま残します）'
+
+    def handle(self, *args, **options):
+        rows = stats.rebuild()
+        self.stdout.write('{0}件の集計を作り直しました'.format(rows))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from register.models import Comment, Video
+
+
+class Command(BaseCommand):
+    help = '動画のコメント数を実際のコメントから数え直します'
+
+    def handle(self, *args, **options):
+        actual = Coalesce(
+            Subquery(
+                Comment.objects.filter(video=OuterRef('pk')).order_by().values('video')
+                .annotate(total=Count('pk')).values('total'),
+                output_field=IntegerField(),
+            ),
+            Value(0),
+        )
+        # ずれている動画だけを1回のUPDATEで直す
+        updated = Video.objects.annotate(actual_count=actual).exclude(
+            comment_count=F('actual_count')
+        ).update(comment_count=actual)
+        self.stdout.write('{0}件の動画のコメント数を修正しました'.format(updated))
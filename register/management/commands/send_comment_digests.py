@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from register import digest
+
+
+class Command(BaseCommand):
+    help = '溜まっているコメント通知を宛先ごとに1通にまとめて送信キューに入れます'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='まとめる時間を待たずに全て送る')
+        parser.add_argument('--loop', action='store_true', help='終了せずに定期的に確認し続ける')
+        parser.add_argument('--interval', type=float, default=60, help='--loopのときの確認間隔（秒）')
+
+    def handle(self, *args, **options):
+        while True:
+            sent = digest.send_due(force=options['force'])
+            if sent or not options['loop']:
+                self.stdout.write('{0}通のまとめメールを送信キューに入れました'.format(sent))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
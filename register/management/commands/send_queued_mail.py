@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from register import mail
+
+
+class Command(BaseCommand):
+    help = '送信キューに溜まっているメールを送信します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--workers', type=int, default=4, help='送信に使うスレッド数')
+        parser.add_argument('--loop', action='store_true', help='終了せずに送信待ちを監視し続ける')
+        parser.add_argument('--interval', type=float, default=5, help='--loopのときの確認間隔（秒）')
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = mail.send_queued(options['batch_size'], options['workers'])
+            if sent or failed:
+                self.stdout.write('送信: {0}件 失敗: {1}件'.format(sent, failed))
+            if not options['loop']:
+                break
+            if sent + failed < options['batch_size']:
+                # まだ残っている場合は待たずに次のバッチを送る
+                time.sleep(options['interval'])
@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from register import trending
+
+
+class Command(BaseCommand):
+    help = '再生回数・コメント数の増加分から、科目ごとの人気ランキングのスコアを更新します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='終了せずに定期的に更新し続ける')
+        parser.add_argument('--interval', type=float, default=600, help='--loopのときの更新間隔（秒）')
+
+    def handle(self, *args, **options):
+        while True:
+            updated = trending.update()
+            self.stdout.write('{0}件の動画のスコアを更新しました'.format(updated))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
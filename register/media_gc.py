@@ -0,0 +1,249 @@
+"""使われなくなったメディアファイルの削除
+
+動画・コメントを削除したり、フォームでファイルを差し替えたりしたときは、
+トランザクションがコミットされてから古いファイルを消す（signals.py）。
+ロールバックされた場合はファイルも残る。
+
+それ以前に残ってしまったファイルや、処理の途中で落ちて残ったファイルは
+collect_orphaned_mediaコマンドで消す。ディレクトリを少しずつ読みながら、
+batch_size件ごとに参照されているかをDBに問い合わせるので、
+ファイルが何件あってもメモリ使用量は一定。
+"""
+import os
+import shutil
+import time
+import uuid
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+from . import hls, renditions, uploads
+
+# モデルごとのファイルのフィールド
+FILE_FIELDS = {
+    'Video': ('upload', 'thumbnail'),
+    'Comment': ('reply_image1', 'reply_image2', 'reply_image3', 'reply_video'),
+}
+
+# アップロードされたファイルの置き場所（ContentAddressedStorageを使う前のものを含む）
+UPLOAD_TREES = ('uploads/', 'thumbnails/', 'reply_images/', 'reply_videos/', 'cas/')
+
+
+def file_names(instance):
+    """instanceのファイルのフィールドが参照しているファイル名"""
+    names = []
+    for field in FILE_FIELDS[type(instance).__name__]:
+        name = getattr(instance, field).name
+        if name:
+            names.append(name)
+    return names
+
+
+def delete_on_commit(names, storage=default_storage):
+    """コミットされたらnamesを消す（ContentAddressedStorageなら参照を減らす）"""
+    for name in names:
+        transaction.on_commit(lambda name=name: storage.delete(name))
+
+
+def delete_hls_on_commit(video_pk):
+    transaction.on_commit(
+        lambda: shutil.rmtree(hls.storage.path('hls/{0}'.format(video_pk)), ignore_errors=True)
+    )
+
+
+def walk(storage, prefix):
+    """prefix以下のファイルを(名前, 更新時刻, 大きさ)で少しずつ返す"""
+    root = storage.path(prefix)
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            entries = os.scandir(directory)
+        except FileNotFoundError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    stat = entry.stat(follow_symlinks=False)
+                    name = os.path.relpath(entry.path, storage.location).replace(os.sep, '/')
+                    yield name, stat.st_mtime, stat.st_size
+
+
+def batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def referenced_uploads(names):
+    """namesのうち、動画・コメント・完了したアップロードから参照されているもの"""
+    from .models import Comment, UploadSession, Video
+
+    referenced = set()
+    for model in (Video, Comment):
+        for field in FILE_FIELDS[model.__name__]:
+            referenced.update(
+                model.objects.filter(**{field + '__in': names}).values_list(field, flat=True)
+            )
+    referenced.update(UploadSession.objects.filter(file_name__in=names).values_list('file_name', flat=True))
+    return referenced
+
+
+def referenced_renditions(names):
+    from .models import Rendition
+
+    return set(Rendition.objects.filter(name__in=names).values_list('name', flat=True))
+
+
+class Collector:
+    """参照されていないファイルを探して消す
+
+    消したファイルは覚えておかず、件数と合計サイズだけ数える。
+    名前が必要な場合はreportに渡した関数が1件ずつ呼ばれる。
+    """
+
+    def __init__(self, batch_size=500, min_age=timedelta(days=1), dry_run=False, limit=None, report=None):
+        self.batch_size = batch_size
+        # アップロード直後でまだDBに保存されていないファイルを消さないように、新しいファイルは残す
+        self.cutoff = time.time() - min_age.total_seconds()
+        self.session_cutoff = timezone.now() - min_age
+        self.dry_run = dry_run
+        self.limit = limit
+        self.report = report
+        self.count = 0
+        self.bytes = 0
+
+    @property
+    def exhausted(self):
+        return self.limit is not None and self.count >= self.limit
+
+    def _record(self, name, size=0):
+        self.count += 1
+        self.bytes += size
+        if self.report is not None:
+            self.report(name)
+
+    def _remove(self, storage, name, size):
+        if self.exhausted:
+            return
+        self._record(name, size)
+        if not self.dry_run:
+            path = storage.path(name)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                return
+            self._remove_empty_parents(storage, os.path.dirname(path))
+
+    def _remove_empty_parents(self, storage, directory):
+        root = os.path.abspath(storage.location)
+        while os.path.abspath(directory) != root:
+            try:
+                os.rmdir(directory)
+            except OSError:
+                # 空でない
+                return
+            directory = os.path.dirname(directory)
+
+    def collect_tree(self, storage, prefix, referenced):
+        for batch in batches(walk(storage, prefix), self.batch_size):
+            if self.exhausted:
+                return
+            old = [(name, size) for name, mtime, size in batch if mtime < self.cutoff]
+            if not old:
+                continue
+            found = referenced([name for name, _ in old])
+            orphans = [(name, size) for name, size in old if name not in found]
+            if not orphans:
+                continue
+            if prefix == 'cas/' and not self.dry_run:
+                from .models import StoredBlob
+                StoredBlob.objects.filter(name__in=[name for name, _ in orphans]).delete()
+            for name, size in orphans:
+                self._remove(storage, name, size)
+
+    def collect_uploads(self):
+        for prefix in UPLOAD_TREES:
+            self.collect_tree(default_storage, prefix, referenced_uploads)
+
+    def collect_renditions(self):
+        """元のファイルが無くなった縮小版の記録を消してから、記録の無いファイルを消す"""
+        from .models import Rendition
+
+        if not self.dry_run:
+            for batch in batches(Rendition.objects.values_list('source', flat=True).distinct().iterator(),
+                                 self.batch_size):
+                found = referenced_uploads(batch)
+                Rendition.objects.filter(source__in=[source for source in batch if source not in found]).delete()
+        self.collect_tree(renditions.storage, 'renditions/', referenced_renditions)
+
+    def collect_hls(self):
+        """削除された動画のHLSの変換結果を消す"""
+        from .models import Video
+
+        root = hls.storage.path('hls')
+        try:
+            entries = sorted(entry.name for entry in os.scandir(root) if entry.is_dir())
+        except FileNotFoundError:
+            return
+        for batch in batches(entries, self.batch_size):
+            pks = [int(name) for name in batch if name.isdigit()]
+            existing = {str(pk) for pk in Video.objects.filter(pk__in=pks).values_list('pk', flat=True)}
+            for name in batch:
+                if name in existing:
+                    continue
+                for file_name, mtime, size in walk(hls.storage, 'hls/{0}'.format(name)):
+                    self._remove(hls.storage, file_name, size)
+
+    def collect_upload_sessions(self):
+        """min_ageより長く止まっている分割アップロードと、セッションの無い一時ファイルを消す"""
+        from .models import UploadSession
+
+        stale = UploadSession.objects.filter(updated_at__lt=self.session_cutoff)
+        for session in stale.iterator():
+            if self.exhausted:
+                return
+            self._record(uploads.part_path(session))
+            if not self.dry_run:
+                uploads.discard(session)
+
+        try:
+            entries = list(os.scandir(uploads.TEMP_DIR))
+        except FileNotFoundError:
+            return
+        for batch in batches(entries, self.batch_size):
+            ids = [entry.name[:-len('.part')] for entry in batch if entry.name.endswith('.part')]
+            existing = set()
+            for session_id in UploadSession.objects.filter(pk__in=_valid_uuids(ids)).values_list('pk', flat=True):
+                existing.add(str(session_id))
+            for entry in batch:
+                stat = entry.stat()
+                if entry.name[:-len('.part')] in existing or stat.st_mtime >= self.cutoff:
+                    continue
+                if self.exhausted:
+                    return
+                self._record(entry.path, stat.st_size)
+                if not self.dry_run:
+                    try:
+                        os.remove(entry.path)
+                    except FileNotFoundError:
+                        pass
+
+
+def _valid_uuids(values):
+    valid = []
+    for value in values:
+        try:
+            valid.append(uuid.UUID(value))
+        except ValueError:
+            pass
+    return valid
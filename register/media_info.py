@@ -0,0 +1,286 @@
+"""動画ファイルのヘッダーから長さ・解像度・コーデック・ビットレートを読む
+
+ffprobeは使わず、MP4/MOVはボックス、WebM/Matroskaは要素のヘッダーだけを
+seekしながら少しずつ読む。mdatやClusterのような大きな中身は読み飛ばすので、
+ファイルが大きくても数KBしか読まない。
+
+読んだ値は動画・コメントのモデルに保存する（signals.py）ので、一覧などで
+長さを表示するときにファイルを開く必要はない。既存の行はprobe_mediaコマンドで埋める。
+"""
+import struct
+from collections import namedtuple
+
+MediaInfo = namedtuple('MediaInfo', ['duration', 'width', 'height', 'codec', 'bitrate'])
+
+# モデルごとの(ファイルのフィールド, 保存先のフィールド名の接頭辞)
+TARGETS = {
+    'Video': ('upload', ''),
+    'Comment': ('reply_video', 'reply_video_'),
+}
+
+CODECS = {
+    'avc1': 'h264', 'avc3': 'h264', 'V_MPEG4/ISO/AVC': 'h264',
+    'hvc1': 'hevc', 'hev1': 'hevc', 'V_MPEGH/ISO/HEVC': 'hevc',
+    'vp08': 'vp8', 'V_VP8': 'vp8',
+    'vp09': 'vp9', 'V_VP9': 'vp9',
+    'av01': 'av1', 'V_AV1': 'av1',
+    'mp4v': 'mpeg4',
+}
+
+# ファイルの先頭に来るボックス（MOVはftypが無いことがある）
+MP4_FIRST_BOXES = (b'ftyp', b'moov', b'mdat', b'wide', b'free', b'skip', b'pnot')
+
+EBML_HEADER = 0x1A45DFA3
+SEGMENT = 0x18538067
+INFO = 0x1549A966
+TIMECODE_SCALE = 0x2AD7B1
+DURATION = 0x4489
+TRACKS = 0x1654AE6B
+TRACK_ENTRY = 0xAE
+TRACK_TYPE = 0x83
+CODEC_ID = 0x86
+VIDEO = 0xE0
+PIXEL_WIDTH = 0xB0
+PIXEL_HEIGHT = 0xBA
+CLUSTER = 0x1F43B675
+
+
+def probe(f, size):
+    """seekできるファイルfを調べる。対応していない形式や壊れている場合はNone"""
+    f.seek(0)
+    head = f.read(8)
+    try:
+        if head[:4] == struct.pack('>I', EBML_HEADER):
+            info = _probe_matroska(f, size)
+        elif head[4:8] in MP4_FIRST_BOXES:
+            info = _probe_mp4(f, size)
+        else:
+            return None
+    except (struct.error, ValueError, UnicodeDecodeError):
+        return None
+    if info is None:
+        return None
+    duration, width, height, codec = info
+    bitrate = int(size * 8 / duration) if duration else None
+    return MediaInfo(duration, width, height, CODECS.get(codec, codec.lower()), bitrate)
+
+
+def probe_field(fieldfile):
+    """FileFieldの値を調べる。保存前のアップロードされたファイルでもよい"""
+    if not fieldfile:
+        return None
+    if getattr(fieldfile, '_committed', True):
+        try:
+            with fieldfile.storage.open(fieldfile.name, 'rb') as f:
+                return probe(f, fieldfile.size)
+        except OSError:
+            return None
+    # フォームから受け取ったばかりのファイル。この後保存するので閉じない
+    f = fieldfile.file
+    position = f.tell()
+    try:
+        return probe(f, fieldfile.size)
+    finally:
+        f.seek(position)
+
+
+def values(info, prefix=''):
+    """モデルに保存するフィールドの値。infoがNoneなら全て空にする"""
+    info = info or MediaInfo(None, None, None, '', None)
+    return {prefix + key: value for key, value in info._asdict().items()}
+
+
+def apply(instance, info):
+    _, prefix = TARGETS[type(instance).__name__]
+    for key, value in values(info, prefix).items():
+        setattr(instance, key, value)
+
+
+# MP4/MOV
+
+def _boxes(f, start, end):
+    """start〜endにあるボックスを(種類, 中身の開始位置, 終了位置)で返す"""
+    position = start
+    while position + 8 <= end:
+        f.seek(position)
+        size, kind = struct.unpack('>I4s', f.read(8))
+        header_size = 8
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+            header_size = 16
+        elif size == 0:
+            # ファイルの最後まで
+            size = end - position
+        if size < header_size:
+            raise ValueError('ボックスの大きさが正しくありません')
+        yield kind, position + header_size, min(position + size, end)
+        position += size
+
+
+def _read_at(f, position, length):
+    f.seek(position)
+    data = f.read(length)
+    if len(data) < length:
+        raise ValueError('ファイルが途中で終わっています')
+    return data
+
+
+def _probe_mp4(f, size):
+    moov = next(((start, end) for kind, start, end in _boxes(f, 0, size) if kind == b'moov'), None)
+    if moov is None:
+        return None
+    duration = None
+    video = None
+    for kind, start, end in _boxes(f, *moov):
+        if kind == b'mvhd':
+            duration = _read_mvhd(f, start)
+        elif kind == b'trak' and video is None:
+            video = _read_video_trak(f, start, end)
+    if video is None:
+        return None
+    return (duration,) + video
+
+
+def _read_mvhd(f, start):
+    version = _read_at(f, start, 1)[0]
+    if version == 1:
+        timescale, duration = struct.unpack('>IQ', _read_at(f, start + 20, 12))
+    else:
+        timescale, duration = struct.unpack('>II', _read_at(f, start + 12, 8))
+    return duration / timescale if timescale else None
+
+
+def _find(f, start, end, path):
+    """入れ子のボックスをたどる。pathは種類の並び"""
+    for kind, child_start, child_end in _boxes(f, start, end):
+        if kind == path[0]:
+            if len(path) == 1:
+                return child_start, child_end
+            return _find(f, child_start, child_end, path[1:])
+    return None
+
+
+def _read_video_trak(f, start, end):
+    """映像のトラックなら(幅, 高さ, コーデック)"""
+    hdlr = _find(f, start, end, (b'mdia', b'hdlr'))
+    if hdlr is None or _read_at(f, hdlr[0] + 8, 4) != b'vide':
+        return None
+    stsd = _find(f, start, end, (b'mdia', b'minf', b'stbl', b'stsd'))
+    if stsd is None:
+        return None
+    # 最初のサンプルエントリーの種類がコーデック、その中に符号化された大きさがある
+    entry = stsd[0] + 8
+    codec = _read_at(f, entry + 4, 4).decode('latin-1').strip()
+    width, height = struct.unpack('>HH', _read_at(f, entry + 32, 4))
+
+    tkhd = _find(f, start, end, (b'tkhd',))
+    if tkhd is not None:
+        # 表示する大きさ（16.16の固定小数点）
+        offset = 88 if _read_at(f, tkhd[0], 1)[0] == 1 else 76
+        display_width, display_height = struct.unpack('>II', _read_at(f, tkhd[0] + offset, 8))
+        if display_width and display_height:
+            width, height = display_width >> 16, display_height >> 16
+    return width or None, height or None, codec
+
+
+# WebM/Matroska
+
+def _read_vint(f, keep_marker):
+    """EBMLの可変長整数を読む。大きさが不明（全ビットが1）ならNone"""
+    first = f.read(1)
+    if not first:
+        raise ValueError('ファイルが途中で終わっています')
+    first = first[0]
+    if first == 0:
+        raise ValueError('EBMLの整数が正しくありません')
+    length = 9 - first.bit_length()
+    rest = f.read(length - 1)
+    if len(rest) < length - 1:
+        raise ValueError('ファイルが途中で終わっています')
+    value = first if keep_marker else first & ((1 << (8 - length)) - 1)
+    for byte in rest:
+        value = (value << 8) | byte
+    if not keep_marker and value == (1 << (7 * length)) - 1:
+        return None
+    return value
+
+
+def _elements(f, start, end):
+    """start〜endにある要素を(ID, 中身の開始位置, 終了位置)で返す"""
+    position = start
+    while position < end:
+        f.seek(position)
+        element_id = _read_vint(f, keep_marker=True)
+        size = _read_vint(f, keep_marker=False)
+        data_start = f.tell()
+        data_end = end if size is None else min(data_start + size, end)
+        yield element_id, data_start, data_end
+        if size is None:
+            # 大きさが不明な要素の後は読めない
+            return
+        position = data_end
+
+
+def _read_uint(f, start, end):
+    return int.from_bytes(_read_at(f, start, end - start), 'big')
+
+
+def _read_float(f, start, end):
+    data = _read_at(f, start, end - start)
+    return struct.unpack('>f' if len(data) == 4 else '>d', data)[0]
+
+
+def _probe_matroska(f, size):
+    segment = None
+    for element_id, start, end in _elements(f, 0, size):
+        if element_id == SEGMENT:
+            segment = (start, end)
+            break
+    if segment is None:
+        return None
+    duration = None
+    video = None
+    for element_id, start, end in _elements(f, *segment):
+        if element_id == INFO:
+            duration = _read_matroska_info(f, start, end)
+        elif element_id == TRACKS:
+            video = _read_matroska_tracks(f, start, end)
+        elif element_id == CLUSTER:
+            # InfoとTracksはClusterより前にある
+            break
+    if video is None:
+        return None
+    return (duration,) + video
+
+
+def _read_matroska_info(f, start, end):
+    scale = 1000000
+    duration = None
+    for element_id, child_start, child_end in _elements(f, start, end):
+        if element_id == TIMECODE_SCALE:
+            scale = _read_uint(f, child_start, child_end)
+        elif element_id == DURATION:
+            duration = _read_float(f, child_start, child_end)
+    return duration * scale / 1e9 if duration else None
+
+
+def _read_matroska_tracks(f, start, end):
+    for element_id, entry_start, entry_end in _elements(f, start, end):
+        if element_id != TRACK_ENTRY:
+            continue
+        track_type = codec = None
+        width = height = None
+        for child_id, child_start, child_end in _elements(f, entry_start, entry_end):
+            if child_id == TRACK_TYPE:
+                track_type = _read_uint(f, child_start, child_end)
+            elif child_id == CODEC_ID:
+                codec = _read_at(f, child_start, child_end - child_start).rstrip(b'\x00').decode('ascii')
+            elif child_id == VIDEO:
+                for video_id, video_start, video_end in _elements(f, child_start, child_end):
+                    if video_id == PIXEL_WIDTH:
+                        width = _read_uint(f, video_start, video_end)
+                    elif video_id == PIXEL_HEIGHT:
+                        height = _read_uint(f, video_start, video_end)
+        if track_type == 1:
+            return width, height, codec or ''
+    return None
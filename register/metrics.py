@@ -0,0 +1,262 @@
+"""ページごとの処理時間・SQL数などの計測
+
+MetricsMiddlewareがリクエストごとに次の値を測り、URL名ごとのヒストグラムとして
+プロセス内のメモリに集計する。DEBUG=Falseでも使えるように、SQLはconnection.queriesではなく
+execute_wrapperで数える。
+
+* wall_ms: リクエスト全体の処理時間（ミリ秒）
+* sql_count / sql_ms: SQLの数と合計時間
+* template_ms: TemplateResponseの描画時間（render()を使う関数ビューはビューの時間に含まれる）
+* response_bytes: レスポンスの大きさ
+
+集計結果はPUBLISH_INTERVAL秒ごとにキャッシュへ書き出し、スタッフ用のページ（metrics/）と
+dump_metricsコマンドは全プロセスの分を合計して表示する。
+METRICS_SAMPLE_RATEを1より小さくすると、その割合のリクエストだけを測る。
+"""
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+ENABLED = getattr(settings, 'METRICS_ENABLED', True)
+SAMPLE_RATE = getattr(settings, 'METRICS_SAMPLE_RATE', 1.0)
+# 何秒ごとにキャッシュへ書き出すか
+PUBLISH_INTERVAL = getattr(settings, 'METRICS_PUBLISH_INTERVAL', 10)
+
+KEY_PREFIX = 'register:metrics:'
+PROCESSES_KEY = KEY_PREFIX + 'processes'
+RESET_KEY = KEY_PREFIX + 'reset'
+# 止まったプロセスの集計はこの秒数で消える
+PROCESS_TIMEOUT = 60 * 60 * 24
+
+MS_BOUNDS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+COUNT_BOUNDS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+BYTES_BOUNDS = tuple(1024 * 2 ** n for n in range(0, 16, 2))
+
+METRICS = (
+    ('wall_ms', MS_BOUNDS),
+    ('sql_count', COUNT_BOUNDS),
+    ('sql_ms', MS_BOUNDS),
+    ('template_ms', MS_BOUNDS),
+    ('response_bytes', BYTES_BOUNDS),
+)
+
+_lock = threading.Lock()
+_stats = {}
+_process_id = '{0}:{1}'.format(socket.gethostname(), os.getpid())
+_published_at = 0.0
+# 最後に確認したリセットの番号。_UNSETはまだ確認していない
+_UNSET = object()
+_reset_token = _UNSET
+
+
+class Histogram:
+    """上限値の決まったバケットに数えるヒストグラム"""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        index = len(self.bounds)
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                index = i
+                break
+        self.counts[index] += 1
+        self.total += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.total += other.total
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def percentile(self, q):
+        """q（0〜1）の位置の値が入っているバケットの上限"""
+        if not self.total:
+            return 0
+        rank = q * self.total
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return round(min(bound, self.max), 2)
+        return round(self.max, 2)
+
+    def summary(self):
+        return {
+            'mean': round(self.sum / self.total, 2) if self.total else 0,
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'p99': self.percentile(0.99),
+            'max': round(self.max, 2),
+        }
+
+    def to_dict(self):
+        return {'counts': self.counts, 'total': self.total, 'sum': self.sum, 'max': self.max}
+
+    @classmethod
+    def from_dict(cls, bounds, data):
+        histogram = cls(bounds)
+        histogram.counts = list(data['counts'])
+        histogram.total = data['total']
+        histogram.sum = data['sum']
+        histogram.max = data['max']
+        return histogram
+
+
+def _new_entry():
+    return {name: Histogram(bounds) for name, bounds in METRICS}
+
+
+def record(view_name, values):
+    """1リクエスト分の値をview_nameの集計に加える"""
+    with _lock:
+        entry = _stats.setdefault(view_name, _new_entry())
+        for name, value in values.items():
+            entry[name].add(value)
+    if time.monotonic() - _published_at >= PUBLISH_INTERVAL:
+        publish()
+
+
+def _snapshot():
+    with _lock:
+        return {
+            view_name: {name: histogram.to_dict() for name, histogram in entry.items()}
+            for view_name, entry in _stats.items()
+        }
+
+
+def publish():
+    """このプロセスの集計をキャッシュへ書き出す"""
+    global _published_at, _reset_token
+    _published_at = time.monotonic()
+    reset_token = cache.get(RESET_KEY)
+    if reset_token != _reset_token:
+        # 他のプロセスでリセットされた
+        with _lock:
+            if _reset_token is not _UNSET:
+                _stats.clear()
+            _reset_token = reset_token
+    cache.set(KEY_PREFIX + _process_id, _snapshot(), PROCESS_TIMEOUT)
+    processes = cache.get(PROCESSES_KEY, set())
+    if _process_id not in processes:
+        processes.add(_process_id)
+        cache.set(PROCESSES_KEY, processes, PROCESS_TIMEOUT)
+
+
+def collect():
+    """全プロセスの集計を合計して{URL名: {指標: Histogram}}で返す"""
+    processes = cache.get(PROCESSES_KEY, set())
+    found = cache.get_many([KEY_PREFIX + process for process in processes])
+    # このプロセスの分は書き出し前のものを使う
+    found.pop(KEY_PREFIX + _process_id, None)
+    snapshots = list(found.values()) + [_snapshot()]
+
+    merged = {}
+    bounds = dict(METRICS)
+    for snapshot in snapshots:
+        for view_name, entry in snapshot.items():
+            target = merged.setdefault(view_name, _new_entry())
+            for name, data in entry.items():
+                target[name].merge(Histogram.from_dict(bounds[name], data))
+    return merged
+
+
+def report():
+    """URL名ごとの件数と各指標の平均・パーセンタイル"""
+    return {
+        'sample_rate': SAMPLE_RATE,
+        'views': {
+            view_name: dict(
+                requests=entry['wall_ms'].total,
+                **{name: histogram.summary() for name, histogram in entry.items()}
+            )
+            for view_name, entry in sorted(collect().items())
+        },
+    }
+
+
+def reset():
+    """全プロセスの集計を消す"""
+    global _reset_token
+    token = uuid.uuid4().hex
+    cache.set(RESET_KEY, token, timeout=None)
+    processes = cache.get(PROCESSES_KEY, set())
+    cache.delete_many([KEY_PREFIX + process for process in processes] + [PROCESSES_KEY])
+    with _lock:
+        _stats.clear()
+        _reset_token = token
+
+
+class _SqlTimer:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - start
+
+
+class MetricsMiddleware:
+    """URL名ごとに処理時間・SQL・描画時間・レスポンスの大きさを集計する"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not ENABLED or random.random() >= SAMPLE_RATE:
+            return self.get_response(request)
+
+        request._metrics_template_seconds = 0.0
+        sql = _SqlTimer()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(sql))
+            response = self.get_response(request)
+        wall = time.perf_counter() - start
+
+        match = request.resolver_match
+        view_name = (match.view_name or match.func.__name__) if match else '<unresolved>'
+        if response.streaming:
+            size = int(response.get('Content-Length') or 0)
+        else:
+            size = len(response.content)
+        record(view_name, {
+            'wall_ms': wall * 1000,
+            'sql_count': sql.count,
+            'sql_ms': sql.seconds * 1000,
+            'template_ms': request._metrics_template_seconds * 1000,
+            'response_bytes': size,
+        })
+        return response
+
+    def process_template_response(self, request, response):
+        if hasattr(request, '_metrics_template_seconds'):
+            # このフックの直後に描画されるので、描画後のコールバックまでの時間を測る
+            started = time.perf_counter()
+
+            def rendered(response):
+                request._metrics_template_seconds += time.perf_counter() - started
+
+            response.add_post_render_callback(rendered)
+        return response
@@ -0,0 +1,27 @@
+# Generated by Django 3.0.14 on 2026-10-17 02:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('register', '0002_video_keyset_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VideoSearchToken',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=8, verbose_name='トークン')),
+                ('field', models.CharField(max_length=1, verbose_name='フィールド')),
+                ('weight', models.PositiveIntegerField(default=1, verbose_name='重み')),
+                ('video', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to='register.Video')),
+            ],
+            options={
+                'unique_together': {('token', 'field', 'video')},
+            },
+        ),
+    ]
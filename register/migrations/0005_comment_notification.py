@@ -0,0 +1,29 @@
+# Generated by Django 3.0.14 on 2026-10-17 02:07
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('register', '0004_outgoing_mail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CommentNotification',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('recipient', models.EmailField(max_length=254, verbose_name='宛先')),
+                ('site_url', models.CharField(max_length=255, verbose_name='サイトURL')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='作成日')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='送信日時')),
+                ('comment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='register.Comment')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='commentnotification',
+            index=models.Index(fields=['sent_at', 'recipient'], name='commentnotif_pending_idx'),
+        ),
+    ]
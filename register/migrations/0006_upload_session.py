@@ -0,0 +1,31 @@
+# Generated by Django 3.0.14 on 2026-10-17 02:09
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('register', '0005_comment_notification'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('target', models.CharField(choices=[('video', '動画'), ('reply_video', 'コメントの動画')], max_length=20, verbose_name='アップロード先')),
+                ('filename', models.CharField(max_length=255, verbose_name='ファイル名')),
+                ('size', models.BigIntegerField(verbose_name='ファイルサイズ')),
+                ('offset', models.BigIntegerField(default=0, verbose_name='受信済みバイト数')),
+                ('sha256', models.CharField(blank=True, max_length=64, verbose_name='SHA-256')),
+                ('file_name', models.CharField(blank=True, max_length=255, verbose_name='保存先')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='作成日')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新日')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.0.14 on 2026-10-17 02:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('register', '0007_stored_blob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Rendition',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=255, verbose_name='元ファイル')),
+                ('size', models.CharField(max_length=20, verbose_name='サイズ')),
+                ('name', models.CharField(blank=True, max_length=255, verbose_name='ファイル名')),
+                ('width', models.PositiveIntegerField(default=0, verbose_name='幅')),
+                ('height', models.PositiveIntegerField(default=0, verbose_name='高さ')),
+            ],
+            options={
+                'unique_together': {('source', 'size')},
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.0.14 on 2026-10-17 02:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('register', '0008_rendition'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='hls_playlist',
+            field=models.CharField(blank=True, max_length=255, verbose_name='HLSプレイリスト'),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='hls_status',
+            field=models.CharField(choices=[('pending', '変換待ち'), ('processing', '変換中'), ('ready', '変換済み'), ('failed', '変換失敗')], default='pending', max_length=10, verbose_name='HLS変換'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.0.14 on 2026-10-17 02:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('register', '0009_video_hls'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['video', 'created_at'], name='comment_video_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['email', 'is_active'], name='user_email_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='video_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['user', 'subject', '-created_at', '-id'], name='video_user_subject_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['user', 'updated_at', 'comment_count', 'count'], name='video_user_version_idx'),
+        ),
+    ]
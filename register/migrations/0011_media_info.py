@@ -0,0 +1,71 @@
+# Generated by Django 3.0.14 on 2026-10-17 02:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('register', '0010_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='reply_video_bitrate',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='動画のビットレート(bps)'),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='reply_video_codec',
+            field=models.CharField(blank=True, max_length=32, verbose_name='動画のコーデック'),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='reply_video_duration',
+            field=models.FloatField(blank=True, null=True, verbose_name='動画の再生時間(秒)'),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='reply_video_height',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='動画の高さ'),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='reply_video_width',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='動画の幅'),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='bitrate',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='ビットレート(bps)'),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='codec',
+            field=models.CharField(blank=True, max_length=32, verbose_name='コーデック'),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='duration',
+            field=models.FloatField(blank=True, null=True, verbose_name='再生時間(秒)'),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='height',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='高さ'),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='width',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='幅'),
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['user', 'duration'], name='video_user_duration_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['user', 'height'], name='video_user_height_idx'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 3.0.14 on 2026-10-17 02:28
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('register', '0011_media_info'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='completed_count',
+            field=models.IntegerField(default=0, verbose_name='最後まで見た人数'),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='viewer_count',
+            field=models.IntegerField(default=0, verbose_name='視聴者数'),
+        ),
+        migrations.CreateModel(
+            name='WatchProgress',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.FloatField(default=0, verbose_name='視聴位置(秒)')),
+                ('completed', models.BooleanField(default=False, verbose_name='最後まで見た')),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='更新日')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('video', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='register.Video')),
+            ],
+            options={
+                'unique_together': {('user', 'video')},
+            },
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 3.0.14 on 2026-10-17 02:29
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('register', '0012_watch_progress'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VideoTrend',
+            fields=[
+                ('video', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='trend', serialize=False, to='register.Video')),
+                ('score', models.FloatField(default=0, verbose_name='スコア')),
+                ('last_count', models.IntegerField(default=0, verbose_name='前回の再生回数')),
+                ('last_comment_count', models.IntegerField(default=0, verbose_name='前回のコメント数')),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='更新日')),
+                ('subject', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='register.Subject', verbose_name='科目')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='videotrend',
+            index=models.Index(fields=['-score'], name='trend_score_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='videotrend',
+            index=models.Index(fields=['subject', '-score'], name='trend_subject_score_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='videotrend',
+            index=models.Index(fields=['user', '-score'], name='trend_user_score_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='videotrend',
+            index=models.Index(fields=['user', 'subject', '-score'], name='trend_user_subject_score_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.0.14 on 2026-10-17 02:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('register', '0013_video_trend'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyStat',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('user', 'ユーザー'), ('subject', '科目'), ('lecturer', '講師')], max_length=10, verbose_name='集計の単位')),
+                ('key', models.IntegerField(verbose_name='ユーザー・科目・講師のID')),
+                ('date', models.DateField(verbose_name='日付')),
+                ('videos', models.IntegerField(default=0, verbose_name='動画数')),
+                ('views', models.IntegerField(default=0, verbose_name='再生回数')),
+                ('comments', models.IntegerField(default=0, verbose_name='コメント数')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='dailystat',
+            index=models.Index(fields=['kind', 'date'], name='dailystat_kind_date_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='dailystat',
+            unique_together={('kind', 'key', 'date')},
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 3.0.14 on 2026-10-17 02:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('register', '0016_outgoing_mail_claim_token'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='rendition',
+            name='name',
+            field=models.CharField(blank=True, db_index=True, max_length=255, verbose_name='ファイル名'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['reply_image1'], name='comment_reply_image1_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['reply_image2'], name='comment_reply_image2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['reply_image3'], name='comment_reply_image3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['reply_video'], name='comment_reply_video_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['upload'], name='video_upload_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['thumbnail'], name='video_thumbnail_idx'),
+        ),
+    ]
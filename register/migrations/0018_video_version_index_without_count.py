@@ -0,0 +1,21 @@
+# Generated by Django 3.0.14 on 2026-10-17 02:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('register', '0017_media_access_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='video',
+            name='video_user_version_idx',
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['user', 'updated_at', 'comment_count'], name='video_user_version_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.0.14 on 2026-10-17 02:45
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('register', '0018_video_version_index_without_count'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='video',
+            name='video_user_duration_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='video',
+            name='video_user_height_idx',
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.0.14 on 2026-10-17 02:57
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('register', '0019_drop_unused_media_info_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='video',
+            name='video_user_version_idx',
+        ),
+    ]
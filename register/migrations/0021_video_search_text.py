@@ -0,0 +1,45 @@
+# Generated by Django 3.0.14 on 2026-10-17 03:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_search_texts(apps, schema_editor):
+    # 既存の動画は部分一致の確認用テキストが無いと検索にかからなくなるので作っておく
+    from register import search
+
+    Video = apps.get_model('register', 'Video')
+    VideoSearchText = apps.get_model('register', 'VideoSearchText')
+    rows = []
+    for video in Video.objects.select_related('user').iterator():
+        rows.extend(
+            VideoSearchText(video_id=video.pk, field=field, text=search.normalize(text))
+            for field, text in ((search.TITLE, video.title), (search.DESCRIPTION, video.description),
+                                (search.EMAIL, video.user.email))
+        )
+        if len(rows) >= 500:
+            VideoSearchText.objects.bulk_create(rows)
+            rows = []
+    VideoSearchText.objects.bulk_create(rows)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('register', '0020_drop_video_version_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VideoSearchText',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('field', models.CharField(max_length=1, verbose_name='フィールド')),
+                ('text', models.TextField(blank=True, verbose_name='テキスト')),
+                ('video', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_texts', to='register.Video')),
+            ],
+            options={
+                'unique_together': {('video', 'field')},
+            },
+        ),
+        migrations.RunPython(fill_search_texts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.0.14 on 2026-10-17 03:13
+
+import math
+
+from django.db import migrations, models
+
+
+def to_log_score(apps, schema_editor):
+    # 前回の実行時点まで減衰させてあったスコアを、基準時刻に換算した対数にする
+    from register import trending
+
+    VideoTrend = apps.get_model('register', 'VideoTrend')
+    trends = list(VideoTrend.objects.filter(score__gt=0))
+    for trend in trends:
+        trend.score = math.log2(trend.score) + (trend.updated_at - trending.EPOCH) / trending.HALF_LIFE
+    VideoTrend.objects.bulk_update(trends, ['score'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('register', '0021_video_search_text'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='videotrend',
+            name='score',
+            field=models.FloatField(default=0, verbose_name='スコア（対数）'),
+        ),
+        migrations.RunPython(to_log_score, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_search_texts(apps, schema_editor):
+    # 既存の動画は部分一致の確認用テキストが無いと検索にかからなくなるので作っておく
+    from register import search
+
+    Video = apps.get_model('register', 'Video')
+    VideoSearchText = apps.get_model('register', 'VideoSearchText')
+    rows = []
+    for video in Video.objects.select_related('user').iterator():
+        rows.append(VideoSearchText(
+            video_id=video.pk, title=search.normalize(video.title),
+            description=search.normalize(video.description), email=search.normalize(video.user.email),
+        ))
+        if len(rows) >= 500:
+            VideoSearchText.objects.bulk_create(rows)
+            rows = []
+    VideoSearchText.objects.bulk_create(rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('register', '0022_trend_log_score'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='VideoSearchText',
+        ),
+        migrations.CreateModel(
+            name='VideoSearchText',
+            fields=[
+                ('video', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_text', serialize=False, to='register.Video')),
+                ('title', models.TextField(blank=True, verbose_name='タイトル')),
+                ('description', models.TextField(blank=True, verbose_name='説明')),
+                ('email', models.TextField(blank=True, verbose_name='メールアドレス')),
+            ],
+        ),
+        migrations.RunPython(fill_search_texts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.14 on 2026-10-17 03:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('register', '0023_video_search_text_per_video'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='commentnotification',
+            name='claim_token',
+            field=models.CharField(blank=True, max_length=32, verbose_name='送信したワーカー'),
+        ),
+    ]
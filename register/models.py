@@ -1,3 +1,5 @@
+import uuid
+
 from django.contrib.auth.base_user import AbstractBaseUser
 from django.contrib.auth.models import PermissionsMixin, UserManager, User
 from django.core.mail import send_mail
@@ -15,7 +17,42 @@ class Subject(models.Model):
         return self.subject
 
 
+class VideoQuerySet(models.QuerySet):
+    """テンプレートで使う関連オブジェクトをまとめて取得するクエリセット"""
+
+    def for_listing(self):
+        """一覧ページ用。カードに表示する科目とユーザーをJOINで取得する"""
+        return self.select_related('subject', 'user').order_by('-created_at', '-id')
+
+    def for_detail(self):
+        """再生ページ用。コメントはコメント欄のキャッシュが無いときだけ読む（page_cache.py）"""
+        return self.select_related('subject', 'user')
+
+    def viewable_by(self, user):
+        """userが再生できる動画。スーパーユーザーは全て、それ以外は自分の動画だけ
+
+        再生ページ（PlayView）とメディアの配信（sendfile.can_access）で同じ条件を使う。
+        """
+        if not user.is_authenticated:
+            return self.none()
+        if user.is_superuser:
+            return self
+        return self.filter(user=user)
+
+
 class Video(models.Model):
+    # HLS（複数画質のストリーミング）への変換状況。hls.pyで変換する
+    HLS_PENDING = 'pending'
+    HLS_PROCESSING = 'processing'
+    HLS_READY = 'ready'
+    HLS_FAILED = 'failed'
+    HLS_STATUS_CHOICES = (
+        (HLS_PENDING, '変換待ち'),
+        (HLS_PROCESSING, '変換中'),
+        (HLS_READY, '変換済み'),
+        (HLS_FAILED, '変換失敗'),
+    )
+
     title = models.CharField('動画タイトル', max_length=255)
     description = models.TextField('説明(空欄可)', blank=True)
     thumbnail = models.ImageField('サムネイル(空欄可)', upload_to='thumbnails/', null=True, blank=True)
@@ -30,10 +67,62 @@ class Video(models.Model):
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL, on_delete=models.PROTECT
     )
+    hls_status = models.CharField('HLS変換', max_length=10, choices=HLS_STATUS_CHOICES, default=HLS_PENDING)
+    hls_playlist = models.CharField('HLSプレイリスト', max_length=255, blank=True)  # マスタープレイリストのファイル名
+    # ファイルのヘッダーから読んだ情報（media_info.py）
+    duration = models.FloatField('再生時間(秒)', null=True, blank=True)
+    width = models.PositiveIntegerField('幅', null=True, blank=True)
+    height = models.PositiveIntegerField('高さ', null=True, blank=True)
+    codec = models.CharField('コーデック', max_length=32, blank=True)
+    bitrate = models.PositiveIntegerField('ビットレート(bps)', null=True, blank=True)
+    # 視聴位置（progress.py）をDBへ書き込むときに増やす
+    viewer_count = models.IntegerField('視聴者数', default=0)
+    completed_count = models.IntegerField('最後まで見た人数', default=0)
+
+    objects = VideoQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # 一覧のキーセットページ分割（created_at, id の降順）用
+            models.Index(fields=['-created_at', '-id'], name='video_created_id_idx'),
+            # ユーザーごと・ユーザーと科目ごとの一覧（IndexView、SubjectViewなど）
+            models.Index(fields=['user', '-created_at', '-id'], name='video_user_created_idx'),
+            models.Index(fields=['user', 'subject', '-created_at', '-id'], name='video_user_subject_idx'),
+            # メディアファイルのアクセス確認（sendfile.can_access）でファイル名から引く
+            models.Index(fields=['upload'], name='video_upload_idx'),
+            models.Index(fields=['thumbnail'], name='video_thumbnail_idx'),
+        ]
 
     def __str__(self):
         return '{0}{1}{2}'.format(self.title, self.description, self.subject)
 
+    @property
+    def hls_url(self):
+        """変換済みならマスタープレイリストのURL"""
+        if self.hls_status != self.HLS_READY or not self.hls_playlist:
+            return ''
+        from .hls import storage
+        return storage.url(self.hls_playlist)
+
+
+class VideoSearchToken(models.Model):
+    """動画検索用の転置インデックス（search.pyで作成）"""
+    token = models.CharField('トークン', max_length=8)
+    field = models.CharField('フィールド', max_length=1)
+    video = models.ForeignKey(Video, on_delete=models.CASCADE, related_name='search_tokens')
+    weight = models.PositiveIntegerField('重み', default=1)
+
+    class Meta:
+        unique_together = [('token', 'field', 'video')]
+
+
+class VideoSearchText(models.Model):
+    """動画検索で部分一致を確かめるための正規化したテキスト（search.pyで作成）"""
+    video = models.OneToOneField(Video, on_delete=models.CASCADE, primary_key=True, related_name='search_text')
+    title = models.TextField('タイトル', blank=True)
+    description = models.TextField('説明', blank=True)
+    email = models.TextField('メールアドレス', blank=True)
+
 
 class Lecturer(models.Model):
     lecture_name = models.CharField('＜講師＞', max_length=100)
@@ -54,10 +143,131 @@ class Comment(models.Model):
     reply_image2 = models.ImageField('＜画像2を投稿する＞',upload_to='reply_images/', null = True, blank = True)
     reply_image3 = models.ImageField('＜画像3を投稿する＞',upload_to='reply_images/', null = True, blank = True)
     reply_video = models.FileField('＜動画でコメントする＞', upload_to='reply_videos/%Y/%m/%d/', null = True, blank= True )
+    reply_video_duration = models.FloatField('動画の再生時間(秒)', null=True, blank=True)
+    reply_video_width = models.PositiveIntegerField('動画の幅', null=True, blank=True)
+    reply_video_height = models.PositiveIntegerField('動画の高さ', null=True, blank=True)
+    reply_video_codec = models.CharField('動画のコーデック', max_length=32, blank=True)
+    reply_video_bitrate = models.PositiveIntegerField('動画のビットレート(bps)', null=True, blank=True)
     created_at = models.DateTimeField('＜投稿日時＞', default=timezone.now)
     lecturer = models.ForeignKey(
         Lecturer, verbose_name='講師', on_delete=models.PROTECT)
 
+    class Meta:
+        indexes = [
+            # 再生ページのコメント欄（動画ごと、投稿順）
+            models.Index(fields=['video', 'created_at'], name='comment_video_created_idx'),
+            # メディアファイルのアクセス確認（sendfile.can_access）でファイル名から引く
+            models.Index(fields=['reply_image1'], name='comment_reply_image1_idx'),
+            models.Index(fields=['reply_image2'], name='comment_reply_image2_idx'),
+            models.Index(fields=['reply_image3'], name='comment_reply_image3_idx'),
+            models.Index(fields=['reply_video'], name='comment_reply_video_idx'),
+        ]
+
+
+class OutgoingMail(models.Model):
+    """送信待ちのメール（mail.pyのワーカーが送信する）"""
+    QUEUED = 'queued'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (QUEUED, '送信待ち'),
+        (SENDING, '送信中'),
+        (SENT, '送信済み'),
+        (FAILED, '送信失敗'),
+    )
+
+    subject = models.TextField('件名')
+    message = models.TextField('本文')
+    from_email = models.CharField('送信元', max_length=254, blank=True)
+    recipients = models.TextField('宛先')  # 1行に1アドレス
+    status = models.CharField('状態', max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveSmallIntegerField('送信回数', default=0)
+    next_attempt_at = models.DateTimeField('次回送信日時', default=timezone.now)
+    last_error = models.TextField('エラー', blank=True)
+    created_at = models.DateTimeField('作成日', auto_now_add=True)
+    sent_at = models.DateTimeField('送信日時', null=True, blank=True)
+    # 送信中にしたワーカーの目印。送信結果はこの値が一致する行にだけ書き込む
+    claim_token = models.CharField('送信中のワーカー', max_length=32, blank=True)
+
+    class Meta:
+        indexes = [
+            # ワーカーが送信対象を探す条件
+            models.Index(fields=['status', 'next_attempt_at'], name='outgoingmail_due_idx'),
+        ]
+
+    def __str__(self):
+        return '{0} {1}'.format(self.subject, self.get_status_display())
+
+
+class StoredBlob(models.Model):
+    """ContentAddressedStorageに保存したファイルと、それを参照している数"""
+    name = models.CharField('ファイル名', max_length=255, unique=True)
+    size = models.BigIntegerField('ファイルサイズ')
+    refcount = models.PositiveIntegerField('参照数', default=0)
+    created_at = models.DateTimeField('作成日', auto_now_add=True)
+
+    def __str__(self):
+        return '{0} ({1})'.format(self.name, self.refcount)
+
+
+class Rendition(models.Model):
+    """画像を縮小したファイル（renditions.pyで作成）
+
+    sourceはサムネイル・コメント画像のファイル名。サムネイルの無い動画は
+    動画ファイル名をsourceにして、切り出した1コマから作る。
+    作れなかった場合はnameを空にして、何度も作り直さないようにする。
+    """
+    source = models.CharField('元ファイル', max_length=255)
+    size = models.CharField('サイズ', max_length=20)  # 例: 256x144
+    name = models.CharField('ファイル名', max_length=255, blank=True, db_index=True)
+    width = models.PositiveIntegerField('幅', default=0)
+    height = models.PositiveIntegerField('高さ', default=0)
+
+    class Meta:
+        unique_together = [('source', 'size')]
+
+
+class UploadSession(models.Model):
+    """分割アップロードの途中経過（uploads.pyで使う）"""
+    VIDEO = 'video'
+    REPLY_VIDEO = 'reply_video'
+    TARGET_CHOICES = (
+        (VIDEO, '動画'),
+        (REPLY_VIDEO, 'コメントの動画'),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    target = models.CharField('アップロード先', max_length=20, choices=TARGET_CHOICES)
+    filename = models.CharField('ファイル名', max_length=255)
+    size = models.BigIntegerField('ファイルサイズ')
+    offset = models.BigIntegerField('受信済みバイト数', default=0)
+    sha256 = models.CharField('SHA-256', max_length=64, blank=True)
+    file_name = models.CharField('保存先', max_length=255, blank=True)  # 完了後のストレージ上の名前
+    created_at = models.DateTimeField('作成日', auto_now_add=True)
+    updated_at = models.DateTimeField('更新日', auto_now=True)
+
+    @property
+    def is_complete(self):
+        return bool(self.file_name)
+
+
+class CommentNotification(models.Model):
+    """まとめて送るコメント通知（digest.pyで送信）"""
+    recipient = models.EmailField('宛先')
+    comment = models.ForeignKey(Comment, on_delete=models.CASCADE)
+    site_url = models.CharField('サイトURL', max_length=255)  # 例: https://example.com
+    created_at = models.DateTimeField('作成日', auto_now_add=True)
+    sent_at = models.DateTimeField('送信日時', null=True, blank=True)
+    # まとめて送るワーカーが自分の取った通知を見分けるための値（digest.send_due）
+    claim_token = models.CharField('送信したワーカー', max_length=32, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['sent_at', 'recipient'], name='commentnotif_pending_idx'),
+        ]
+
 
 class CustomUserManager(UserManager):
     """ユーザーマネージャー"""
@@ -125,6 +335,10 @@ class User(AbstractBaseUser, PermissionsMixin):
     class Meta:
         verbose_name = _('user')
         verbose_name_plural = _('users')
+        indexes = [
+            # 登録フォームのclean_emailで、仮登録のまま残ったユーザーを探す
+            models.Index(fields=['email', 'is_active'], name='user_email_active_idx'),
+        ]
 
     def get_full_name(self):
         """Return the first_name plus the last_name, with a space in
@@ -142,4 +356,64 @@ class User(AbstractBaseUser, PermissionsMixin):
 
     @property
     def username(self):
-        return self.email
\ No newline at end of file
+        return self.email
+
+
+class WatchProgress(models.Model):
+    """ユーザーごとの動画の視聴位置（progress.pyでまとめて書き込む）"""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    video = models.ForeignKey(Video, on_delete=models.CASCADE)
+    position = models.FloatField('視聴位置(秒)', default=0)
+    completed = models.BooleanField('最後まで見た', default=False)
+    # bulk_updateではauto_nowが効かないので、progress.pyで設定する
+    updated_at = models.DateTimeField('更新日', default=timezone.now)
+
+    class Meta:
+        unique_together = [('user', 'video')]
+
+
+class VideoTrend(models.Model):
+    """動画の時間とともに減衰する人気のスコア（trending.pyで定期的に更新）"""
+    video = models.OneToOneField(Video, on_delete=models.CASCADE, primary_key=True, related_name='trend')
+    # 科目・ユーザーごとのランキングを索引だけで読むため、動画の値を写しておく
+    subject = models.ForeignKey(Subject, verbose_name='科目', on_delete=models.CASCADE)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    # 基準時刻に換算した値の対数（trending.add_points）。0はまだ再生もコメントも無い
+    score = models.FloatField('スコア（対数）', default=0)
+    last_count = models.IntegerField('前回の再生回数', default=0)
+    last_comment_count = models.IntegerField('前回のコメント数', default=0)
+    updated_at = models.DateTimeField('更新日', default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-score'], name='trend_score_idx'),
+            models.Index(fields=['subject', '-score'], name='trend_subject_score_idx'),
+            models.Index(fields=['user', '-score'], name='trend_user_score_idx'),
+            models.Index(fields=['user', 'subject', '-score'], name='trend_user_subject_score_idx'),
+        ]
+
+
+class DailyStat(models.Model):
+    """ユーザー・科目・講師ごと、日ごとの集計（stats.pyで増減する）"""
+    USER = 'user'
+    SUBJECT = 'subject'
+    LECTURER = 'lecturer'
+    KIND_CHOICES = (
+        (USER, 'ユーザー'),
+        (SUBJECT, '科目'),
+        (LECTURER, '講師'),
+    )
+
+    kind = models.CharField('集計の単位', max_length=10, choices=KIND_CHOICES)
+    key = models.IntegerField('ユーザー・科目・講師のID')
+    date = models.DateField('日付')
+    videos = models.IntegerField('動画数', default=0)
+    views = models.IntegerField('再生回数', default=0)
+    comments = models.IntegerField('コメント数', default=0)
+
+    class Meta:
+        unique_together = [('kind', 'key', 'date')]
+        indexes = [
+            # ダッシュボードの期間ごとの集計
+            models.Index(fields=['kind', 'date'], name='dailystat_kind_date_idx'),
+        ]
@@ -0,0 +1,101 @@
+"""一覧・再生ページの描画結果のキャッシュ
+
+動画はめったに変わらないのに、ページを開くたびにカードやコメント欄を
+ORMとテンプレートで作り直していた。一覧のカードとコメント欄をテンプレートの
+{% cache %} で部分的にキャッシュする。
+
+* 一覧はページのカードをまとめて1つのキャッシュにし、一覧のバージョンとURLをキーに含める。
+  カードごとにキャッシュすると、1ページでカードの数だけキャッシュに問い合わせることになる。
+* コメント欄は動画ごとのバージョンをキーに含め、動画・コメントの保存・削除の
+  シグナル（signals.py）と、コメント画像の縮小版の作成（renditions.py）でバージョンを変える。
+* ログインしていないユーザーへの全動画の一覧は人によって変わらないので、
+  レスポンスを丸ごとキャッシュする（get_response・set_response）。
+
+一覧の条件付きGET（conditional.py）も、全動画の一覧とユーザーごとの一覧のバージョンを使う。
+動画・コメントの保存と削除、再生回数の書き込み（counters.py）、縮小版・HLSの作成、
+動画情報の読み取り（probe_media）でinvalidate_listingsを呼んでバージョンを変える。
+"""
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+KEY_PREFIX = 'register:page:'
+TIMEOUT = getattr(settings, 'PAGE_CACHE_TIMEOUT', 300)
+
+# 全動画の一覧（管理者用）に関わるバージョン
+VIDEOS = 'videos'
+
+
+def video_scope(pk):
+    """1つの動画（とそのコメント）に関わるバージョン"""
+    return 'video:{0}'.format(pk)
+
+
+def user_scope(pk):
+    """ユーザーが自分の動画を見る一覧に関わるバージョン"""
+    return 'user:{0}'.format(pk)
+
+
+def _version_key(scope):
+    return '{0}version:{1}'.format(KEY_PREFIX, scope)
+
+
+def get_versions(scopes):
+    """scopesそれぞれの現在のバージョンを1回の問い合わせで返す"""
+    keys = [_version_key(scope) for scope in scopes]
+    found = cache.get_many(keys)
+    versions = []
+    for key in keys:
+        version = found.get(key)
+        if version is None:
+            version = uuid.uuid4().hex
+            if not cache.add(key, version, timeout=None):
+                version = cache.get(key, version)
+        versions.append(version)
+    return versions
+
+
+def get_version(scope):
+    return get_versions([scope])[0]
+
+
+def invalidate(*scopes):
+    """scopesを含むキャッシュを全て使われなくする"""
+    cache.set_many({_version_key(scope): uuid.uuid4().hex for scope in scopes}, timeout=None)
+
+
+def invalidate_listings(video_pks):
+    """video_pksの動画が載っている一覧のバージョンを変える。ユーザーを調べるのに1クエリ使う"""
+    from .models import Video
+
+    if not video_pks:
+        return
+    user_pks = set(Video.objects.filter(pk__in=video_pks).values_list('user_id', flat=True))
+    invalidate(VIDEOS, *[user_scope(pk) for pk in user_pks])
+
+
+def _response_key(request, versions):
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return '{0}response:{1}:{2}'.format(KEY_PREFIX, path, ':'.join(versions))
+
+
+def get_response(request, versions):
+    """versionsの時点でキャッシュされたレスポンス。無ければNone"""
+    cached = cache.get(_response_key(request, versions))
+    if cached is None:
+        return None
+    content, content_type = cached
+    return HttpResponse(content, content_type=content_type)
+
+
+def set_response(request, versions, response):
+    """responseを描画してキャッシュし、描画したresponseを返す"""
+    if hasattr(response, 'render') and callable(response.render):
+        response = response.render()
+    # Cookieを発行するレスポンスは他の人に返せない
+    if response.status_code == 200 and not response.cookies and not response.streaming:
+        cache.set(_response_key(request, versions), (response.content, response['Content-Type']), TIMEOUT)
+    return response
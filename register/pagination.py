@@ -0,0 +1,99 @@
+"""キーセット（カーソル）方式のページ分割
+
+OFFSETを使うと深いページほど読み飛ばす行が増えて遅くなるので、
+直前のページの最後の (created_at, id) より古い行を取得する。
+どのページも1ページ目と同じコストで取得できる。
+"""
+from django.db.models import Q
+from django.http import Http404
+from django.utils.dateparse import parse_datetime
+from django.utils.encoding import force_str
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
+
+CURSOR_PARAM = 'cursor'
+# 検索結果のように関連度で並べる場合のアノテーション名（search.pyで付与）
+RANK_ANNOTATION = 'search_rank'
+
+
+def encode_cursor(obj, ranked=False):
+    """ページ最後の動画からカーソル文字列を作る"""
+    parts = [obj.created_at.isoformat(), str(obj.pk)]
+    if ranked:
+        parts.append(str(getattr(obj, RANK_ANNOTATION)))
+    return urlsafe_base64_encode('|'.join(parts).encode())
+
+
+def decode_cursor(cursor, ranked=False):
+    """カーソル文字列を(created_at, pk, rank)に戻す。不正な値はHttp404"""
+    try:
+        parts = force_str(urlsafe_base64_decode(cursor)).split('|')
+        created_at = parse_datetime(parts[0])
+        pk = int(parts[1])
+        rank = int(parts[2]) if ranked else None
+    except (IndexError, TypeError, ValueError):
+        raise Http404('不正なカーソルです')
+    if created_at is None:
+        raise Http404('不正なカーソルです')
+    return created_at, pk, rank
+
+
+class KeysetPage:
+    """1ページ分の結果。テンプレートではpage_objとして使う"""
+
+    def __init__(self, object_list, has_next, next_cursor, is_first, request):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.next_cursor = next_cursor
+        self.is_first = is_first
+        self.request = request
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def _url_with_cursor(self, cursor):
+        query = self.request.GET.copy()
+        query.pop(CURSOR_PARAM, None)
+        if cursor:
+            query[CURSOR_PARAM] = cursor
+        if not query:
+            return self.request.path
+        return '{0}?{1}'.format(self.request.path, query.urlencode())
+
+    @property
+    def next_url(self):
+        """次のページへのURL（検索条件などのクエリ文字列は引き継ぐ）"""
+        if not self.has_next:
+            return ''
+        return self._url_with_cursor(self.next_cursor)
+
+    @property
+    def first_url(self):
+        return self._url_with_cursor(None)
+
+
+def paginate_keyset(request, queryset, per_page):
+    """querysetを新しい順に並べ、リクエストのカーソルの次からper_page件を返す
+
+    関連度（search_rank）が付いている場合は関連度の高い順を優先する。
+    """
+    cursor = request.GET.get(CURSOR_PARAM)
+    ranked = RANK_ANNOTATION in queryset.query.annotations
+    if ranked:
+        queryset = queryset.order_by('-' + RANK_ANNOTATION, '-created_at', '-id')
+    else:
+        queryset = queryset.order_by('-created_at', '-id')
+    if cursor:
+        created_at, pk, rank = decode_cursor(cursor, ranked)
+        older = Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+        if ranked:
+            older = Q(**{RANK_ANNOTATION + '__lt': rank}) | (Q(**{RANK_ANNOTATION: rank}) & older)
+        queryset = queryset.filter(older)
+    # 1件多く取得して次のページがあるか判定する（COUNTは発行しない）
+    rows = list(queryset[:per_page + 1])
+    has_next = len(rows) > per_page
+    rows = rows[:per_page]
+    next_cursor = encode_cursor(rows[-1], ranked) if has_next else None
+    return KeysetPage(rows, has_next, next_cursor, is_first=not cursor, request=request)
@@ -0,0 +1,167 @@
+"""視聴位置の記録
+
+再生ページのプレイヤーが一定間隔で視聴位置を送ってくる（WatchProgressView）。
+送られるたびにDBへ書き込むのではなく、ユーザーと動画ごとに最新の位置だけを
+counters.pyと同じキャッシュ（settings.CACHESの'counters'）に上書きしておき、
+counters.pyと同じスレッドでWatchProgressへまとめて書き込む。
+書き込む(ユーザー, 動画)の組は受け取ったプロセスが覚えておく。全プロセスで共有する一覧を
+読んで書き戻すと、同時に届いた組が消えてしまうので使わない。
+
+動画ごとの視聴者数・最後まで見た人数はVideoの行に持ち、書き込むときに増やすので、
+集計のためにWatchProgressを数え直す必要はない。
+"""
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import counters
+
+KEY_PREFIX = 'register:progress:'
+LOCK_KEY = KEY_PREFIX + 'lock'
+LOCK_TIMEOUT = 60
+
+# プレイヤーが視聴位置を送る間隔（秒）
+HEARTBEAT_INTERVAL = getattr(settings, 'WATCH_HEARTBEAT_INTERVAL', 15)
+# 動画の長さのこの割合まで見たら最後まで見たとみなす
+COMPLETE_RATIO = getattr(settings, 'WATCH_COMPLETE_RATIO', 0.9)
+# 1回のクエリで書き込む行数
+BATCH_SIZE = 500
+
+_lock = threading.Lock()
+# このプロセスで受け取り、まだ書き込んでいない(ユーザー, 動画)
+_pending = set()
+
+
+def _key(user_pk, video_pk):
+    return '{0}{1}:{2}'.format(KEY_PREFIX, user_pk, video_pk)
+
+
+def record(user_pk, video_pk, position, duration=None, ended=False):
+    """視聴位置をバッファに記録する"""
+    cache = counters.get_cache()
+    key = _key(user_pk, video_pk)
+    previous = cache.get(key)
+    completed = bool(
+        ended
+        or (duration and position >= duration * COMPLETE_RATIO)
+        or (previous and previous['completed'])
+    )
+    cache.set(key, {'position': position, 'completed': completed, 'at': timezone.now()}, timeout=None)
+    with _lock:
+        _pending.add((user_pk, video_pk))
+    counters.ensure_flusher()
+
+
+def get_position(user_pk, video_pk):
+    """最後の視聴位置（秒）。まだDBに書き込まれていない位置を優先する"""
+    entry = counters.get_cache().get(_key(user_pk, video_pk))
+    if entry is not None:
+        return entry['position']
+    from .models import WatchProgress
+
+    return WatchProgress.objects.filter(user_id=user_pk, video_id=video_pk).values_list(
+        'position', flat=True
+    ).first() or 0
+
+
+def resume_position(position, duration):
+    """続きから再生する位置。最後の方まで見ていたら最初から"""
+    if duration and position >= duration * COMPLETE_RATIO:
+        return 0
+    return position
+
+
+def flush():
+    """このプロセスで受け取った視聴位置をDBへまとめて書き込み、書き込んだ行数を返す"""
+    global _pending
+    cache = counters.get_cache()
+    with _lock:
+        pending, _pending = _pending, set()
+    if not pending:
+        return 0
+    # 書き込めなかった組は次回に回す
+    remaining = set(pending)
+    if not cache.add(LOCK_KEY, 1, timeout=LOCK_TIMEOUT):
+        # 他のプロセスがflush中
+        with _lock:
+            _pending |= remaining
+        return 0
+    try:
+        pending = sorted(pending)
+        written = 0
+        for start in range(0, len(pending), BATCH_SIZE):
+            batch = pending[start:start + BATCH_SIZE]
+            written += _flush_batch(cache, batch)
+            remaining.difference_update(batch)
+        return written
+    finally:
+        cache.delete(LOCK_KEY)
+        with _lock:
+            _pending |= remaining
+
+
+def _flush_batch(cache, pairs):
+    from .models import User, Video, WatchProgress
+
+    keys = {pair: _key(*pair) for pair in pairs}
+    found = cache.get_many(keys.values())
+    entries = {pair: found[key] for pair, key in keys.items() if key in found}
+
+    user_pks = {user_pk for user_pk, _ in entries}
+    video_pks = {video_pk for _, video_pk in entries}
+    # バッファに溜まっている間に削除されたユーザー・動画の分は捨てる
+    user_pks &= set(User.objects.filter(pk__in=user_pks).values_list('pk', flat=True))
+    video_pks &= set(Video.objects.filter(pk__in=video_pks).values_list('pk', flat=True))
+    rows = {
+        (row.user_id, row.video_id): row
+        for row in WatchProgress.objects.filter(user_id__in=user_pks, video_id__in=video_pks)
+    }
+
+    created = []
+    updated = []
+    # 動画ごとの(視聴者数, 最後まで見た人数)の増分
+    deltas = defaultdict(lambda: [0, 0])
+    for (user_pk, video_pk), entry in entries.items():
+        if user_pk not in user_pks or video_pk not in video_pks:
+            continue
+        row = rows.get((user_pk, video_pk))
+        if row is None:
+            created.append(WatchProgress(
+                user_id=user_pk, video_id=video_pk, position=entry['position'],
+                completed=entry['completed'], updated_at=entry['at'],
+            ))
+            deltas[video_pk][0] += 1
+            deltas[video_pk][1] += entry['completed']
+        else:
+            if entry['completed'] and not row.completed:
+                row.completed = True
+                deltas[video_pk][1] += 1
+            row.position = entry['position']
+            row.updated_at = entry['at']
+            updated.append(row)
+
+    # 同じ増分の動画はUPDATE 1回にまとめる
+    by_delta = defaultdict(list)
+    for video_pk, delta in deltas.items():
+        by_delta[tuple(delta)].append(video_pk)
+    with transaction.atomic():
+        WatchProgress.objects.bulk_create(created)
+        WatchProgress.objects.bulk_update(updated, ['position', 'completed', 'updated_at'])
+        for (viewers, completions), pks in by_delta.items():
+            if viewers or completions:
+                Video.objects.filter(pk__in=pks).update(
+                    viewer_count=F('viewer_count') + viewers,
+                    completed_count=F('completed_count') + completions,
+                )
+
+    # 書き込み中に新しい位置が届いていなければバッファから消す。届いていれば次回書き込む
+    current = cache.get_many(keys.values())
+    done = {pair for pair, key in keys.items() if current.get(key) == entries.get(pair)}
+    cache.delete_many([keys[pair] for pair in done])
+    with _lock:
+        _pending.update(pair for pair in pairs if pair not in done and keys[pair] in current)
+    return len(created) + len(updated)
@@ -0,0 +1,69 @@
+"""科目・講師などめったに変わらない参照データのキャッシュ
+
+一覧はプロセス内のメモリとキャッシュバックエンドの両方に保持する。
+キャッシュにはバージョン番号だけを別キーで置き、保存・削除のシグナルで
+バージョンを変えることで全プロセスのメモリ上のデータを無効にする。
+"""
+import threading
+import uuid
+
+from django.core.cache import cache
+
+KEY_PREFIX = 'register:reference:'
+# 古いバージョンのデータはこの秒数で消える
+DATA_TIMEOUT = 60 * 60 * 24
+
+_local = {}
+_lock = threading.Lock()
+
+
+def _version_key(name):
+    return '{0}{1}:version'.format(KEY_PREFIX, name)
+
+
+def _data_key(name, version):
+    return '{0}{1}:{2}'.format(KEY_PREFIX, name, version)
+
+
+def get_version(name):
+    """nameの参照データの現在のバージョン。データが変わるとこの値も変わる"""
+    version = cache.get(_version_key(name))
+    if version is None:
+        version = uuid.uuid4().hex
+        if not cache.add(_version_key(name), version, timeout=None):
+            version = cache.get(_version_key(name))
+    return version
+
+
+def _load(name, loader):
+    version = get_version(name)
+    local = _local.get(name)
+    if local is not None and local[0] == version:
+        return local[1]
+
+    objects = cache.get(_data_key(name, version))
+    if objects is None:
+        objects = loader()
+        cache.set(_data_key(name, version), objects, timeout=DATA_TIMEOUT)
+    with _lock:
+        _local[name] = (version, objects)
+    return objects
+
+
+def invalidate(name):
+    """nameの参照データを全プロセスで読み直させる"""
+    cache.set(_version_key(name), uuid.uuid4().hex, timeout=None)
+    with _lock:
+        _local.pop(name, None)
+
+
+def get_subjects():
+    """科目の一覧"""
+    from .models import Subject
+    return _load('subjects', lambda: list(Subject.objects.order_by('pk')))
+
+
+def get_lecturers():
+    """講師の一覧"""
+    from .models import Lecturer
+    return _load('lecturers', lambda: list(Lecturer.objects.order_by('pk')))
@@ -0,0 +1,275 @@
+"""サムネイル・コメント画像の縮小版（レンディション）の作成
+
+一覧のカードに元の画像をそのまま出すと、CSSで小さく表示していても
+画像1枚分を丸ごとダウンロードすることになる。generate_renditionsコマンドで
+RENDITION_SIZESの各サイズの縮小版を前もって作っておき、テンプレートでは
+表示サイズに合う一番小さいものを使う（templatetags/media_tags.py）。
+
+サムネイルの無い動画は、ffmpegで動画から1コマ切り出して縮小版を作る。
+ffmpegがインストールされていない場合は作らない。
+"""
+import hashlib
+import io
+import os
+import shutil
+import subprocess
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.db.models import Q
+from PIL import Image, ImageOps, features
+
+from . import page_cache
+
+# 作る大きさ（幅, 高さ）。縦横比は保ったままこの枠に収める
+SIZES = getattr(settings, 'RENDITION_SIZES', ((256, 144), (512, 288)))
+FORMAT = getattr(settings, 'RENDITION_FORMAT', 'WEBP' if features.check('webp') else 'JPEG')
+QUALITY = 80
+# 動画の何秒目をサムネイルにするか
+POSTER_OFFSET_SECONDS = getattr(settings, 'RENDITION_POSTER_OFFSET_SECONDS', 5)
+FFMPEG = getattr(settings, 'FFMPEG_BINARY', 'ffmpeg')
+
+# 縮小版を作るコメントの画像のフィールド
+COMMENT_IMAGE_FIELDS = ('reply_image1', 'reply_image2', 'reply_image3')
+
+CACHE_PREFIX = 'register:rendition:'
+CACHE_TIMEOUT = 60 * 60 * 24
+
+# 縮小版は元のファイルから何度でも作り直せるので、参照数を数えずに普通に保存する
+storage = FileSystemStorage()
+
+
+def size_key(width, height):
+    return '{0}x{1}'.format(width, height)
+
+
+def rendition_name(source, key):
+    stem = os.path.splitext(source)[0]
+    return 'renditions/{0}_{1}.{2}'.format(stem, key, FORMAT.lower())
+
+
+def _cache_key(source):
+    # 日本語のファイル名でも使えるキーにする
+    return CACHE_PREFIX + hashlib.md5(source.encode()).hexdigest()
+
+
+def get_urls(source):
+    """sourceの縮小版のURLを{'256x144': url}の形で返す"""
+    from .models import Rendition
+
+    if not source:
+        return {}
+    urls = cache.get(_cache_key(source))
+    if urls is None:
+        urls = {
+            rendition.size: storage.url(rendition.name)
+            for rendition in Rendition.objects.filter(source=source).exclude(name='')
+        }
+        cache.set(_cache_key(source), urls, CACHE_TIMEOUT)
+    return urls
+
+
+def get_urls_many(sources):
+    """複数のsourceの縮小版のURLを{source: {'256x144': url}}の形で返す
+
+    まとめて1回のクエリで取得する。呼び出し側（一覧のカード、コメント欄）が描画結果を
+    キャッシュするので、sourceごとのキャッシュは読み書きしない。
+    """
+    from .models import Rendition
+
+    sources = {source for source in sources if source}
+    result = {source: {} for source in sources}
+    if sources:
+        for rendition in Rendition.objects.filter(source__in=sources).exclude(name=''):
+            result[rendition.source][rendition.size] = storage.url(rendition.name)
+    return result
+
+
+def attach(videos):
+    """一覧の動画にサムネイルの縮小版のURLをまとめて付ける（video.rendition_urls）
+
+    付けておくとテンプレートのvideo_thumbnail_urlがカードごとにクエリを発行しない。
+    """
+    videos = list(videos)
+    urls = get_urls_many(_thumbnail_source(video) for video in videos)
+    for video in videos:
+        video.rendition_urls = urls.get(_thumbnail_source(video), {})
+    return videos
+
+
+def attach_comment_images(comments):
+    """コメントの画像の縮小版のURLをまとめて付ける（comment.rendition_urls = {画像: {'256x144': url}}）
+
+    付けておくとテンプレートのrendition_urlが画像ごとにクエリを発行しない。
+    """
+    comments = list(comments)
+    urls = get_urls_many(name for comment in comments for name in _comment_images(comment))
+    for comment in comments:
+        comment.rendition_urls = {name: urls[name] for name in _comment_images(comment)}
+    return comments
+
+
+def _comment_images(comment):
+    return [getattr(comment, field).name for field in COMMENT_IMAGE_FIELDS if getattr(comment, field)]
+
+
+def _thumbnail_source(video):
+    # サムネイルが無ければ動画から切り出した1コマ
+    return video.thumbnail.name or video.upload.name
+
+
+def render(source, image):
+    """imageから各サイズの縮小版を保存する"""
+    from .models import Rendition
+
+    image = ImageOps.exif_transpose(image)
+    if FORMAT == 'JPEG' and image.mode != 'RGB':
+        image = image.convert('RGB')
+    elif image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+
+    for width, height in SIZES:
+        resized = image.copy()
+        resized.thumbnail((width, height), Image.LANCZOS)
+        buffer = io.BytesIO()
+        resized.save(buffer, FORMAT, quality=QUALITY)
+
+        key = size_key(width, height)
+        name = rendition_name(source, key)
+        storage.delete(name)
+        name = storage.save(name, ContentFile(buffer.getvalue()))
+        Rendition.objects.update_or_create(
+            source=source, size=key,
+            defaults={'name': name, 'width': resized.width, 'height': resized.height},
+        )
+    cache.delete(_cache_key(source))
+
+
+def mark_failed(source):
+    """作れなかったsourceを記録し、次回から対象にしない"""
+    from .models import Rendition
+
+    for width, height in SIZES:
+        Rendition.objects.update_or_create(source=source, size=size_key(width, height), defaults={'name': ''})
+    cache.delete(_cache_key(source))
+
+
+def extract_poster(fieldfile):
+    """動画から1コマ切り出してJPEGのバイト列を返す。できなければNone"""
+    if shutil.which(FFMPEG) is None:
+        return None
+    try:
+        path = fieldfile.path
+    except NotImplementedError:
+        return None
+    # 短い動画で指定秒数が無い場合は先頭のコマを使う
+    for offset in (POSTER_OFFSET_SECONDS, 0):
+        try:
+            result = subprocess.run(
+                [FFMPEG, '-v', 'error', '-ss', str(offset), '-i', path,
+                 '-frames:v', '1', '-f', 'image2', '-c:v', 'mjpeg', 'pipe:1'],
+                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=120,
+            )
+        except (OSError, subprocess.TimeoutExpired):
+            return None
+        if result.returncode == 0 and result.stdout:
+            return result.stdout
+    return None
+
+
+def process_image(fieldfile):
+    try:
+        with fieldfile.storage.open(fieldfile.name, 'rb') as f:
+            image = Image.open(f)
+            image.load()
+    except (OSError, ValueError):
+        mark_failed(fieldfile.name)
+        return False
+    render(fieldfile.name, image)
+    return True
+
+
+def process_poster(fieldfile):
+    data = extract_poster(fieldfile)
+    if data is None:
+        mark_failed(fieldfile.name)
+        return False
+    render(fieldfile.name, Image.open(io.BytesIO(data)))
+    return True
+
+
+def pending(limit):
+    """縮小版がまだ無いファイルを(ファイル, 動画からの切り出しか)で返す"""
+    from .models import Comment, Rendition, Video
+
+    done = Rendition.objects.values('source')
+    found = 0
+    no_thumbnail = Q(thumbnail='') | Q(thumbnail__isnull=True)
+    sources = [
+        (Video.objects.exclude(no_thumbnail).exclude(thumbnail__in=done), 'thumbnail', False),
+        (Video.objects.filter(no_thumbnail).exclude(upload__in=done), 'upload', True),
+    ]
+    for field in COMMENT_IMAGE_FIELDS:
+        queryset = Comment.objects.exclude(**{field: ''}).exclude(**{field + '__isnull': True})
+        sources.append((queryset.exclude(**{field + '__in': done}), field, False))
+
+    seen = set()
+    for queryset, field, is_video in sources:
+        for obj in queryset.only(field)[:limit]:
+            fieldfile = getattr(obj, field)
+            # 同じファイルが複数のフィールドから参照されていても1回だけ作る
+            if fieldfile.name in seen:
+                continue
+            seen.add(fieldfile.name)
+            yield fieldfile, is_video
+            found += 1
+            if found >= limit:
+                return
+
+
+def process_pending(limit=100):
+    """縮小版がまだ無いファイルを処理し、(作成数, 失敗数)を返す"""
+    from .models import Comment
+
+    created = failed = 0
+    images = []
+    videos = []
+    for fieldfile, is_video in list(pending(limit)):
+        ok = process_poster(fieldfile) if is_video else process_image(fieldfile)
+        if ok:
+            created += 1
+        else:
+            failed += 1
+        if isinstance(fieldfile.instance, Comment):
+            images.append(fieldfile.name)
+        else:
+            videos.append(fieldfile.name)
+    _invalidate_comments(images)
+    _invalidate_listings(videos)
+    return created, failed
+
+
+def _invalidate_listings(names):
+    """縮小版を作ったサムネイル・動画を使う一覧を作り直させる"""
+    from .models import Video
+
+    if not names:
+        return
+    video_pks = Video.objects.filter(Q(thumbnail__in=names) | Q(upload__in=names)).values_list('pk', flat=True)
+    page_cache.invalidate_listings(list(video_pks))
+
+
+def _invalidate_comments(names):
+    """縮小版を作った画像を使うコメント欄のキャッシュを使われなくする"""
+    from .models import Comment
+
+    if not names:
+        return
+    condition = Q()
+    for field in COMMENT_IMAGE_FIELDS:
+        condition |= Q(**{field + '__in': names})
+    video_pks = set(Comment.objects.filter(condition).values_list('video_id', flat=True))
+    if video_pks:
+        page_cache.invalidate(*[page_cache.video_scope(pk) for pk in video_pks])
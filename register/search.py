@@ -0,0 +1,151 @@
+"""動画のキーワード検索用の転置インデックス
+
+icontainsによる全件スキャンの代わりに、タイトル・説明・アップロードした
+ユーザーのメールアドレスを文字bi-gramに分解してVideoSearchTokenに保存しておく。
+日本語は単語の区切りが無いので、形態素解析ではなくn-gramで分割する。
+
+bi-gramが全て含まれていても語として含まれているとは限らない（「第1回」のbi-gramは
+「第11回」にも含まれる）ので、インデックスで絞り込んだ後、正規化したテキスト
+（VideoSearchText）にキーワードの語が部分文字列として含まれるかも確かめる。
+この確認はインデックスで見つかった行を数える集計の条件にし、テキストは候補の動画ごとに
+主キーで引くので、全ての動画のテキストを読むことはない。
+
+インデックスはシグナル（signals.py）で動画の保存時に更新される。
+作り直す場合は rebuild_search_index コマンドを使う。
+"""
+import re
+import unicodedata
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery, Sum, TextField, Value
+from django.db.models.functions import Concat
+
+from .pagination import RANK_ANNOTATION
+
+# 検索対象のフィールドと関連度の重み
+TITLE = 't'
+DESCRIPTION = 'd'
+EMAIL = 'e'
+FIELD_WEIGHTS = {
+    TITLE: 3,
+    DESCRIPTION: 1,
+    EMAIL: 1,
+}
+
+# VideoSearchTextの列
+TEXT_COLUMNS = {
+    TITLE: 'title',
+    DESCRIPTION: 'description',
+    EMAIL: 'email',
+}
+
+NGRAM_SIZE = 2
+
+WORD_RE = re.compile(r'\w+')
+
+
+def normalize(text):
+    """全角英数字や大文字小文字の違いを吸収する"""
+    return unicodedata.normalize('NFKC', text or '').lower()
+
+
+def tokenize(text):
+    """テキストをbi-gramのリストにする。1文字だけの語はそのまま使う"""
+    tokens = []
+    for word in WORD_RE.findall(normalize(text)):
+        if len(word) <= NGRAM_SIZE:
+            tokens.append(word)
+            continue
+        tokens.extend(word[i:i + NGRAM_SIZE] for i in range(len(word) - NGRAM_SIZE + 1))
+    return tokens
+
+
+def _sources(video):
+    return {
+        TITLE: video.title,
+        DESCRIPTION: video.description,
+        EMAIL: video.user.email,
+    }
+
+
+def build_tokens(video):
+    """動画1件分のVideoSearchTokenを作る（保存はしない）"""
+    from .models import VideoSearchToken
+
+    rows = []
+    for field, text in _sources(video).items():
+        for token, occurrences in Counter(tokenize(text)).items():
+            rows.append(VideoSearchToken(
+                video_id=video.pk, field=field, token=token,
+                weight=occurrences * FIELD_WEIGHTS[field],
+            ))
+    return rows
+
+
+def build_text(video):
+    """動画1件分のVideoSearchTextを作る（保存はしない）"""
+    from .models import VideoSearchText
+
+    return VideoSearchText(video_id=video.pk, **{
+        TEXT_COLUMNS[field]: normalize(text) for field, text in _sources(video).items()
+    })
+
+
+def index_video(video):
+    """動画1件分のインデックスを作り直す"""
+    from .models import VideoSearchText, VideoSearchToken
+
+    with transaction.atomic():
+        VideoSearchToken.objects.filter(video_id=video.pk).delete()
+        VideoSearchToken.objects.bulk_create(build_tokens(video))
+        build_text(video).save()
+
+
+def search(queryset, keyword, fields=(TITLE, DESCRIPTION)):
+    """querysetをキーワードで絞り込み、関連度（search_rank）を付けて返す
+
+    キーワードの全てのbi-gramを含み、キーワードの各語をどれかのフィールドに
+    部分文字列として含む動画だけが残る。
+    インデックスを作れないほど短いキーワードは部分一致で検索する。
+    """
+    from .models import VideoSearchText
+
+    tokens = set(tokenize(keyword))
+    if not tokens or all(len(token) < NGRAM_SIZE for token in tokens):
+        return _search_icontains(queryset, normalize(keyword).strip(), fields)
+
+    # 動画1件ごとに主キーで引く。JOINやEXISTSにすると、PostgreSQLはテキストの表を全件読むことがある
+    parts = []
+    for field in fields:
+        if parts:
+            # 改行は語に含まれないので、フィールドをまたいで一致することはない
+            parts.append(Value('\n'))
+        parts.append(F(TEXT_COLUMNS[field]))
+    text = Concat(*parts, output_field=TextField()) if len(parts) > 1 else parts[0]
+    body = VideoSearchText.objects.filter(video=OuterRef('pk')).values(text=text)[:1]
+    contains_words = Q()
+    for word in set(WORD_RE.findall(normalize(keyword))):
+        contains_words &= Q(search_body__contains=word)
+
+    return queryset.filter(
+        search_tokens__token__in=tokens,
+        search_tokens__field__in=fields,
+    ).annotate(
+        search_body=Subquery(body),
+    ).annotate(
+        matched_tokens=Count('search_tokens__token', distinct=True, filter=contains_words),
+        **{RANK_ANNOTATION: Sum('search_tokens__weight')}
+    ).filter(matched_tokens__gte=len(tokens))
+
+
+def _search_icontains(queryset, keyword, fields):
+    lookups = {
+        TITLE: 'title__icontains',
+        DESCRIPTION: 'description__icontains',
+        EMAIL: 'user__email__icontains',
+    }
+    condition = Q()
+    for field in fields:
+        condition |= Q(**{lookups[field]: keyword})
+    return queryset.filter(condition)
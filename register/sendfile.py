@@ -0,0 +1,127 @@
+"""メディアファイルのアクセス確認と、送信のフロントのWebサーバーへの委譲
+
+動画や画像の中身をPythonのワーカーで送ると、その間ワーカーが1つふさがる。
+ここではアクセスしてよいかだけを確認し、送信はMEDIA_SENDFILE_BACKENDに応じて
+nginx（X-Accel-Redirect）かApache（X-Sendfile）に任せる。
+設定が無い場合はFileResponse（WSGIサーバーのfile_wrapper経由でos.sendfile）で返す。
+
+nginxの設定例::
+
+    location /protected-media/ {
+        internal;
+        alias /path/to/media/;
+    }
+"""
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.db.models import Q
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils.http import http_date
+
+from .streaming import make_etag, not_modified, serve_file
+
+# 'nginx'、'apache'、None のいずれか
+BACKEND = getattr(settings, 'MEDIA_SENDFILE_BACKEND', None)
+# nginxのinternalなlocation
+ACCEL_REDIRECT_PREFIX = getattr(settings, 'MEDIA_ACCEL_REDIRECT_PREFIX', '/protected-media/')
+
+HLS_RE = re.compile(r'^hls/(\d+)/')
+
+REPLY_FIELDS = ('reply_image1', 'reply_image2', 'reply_image3', 'reply_video')
+
+
+def _comments(user):
+    from .models import Comment
+
+    comments = Comment.objects.all()
+    if not user.is_superuser:
+        # 動画の持ち主と、コメントした本人
+        comments = comments.filter(Q(video__user=user) | Q(user=user))
+    return comments
+
+
+def can_access(user, name):
+    """userがメディアファイルnameを見てよいか
+
+    スーパーユーザーは全て、それ以外のユーザーは自分の動画とそのコメント、
+    自分が投稿したコメントのファイルだけ見られる。
+    縮小版やHLSのファイルは元の動画・画像と同じ扱いにする。
+    """
+    from .models import Rendition, Video
+
+    if not user.is_authenticated:
+        return False
+
+    match = HLS_RE.match(name)
+    if match:
+        return Video.objects.viewable_by(user).filter(pk=match.group(1)).exists()
+
+    if name.startswith('renditions/'):
+        source = Rendition.objects.filter(name=name).values_list('source', flat=True).first()
+        if source is None:
+            return False
+        name = source
+
+    if user.is_superuser:
+        return True
+    # 同じ中身のファイルは複数の動画・コメントから参照されることがある
+    if Video.objects.viewable_by(user).filter(Q(upload=name) | Q(thumbnail=name)).exists():
+        return True
+    condition = Q()
+    for field in REPLY_FIELDS:
+        condition |= Q(**{field: name})
+    return _comments(user).filter(condition).exists()
+
+
+def cache_control(name):
+    if name.startswith('cas/'):
+        # 中身のハッシュが名前なので、同じ名前の中身は変わらない
+        return 'private, max-age=31536000, immutable'
+    return 'private, max-age=3600'
+
+
+def send(request, name, storage=default_storage):
+    """nameの送信をフロントのWebサーバーに任せるレスポンスを作る"""
+    try:
+        path = storage.path(name)
+    except SuspiciousFileOperation:
+        raise Http404
+    if not os.path.isfile(path):
+        raise Http404
+
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    if BACKEND == 'nginx':
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = ACCEL_REDIRECT_PREFIX + quote(name)
+    elif BACKEND == 'apache':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = path
+    elif 'HTTP_RANGE' in request.META:
+        # FileResponseはRangeに対応していないので、シーク時は自前で返す
+        response = serve_file(request, _StoredFile(storage, name))
+    else:
+        # serve_fileと同じETag・Last-Modifiedを付け、変わっていなければ304を返す
+        stat = os.stat(path)
+        etag = make_etag(stat.st_size, stat.st_mtime)
+        response = not_modified(request, etag, stat.st_mtime)
+        if response is None:
+            response = FileResponse(open(path, 'rb'), content_type=content_type)
+            response['Accept-Ranges'] = 'bytes'
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Cache-Control'] = cache_control(name)
+    return response
+
+
+class _StoredFile:
+    """serve_fileに渡すための、FieldFileと同じstorage/name属性を持つ入れ物"""
+
+    def __init__(self, storage, name):
+        self.storage = storage
+        self.name = name
@@ -0,0 +1,148 @@
+from django.conf import settings
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import media_gc, media_info, page_cache, reference, search, stats
+from .models import Comment, Lecturer, Subject, Video
+
+
+@receiver(pre_save, sender=Video)
+def reset_hls_status(sender, instance, raw=False, **kwargs):
+    """動画ファイルが差し替えられたらHLSに変換し直す"""
+    if raw or instance.pk is None:
+        return
+    old_upload = Video.objects.filter(pk=instance.pk).values_list('upload', flat=True).first()
+    if old_upload is not None and old_upload != instance.upload.name:
+        instance.hls_status = Video.HLS_PENDING
+        instance.hls_playlist = ''
+
+
+@receiver(post_save, sender=Video)
+def update_search_index(sender, instance, raw=False, **kwargs):
+    """動画が保存されたら検索インデックスを作り直す"""
+    if raw:
+        # loaddata中は関連オブジェクトが揃っていないことがある
+        return
+    search.index_video(instance)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def update_search_index_for_user(sender, instance, raw=False, update_fields=None, **kwargs):
+    """メールアドレスも検索対象なので、ユーザーが更新されたらその動画を作り直す"""
+    if raw or (update_fields is not None and 'email' not in update_fields):
+        # ログイン時のlast_loginだけの更新などは対象外
+        return
+    for video in Video.objects.select_related('user').filter(user=instance):
+        search.index_video(video)
+
+
+@receiver(post_save, sender=Subject)
+@receiver(post_delete, sender=Subject)
+def invalidate_subjects(sender, **kwargs):
+    reference.invalidate('subjects')
+
+
+@receiver(post_save, sender=Lecturer)
+@receiver(post_delete, sender=Lecturer)
+def invalidate_lecturers(sender, **kwargs):
+    reference.invalidate('lecturers')
+
+
+@receiver(post_save, sender=Comment)
+def increment_comment_count(sender, instance, created, raw=False, **kwargs):
+    """コメント数はDB上で増減する。同時にコメントされても数え漏れない"""
+    if raw or not created:
+        return
+    Video.objects.filter(pk=instance.video_id).update(comment_count=F('comment_count') + 1)
+
+
+@receiver(post_delete, sender=Comment)
+def decrement_comment_count(sender, instance, **kwargs):
+    Video.objects.filter(pk=instance.video_id).update(comment_count=F('comment_count') - 1)
+
+
+@receiver(post_save, sender=Video)
+@receiver(post_delete, sender=Video)
+def invalidate_video_pages(sender, instance, **kwargs):
+    page_cache.invalidate(
+        page_cache.VIDEOS, page_cache.user_scope(instance.user_id), page_cache.video_scope(instance.pk)
+    )
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_comment_pages(sender, instance, **kwargs):
+    """コメント欄とコメント数を表示しているページを作り直させる"""
+    page_cache.invalidate(page_cache.video_scope(instance.video_id))
+    page_cache.invalidate_listings([instance.video_id])
+
+
+@receiver(pre_save, sender=Video)
+@receiver(pre_save, sender=Comment)
+def remember_old_files(sender, instance, raw=False, **kwargs):
+    """差し替えられたファイルを保存後に消すため、保存前のファイル名を覚えておく"""
+    instance._old_files = {}
+    if raw or instance.pk is None:
+        return
+    fields = media_gc.FILE_FIELDS[sender.__name__]
+    row = sender.objects.filter(pk=instance.pk).values_list(*fields).first()
+    if row is not None:
+        instance._old_files = dict(zip(fields, row))
+
+
+@receiver(pre_save, sender=Video)
+@receiver(pre_save, sender=Comment)
+def read_media_info(sender, instance, raw=False, **kwargs):
+    """動画ファイルが新しくなったら、ヘッダーから長さ・解像度などを読んで保存する"""
+    if raw:
+        return
+    field, _ = media_info.TARGETS[sender.__name__]
+    fieldfile = getattr(instance, field)
+    if fieldfile.name == getattr(instance, '_old_files', {}).get(field):
+        return
+    media_info.apply(instance, media_info.probe_field(fieldfile))
+
+
+@receiver(post_save, sender=Video)
+@receiver(post_save, sender=Comment)
+def delete_replaced_files(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    current = set(media_gc.file_names(instance))
+    old_files = getattr(instance, '_old_files', {})
+    media_gc.delete_on_commit([name for name in old_files.values() if name and name not in current])
+    instance._old_files = {}
+
+
+@receiver(post_delete, sender=Video)
+@receiver(post_delete, sender=Comment)
+def delete_files(sender, instance, **kwargs):
+    """行の削除がコミットされたらファイルも消す"""
+    media_gc.delete_on_commit(media_gc.file_names(instance))
+    if sender is Video:
+        media_gc.delete_hls_on_commit(instance.pk)
+
+
+@receiver(post_save, sender=Video)
+def count_video(sender, instance, created, raw=False, **kwargs):
+    if raw or not created:
+        return
+    stats.add_video(instance, 1)
+
+
+@receiver(post_delete, sender=Video)
+def uncount_video(sender, instance, **kwargs):
+    stats.add_video(instance, -1)
+
+
+@receiver(post_save, sender=Comment)
+def count_comment(sender, instance, created, raw=False, **kwargs):
+    if raw or not created:
+        return
+    stats.add_comment(instance, 1)
+
+
+@receiver(post_delete, sender=Comment)
+def uncount_comment(sender, instance, **kwargs):
+    stats.add_comment(instance, -1)
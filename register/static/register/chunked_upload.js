@@ -0,0 +1,85 @@
+// 分割アップロード
+// data-chunked-upload が付いたファイル欄は、フォーム送信前にチャンクに分けて
+// 先にサーバーへ送り、フォームにはupload_session（アップロードのID）だけを送る。
+// 通信が切れてもサーバーが受け取ったところから送り直す。
+(function () {
+    var MAX_RETRIES = 5;
+
+    function sleep(ms) {
+        return new Promise(function (resolve) { setTimeout(resolve, ms); });
+    }
+
+    async function uploadFile(form, input, progress) {
+        var file = input.files[0];
+        var headers = {'X-CSRFToken': form.querySelector('[name=csrfmiddlewaretoken]').value};
+        var data = new FormData();
+        data.append('target', input.dataset.chunkedUpload);
+        data.append('filename', file.name);
+        data.append('size', file.size);
+
+        var response = await fetch(form.dataset.uploadSessionUrl, {
+            method: 'POST', body: data, headers: headers, credentials: 'same-origin'
+        });
+        var session = await response.json();
+        if (!response.ok) {
+            throw new Error(session.error);
+        }
+
+        var retries = 0;
+        while (!session.complete) {
+            var end = Math.min(session.offset + session.chunk_size, file.size);
+            response = await fetch(session.url, {
+                method: 'PUT',
+                body: file.slice(session.offset, end),
+                headers: Object.assign({'Content-Range': 'bytes ' + session.offset + '-' + (end - 1) + '/' + file.size}, headers),
+                credentials: 'same-origin'
+            }).catch(function () { return null; });
+
+            if (response && (response.ok || response.status === 409)) {
+                // 409のときもサーバーの受信済み位置が返ってくるので、そこから続ける
+                session = await response.json();
+                retries = 0;
+                progress(session.offset / file.size);
+                continue;
+            }
+            if (++retries > MAX_RETRIES) {
+                throw new Error('アップロードに失敗しました。もう一度お試しください。');
+            }
+            await sleep(1000 * Math.pow(2, retries));
+            response = await fetch(session.url, {credentials: 'same-origin'}).catch(function () { return null; });
+            if (response && response.ok) {
+                session = await response.json();
+            }
+        }
+        return session.id;
+    }
+
+    document.querySelectorAll('form[data-upload-session-url]').forEach(function (form) {
+        var inputs = form.querySelectorAll('input[type=file][data-chunked-upload]');
+        var button = form.querySelector('[type=submit]');
+        var label = button.textContent;
+
+        form.addEventListener('submit', async function (event) {
+            var pending = Array.prototype.filter.call(inputs, function (input) { return input.files.length; });
+            if (!pending.length) {
+                return;
+            }
+            event.preventDefault();
+            button.disabled = true;
+            try {
+                for (var i = 0; i < pending.length; i++) {
+                    form.querySelector('[name=upload_session]').value = await uploadFile(form, pending[i], function (ratio) {
+                        button.textContent = 'アップロード中 ' + Math.floor(ratio * 100) + '%';
+                    });
+                    // ファイル本体はもう送ったのでフォームからは外す
+                    pending[i].value = '';
+                }
+                form.submit();
+            } catch (e) {
+                alert(e.message);
+                button.disabled = false;
+                button.textContent = label;
+            }
+        });
+    });
+})();
@@ -0,0 +1,132 @@
+"""ユーザー・科目・講師ごとの日ごとの集計
+
+動画・コメントの保存と削除（signals.py）、再生回数の書き込み（counters.flush）のたびに
+DailyStatの該当する行を増減する。スタッフ用のダッシュボードはDailyStatだけを読むので、
+動画やコメントが何件あっても読む行数は「対象の数×日数」で済む。
+
+数え方:
+- 動画数: 動画の投稿日に、持ち主のユーザーと科目で数える
+- コメント数: コメントの投稿日に、書いたユーザー・動画の科目・講師で数える
+- 再生回数: DBへ書き込んだ日に、動画の持ち主のユーザーと科目で数える
+
+動画の科目や持ち主を後から変えた場合は、rebuild_statsコマンドで数え直す。
+"""
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+FIELDS = ('videos', 'views', 'comments')
+# ダッシュボードに表示する対象の数
+TOP = 20
+
+
+def video_keys(user_pk, subject_pk):
+    return [('user', user_pk), ('subject', subject_pk)]
+
+
+def comment_keys(comment, subject_pk):
+    keys = [('subject', subject_pk), ('lecturer', comment.lecturer_id)]
+    if comment.user_id is not None:
+        keys.append(('user', comment.user_id))
+    return keys
+
+
+def add(date, changes):
+    """changes（{(kind, key): {フィールド: 増減}}）をdateの行に加える"""
+    from .models import DailyStat
+
+    for (kind, key), amounts in changes.items():
+        amounts = {field: amount for field, amount in amounts.items() if amount}
+        if not amounts:
+            continue
+        rows = DailyStat.objects.filter(kind=kind, key=key, date=date)
+        updates = {field: F(field) + amount for field, amount in amounts.items()}
+        if rows.update(**updates) or all(amount < 0 for amount in amounts.values()):
+            # 集計を始める前の動画・コメントの削除では行を作らない
+            continue
+        try:
+            with transaction.atomic():
+                DailyStat.objects.create(kind=kind, key=key, date=date, **amounts)
+        except IntegrityError:
+            # 同時に作られた
+            rows.update(**updates)
+
+
+def add_video(video, amount):
+    add(timezone.localdate(video.created_at), {
+        key: {'videos': amount} for key in video_keys(video.user_id, video.subject_id)
+    })
+
+
+def add_comment(comment, amount):
+    from .models import Video
+
+    subject_pk = Video.objects.filter(pk=comment.video_id).values_list('subject_id', flat=True).first()
+    if subject_pk is None:
+        # 動画ごと削除された
+        keys = [key for key in comment_keys(comment, None) if key[0] != 'subject']
+    else:
+        keys = comment_keys(comment, subject_pk)
+    add(timezone.localdate(comment.created_at), {key: {'comments': amount} for key in keys})
+
+
+def add_views(amounts):
+    """counters.flushで書き込んだ再生回数（{動画のID: 回数}）を今日の行に加える"""
+    from .models import Video
+
+    changes = defaultdict(lambda: defaultdict(int))
+    rows = Video.objects.filter(pk__in=list(amounts)).values_list('pk', 'user_id', 'subject_id')
+    for video_pk, user_pk, subject_pk in rows:
+        for key in video_keys(user_pk, subject_pk):
+            changes[key]['views'] += amounts[video_pk]
+    add(timezone.localdate(), changes)
+
+
+def rebuild():
+    """動画数・コメント数を数え直す。再生回数は日ごとの元データが無いので今の値を残す"""
+    from .models import Comment, DailyStat, Video
+
+    totals = defaultdict(lambda: defaultdict(int))
+    videos = Video.objects.annotate(date=TruncDate('created_at')).values('date', 'user_id', 'subject_id')
+    for row in videos.annotate(n=Count('pk')).order_by():
+        for key in video_keys(row['user_id'], row['subject_id']):
+            totals[key + (row['date'],)]['videos'] += row['n']
+    for kind, field in (('user', 'user_id'), ('subject', 'video__subject_id'), ('lecturer', 'lecturer_id')):
+        comments = Comment.objects.annotate(date=TruncDate('created_at')).exclude(**{field: None})
+        for row in comments.values('date', field).annotate(n=Count('pk')).order_by():
+            totals[(kind, row[field], row['date'])]['comments'] += row['n']
+
+    with transaction.atomic():
+        existing = {(row.kind, row.key, row.date): row for row in DailyStat.objects.all()}
+        created = []
+        for key, values in totals.items():
+            row = existing.get(key)
+            if row is None:
+                created.append(DailyStat(kind=key[0], key=key[1], date=key[2], **values))
+        for key, row in existing.items():
+            row.videos = totals.get(key, {}).get('videos', 0)
+            row.comments = totals.get(key, {}).get('comments', 0)
+        DailyStat.objects.bulk_create(created, batch_size=500)
+        DailyStat.objects.bulk_update(list(existing.values()), ['videos', 'comments'], batch_size=500)
+        DailyStat.objects.filter(videos=0, views=0, comments=0).delete()
+    return len(totals)
+
+
+def summary(since):
+    """since以降の集計。ダッシュボードで使う"""
+    from .models import DailyStat
+
+    rows = DailyStat.objects.filter(date__gte=since)
+    sums = {field + '_total': Sum(field) for field in FIELDS}
+    by_kind = {}
+    for kind, _ in DailyStat.KIND_CHOICES:
+        by_kind[kind] = list(
+            rows.filter(kind=kind).values('key').annotate(**sums)
+            .order_by('-views_total', '-comments_total', '-videos_total')[:TOP]
+        )
+    # 動画・再生・コメントは必ず1つの科目に数えるので、科目の合計が全体の合計になる
+    days = list(rows.filter(kind='subject').values('date').annotate(**sums).order_by('date'))
+    return by_kind, days
@@ -0,0 +1,94 @@
+"""中身のハッシュでファイル名を決めるストレージ
+
+同じ動画や画像が何度アップロードされても（Video.upload、Video.thumbnail、
+Comment.reply_image1〜3、reply_videoのどれでも）、ディスク上には1つだけ保存する。
+ファイル名は cas/ab/cd/<SHA-256><拡張子> のように2階層に分けて置く。
+
+同じファイルを何件のフィールドが参照しているかをStoredBlobで数え、
+delete()では参照が無くなったときだけ実際にファイルを消す。
+"""
+import hashlib
+import os
+
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+PREFIX = 'cas/'
+
+
+def hashed_name(digest, original_name):
+    """SHA-256と元のファイル名から保存先の名前を作る"""
+    ext = os.path.splitext(original_name)[1].lower()
+    return '{0}{1}/{2}/{3}{4}'.format(PREFIX, digest[:2], digest[2:4], digest, ext)
+
+
+class ContentAddressedStorage(FileSystemStorage):
+
+    def get_available_name(self, name, max_length=None):
+        # 保存先は_saveで中身から決めるので、ここでは名前を変えない
+        if name.startswith(PREFIX):
+            return super().get_available_name(name, max_length)
+        return name
+
+    def _save(self, name, content):
+        hasher = hashlib.sha256()
+        for chunk in content.chunks():
+            hasher.update(chunk)
+        cas_name = hashed_name(hasher.hexdigest(), name)
+
+        with transaction.atomic():
+            if self._add_reference(cas_name):
+                # 同じ中身のファイルがもうあるので書き込まない
+                return cas_name
+            if not self.exists(cas_name):
+                cas_name = super()._save(cas_name, content)
+            self._create_blob(cas_name)
+        return cas_name
+
+    def adopt(self, path, original_name, sha256):
+        """ハッシュ計算済みのローカルファイルを、読み直さずに取り込む（uploads.py用）"""
+        cas_name = hashed_name(sha256, original_name)
+        with transaction.atomic():
+            if self._add_reference(cas_name):
+                os.remove(path)
+                return cas_name
+            full_path = self.path(cas_name)
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            file_move_safe(path, full_path, allow_overwrite=True)
+            if self.file_permissions_mode is not None:
+                os.chmod(full_path, self.file_permissions_mode)
+            self._create_blob(cas_name)
+        return cas_name
+
+    def delete(self, name):
+        """参照を1つ減らし、誰も参照しなくなったらファイルを消す"""
+        from .models import StoredBlob
+
+        if not name.startswith(PREFIX):
+            # このストレージを使う前に保存されたファイル
+            return super().delete(name)
+        with transaction.atomic():
+            blob = StoredBlob.objects.select_for_update().filter(name=name).first()
+            if blob is not None and blob.refcount > 1:
+                StoredBlob.objects.filter(pk=blob.pk).update(refcount=F('refcount') - 1)
+                return
+            if blob is not None:
+                blob.delete()
+            super().delete(name)
+
+    def _add_reference(self, name):
+        from .models import StoredBlob
+
+        return StoredBlob.objects.filter(name=name).update(refcount=F('refcount') + 1) > 0
+
+    def _create_blob(self, name):
+        from .models import StoredBlob
+
+        try:
+            with transaction.atomic():
+                StoredBlob.objects.create(name=name, size=self.size(name), refcount=1)
+        except IntegrityError:
+            # 同時に同じファイルが保存された
+            self._add_reference(name)
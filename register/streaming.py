@@ -0,0 +1,145 @@
+"""動画ファイルのバイト単位配信（HTTP Range対応）
+
+シークするたびにファイルを頭から送り直さないように、Range/If-Rangeを解釈して
+206 Partial Contentで必要な範囲だけを返す。
+"""
+import mimetypes
+import mmap
+import re
+
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import http_date, parse_http_date_safe
+
+# 1回のreadで送るバイト数
+CHUNK_SIZE = 64 * 1024
+
+RANGE_RE = re.compile(r'^\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*$')
+
+
+def make_etag(size, mtime):
+    """ファイルサイズと更新時刻から強いETagを作る"""
+    return '"{0:x}-{1:x}"'.format(size, int(mtime))
+
+
+def parse_range(header, size):
+    """Rangeヘッダを(start, end)に変換する。endは末尾を含む。
+
+    複数範囲の指定や解釈できない値はNoneを返し、呼び出し側で全体を返す。
+    満たせない範囲の場合はValueErrorを投げる。
+    """
+    match = RANGE_RE.match(header)
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # bytes=-500 は末尾500バイト
+        length = int(last)
+        if length == 0:
+            raise ValueError('empty suffix range')
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError('unsatisfiable range')
+    return start, min(end, size - 1)
+
+
+def file_iterator(fieldfile, start, length, chunk_size=CHUNK_SIZE):
+    """startからlengthバイトをchunk_sizeずつ返す。
+
+    ローカルファイルならmmapして必要なページだけ読み込む。
+    mmapできないストレージではseekとreadで読む。
+    """
+    with fieldfile.storage.open(fieldfile.name, 'rb') as f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (AttributeError, OSError, ValueError):
+            mapped = None
+
+        if mapped is not None:
+            with mapped:
+                position, stop = start, start + length
+                while position < stop:
+                    size = min(chunk_size, stop - position)
+                    yield mapped[position:position + size]
+                    position += size
+            return
+
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            data = f.read(min(chunk_size, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+
+def if_range_matches(request, etag, mtime):
+    """If-Rangeが無いか、現在のファイルと一致していればTrue"""
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        # 弱いETagはIf-Rangeには使えない
+        return if_range == etag
+    since = parse_http_date_safe(if_range)
+    return since is not None and int(mtime) <= since
+
+
+def not_modified(request, etag, mtime):
+    """If-None-Match・If-Modified-Sinceが現在のファイルと一致すれば304を返す"""
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        matched = etag in [tag.strip() for tag in if_none_match.split(',')]
+    else:
+        since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        matched = since is not None and int(mtime) <= since
+    if not matched:
+        return None
+    response = HttpResponseNotModified()
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(mtime)
+    return response
+
+
+def serve_file(request, fieldfile):
+    """FieldFileをRange対応で返すレスポンスを作る"""
+    storage = fieldfile.storage
+    size = storage.size(fieldfile.name)
+    mtime = storage.get_modified_time(fieldfile.name).timestamp()
+    etag = make_etag(size, mtime)
+    content_type = mimetypes.guess_type(fieldfile.name)[0] or 'application/octet-stream'
+
+    response = not_modified(request, etag, mtime)
+    if response is not None:
+        return response
+
+    byte_range = None
+    range_header = request.META.get('HTTP_RANGE')
+    if range_header and if_range_matches(request, etag, mtime):
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */{0}'.format(size)
+            response['Accept-Ranges'] = 'bytes'
+            return response
+
+    if byte_range is None:
+        start, length, status = 0, size, 200
+    else:
+        start, length, status = byte_range[0], byte_range[1] - byte_range[0] + 1, 206
+
+    response = StreamingHttpResponse(
+        file_iterator(fieldfile, start, length), status=status, content_type=content_type
+    )
+    if status == 206:
+        response['Content-Range'] = 'bytes {0}-{1}/{2}'.format(start, start + length - 1, size)
+    response['Content-Length'] = str(length)
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(mtime)
+    return response
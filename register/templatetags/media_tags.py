@@ -0,0 +1,67 @@
+from django import template
+
+from register import renditions
+
+register = template.Library()
+
+
+@register.simple_tag
+def rendition_url(fieldfile, size):
+    """画像の縮小版のURL。まだ作られていなければ元の画像のURL
+
+    prefetch_comment_renditionsで取得してあれば、そのURLを使う。
+    """
+    if not fieldfile:
+        return ''
+    urls = getattr(fieldfile.instance, 'rendition_urls', {}).get(fieldfile.name)
+    if urls is None:
+        urls = renditions.get_urls(fieldfile.name)
+    return urls.get(size) or fieldfile.url
+
+
+@register.simple_tag
+def prefetch_renditions(videos):
+    """一覧の動画の縮小版のURLをまとめて取得しておく（renditions.attach）
+
+    キャッシュされていないときだけ取得するように、{% cache %} の中で使う。
+    """
+    renditions.attach(videos)
+    return ''
+
+
+@register.simple_tag
+def prefetch_comment_renditions(comments):
+    """コメントの画像の縮小版のURLをまとめて取得しておく（renditions.attach_comment_images）
+
+    prefetch_renditionsと同じく {% cache %} の中で使う。
+    """
+    renditions.attach_comment_images(comments)
+    return ''
+
+
+@register.simple_tag
+def video_thumbnail_url(video, size):
+    """動画のサムネイルの縮小版のURL
+
+    サムネイルが無い場合は動画から切り出した1コマを使い、それも無ければ空文字を返す。
+    prefetch_renditionsで取得してあれば、そのURLを使う。
+    """
+    urls = getattr(video, 'rendition_urls', None)
+    if urls is None:
+        source = video.thumbnail.name or video.upload.name
+        urls = renditions.get_urls(source)
+    if video.thumbnail:
+        return urls.get(size) or video.thumbnail.url
+    return urls.get(size, '')
+
+
+@register.filter
+def duration(seconds):
+    """秒数を 1:02:03 や 2:03 の形にする"""
+    if seconds is None:
+        return ''
+    hours, rest = divmod(int(round(seconds)), 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return '{0}:{1:02}:{2:02}'.format(hours, minutes, seconds)
+    return '{0}:{1:02}'.format(minutes, seconds)
@@ -0,0 +1,22 @@
+"""テスト用のヘルパー"""
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryBudgetMixin:
+    """TestCaseに混ぜて使う。ページ表示で発行されるSQLの件数が予算内か確認する
+
+    件数が動画やコメントの数に比例して増える（N+1）と予算を超えて失敗する。
+    """
+
+    def assertQueryBudget(self, budget, url, **extra):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, **extra)
+            # テンプレートの遅延評価も含めて数えるため、ここで描画を終わらせる
+            if hasattr(response, 'render') and not response.is_rendered:
+                response.render()
+        executed = len(context.captured_queries)
+        if executed > budget:
+            queries = '\n'.join(query['sql'] for query in context.captured_queries)
+            self.fail('{0}: {1} queries executed, budget is {2}\n{3}'.format(url, executed, budget, queries))
+        return response
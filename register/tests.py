@@ -1,3 +1,94 @@
-from django.test import TestCase
+import shutil
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from . import counters
+from .models import Comment, Lecturer, Subject, User, Video
+from .testing import QueryBudgetMixin
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+# キャッシュはプロジェクトの設定のまま使い、DatabaseCacheへの問い合わせも予算に含める
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    """一覧・再生・検索のページのSQLの件数が動画やコメントの数で増えないことを確認する"""
+    # 予算を決めたときより行を増やしても件数が変わらないことを確かめるため、ページ1枚分より多く作る
+    VIDEOS = 30
+    COMMENTS = 10
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('owner@example.com', 'password')
+        cls.subject = Subject.objects.create(subject='数学')
+        cls.lecturer = Lecturer.objects.create(lecture_name='講師', lecture_email='lecturer@example.com')
+        for i in range(cls.VIDEOS):
+            video = Video(title='微分積分 第{0}回'.format(i), subject=cls.subject, user=cls.user)
+            video.upload.save('video{0}.mp4'.format(i), ContentFile('video{0}'.format(i).encode()), save=False)
+            video.save()
+        cls.video = video
+        for i in range(cls.COMMENTS):
+            comment = Comment(
+                title='質問{0}'.format(i), text='本文', video=cls.video, user=cls.user, lecturer=cls.lecturer,
+            )
+            # 画像の縮小版の取得もコメントの数で増えないことを確かめる
+            for field in ('reply_image1', 'reply_image2', 'reply_image3'):
+                name = '{0}_{1}.png'.format(field, i)
+                getattr(comment, field).save(name, ContentFile(name.encode()), save=False)
+            comment.save()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        counters.get_cache().clear()
+        # 再生回数を書き込むスレッドはテスト用のDBが消えた後にも動くので起動しない
+        patcher = mock.patch('register.counters.ensure_flusher')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # 集計の書き出しはPUBLISH_INTERVAL秒ごとで、どのリクエストで起きるかが決まらないので止める
+        patcher = mock.patch('register.metrics.publish')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client.force_login(self.user)
+
+    def test_video_list(self):
+        self.assertQueryBudget(30, reverse('register:index'))
+
+    def test_index(self):
+        self.assertQueryBudget(30, reverse('register:second_index'))
+
+    def test_all_videos(self):
+        self.assertQueryBudget(30, reverse('register:all_videos'))
+
+    def test_subject(self):
+        self.assertQueryBudget(31, reverse('register:subject', args=[self.subject.pk]))
+
+    def test_search(self):
+        self.assertQueryBudget(30, reverse('register:second_index') + '?keyword=微分')
+
+    def test_all_videos_search(self):
+        self.assertQueryBudget(30, reverse('register:all_videos') + '?master_keyword=積分')
+
+    def test_play(self):
+        self.assertQueryBudget(34, reverse('register:play', args=[self.video.pk]))
+
+    def test_all_videos_cached(self):
+        # 2回目はカードをキャッシュから描画する
+        url = reverse('register:all_videos')
+        self.client.get(url)
+        self.assertQueryBudget(7, url)
+
+    def test_play_cached(self):
+        # 2回目はコメント欄をキャッシュから描画する
+        url = reverse('register:play', args=[self.video.pk])
+        self.client.get(url)
+        self.assertQueryBudget(10, url)
@@ -0,0 +1,109 @@
+"""科目ごとの人気ランキング
+
+update_trendingコマンドが定期的に、前回から増えた再生回数とコメント数を
+動画ごとのスコア（VideoTrend.score）に加える。スコアは半減期HALF_LIFEで
+減衰するので、最近よく見られている動画ほど上位になる。
+
+減衰は全ての動画に同じ係数を掛けるだけで順位を変えないので、保存するスコアは
+減衰させずに、加える値の方を基準時刻EPOCHからの経過時間に応じて2**(経過/HALF_LIFE)倍する。
+こうすると実行のたびに書き込むのは再生・コメントが増えた動画だけで済む。
+値がすぐに大きくなりすぎるので、2を底とする対数で保存する（0はまだ何も無い）。
+HALF_LIFEを変えた場合は、スコアを作り直す必要がある。
+
+ランキングのページは科目・ユーザーとスコアの索引を上から読むだけなので、
+動画が何件あっても表示する件数分しか読まない。
+"""
+import math
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+HALF_LIFE = timedelta(hours=getattr(settings, 'TRENDING_HALF_LIFE_HOURS', 72))
+# スコアを換算する基準時刻
+EPOCH = datetime(2020, 1, 1, tzinfo=timezone.utc)
+# 再生1回・コメント1件あたりのスコア
+VIEW_WEIGHT = getattr(settings, 'TRENDING_VIEW_WEIGHT', 1.0)
+COMMENT_WEIGHT = getattr(settings, 'TRENDING_COMMENT_WEIGHT', 5.0)
+# ランキングに表示する件数
+SIZE = getattr(settings, 'TRENDING_SIZE', 50)
+BATCH_SIZE = 500
+
+
+def add_points(score, points, when):
+    """対数のスコアscoreに、時刻whenのpoints点を加えたスコアを返す"""
+    if points <= 0:
+        return score
+    value = math.log2(points) + (when - EPOCH) / HALF_LIFE
+    if score <= 0:
+        return value
+    # log2(2**score + 2**value)を、大きい方を括り出して桁あふれさせずに計算する
+    high, low = max(score, value), min(score, value)
+    return high + math.log2(1 + 2 ** (low - high))
+
+
+def update(now=None):
+    """前回から増えた再生・コメントをスコアに加える。更新した動画の数を返す"""
+    from .models import Video
+
+    now = now or timezone.now()
+    with transaction.atomic():
+        # 前回から再生回数・コメント数・科目・ユーザーが変わった動画と、まだスコアの無い動画
+        changed = Video.objects.filter(
+            Q(trend__isnull=True)
+            | ~Q(count=F('trend__last_count'))
+            | ~Q(comment_count=F('trend__last_comment_count'))
+            | ~Q(subject=F('trend__subject'))
+            | ~Q(user=F('trend__user'))
+        ).order_by('pk').values_list('pk', 'subject_id', 'user_id', 'count', 'comment_count')
+
+        updated = 0
+        rows = list(changed[:BATCH_SIZE])
+        while rows:
+            updated += _update_batch(rows, now)
+            rows = list(changed.filter(pk__gt=rows[-1][0])[:BATCH_SIZE])
+    return updated
+
+
+def _update_batch(rows, now):
+    from .models import VideoTrend
+
+    trends = VideoTrend.objects.in_bulk([row[0] for row in rows])
+    created = []
+    updated = []
+    for video_pk, subject_pk, user_pk, count, comment_count in rows:
+        trend = trends.get(video_pk)
+        if trend is None:
+            # 初回はそれまでの再生・コメントを全て今のものとして数える
+            trend = VideoTrend(video_id=video_pk)
+            created.append(trend)
+        else:
+            updated.append(trend)
+        # コメントの削除などで減った場合はスコアを減らさない
+        views = max(0, count - trend.last_count)
+        comments = max(0, comment_count - trend.last_comment_count)
+        trend.score = add_points(trend.score, views * VIEW_WEIGHT + comments * COMMENT_WEIGHT, now)
+        trend.subject_id = subject_pk
+        trend.user_id = user_pk
+        trend.last_count = count
+        trend.last_comment_count = comment_count
+        trend.updated_at = now
+    VideoTrend.objects.bulk_create(created)
+    VideoTrend.objects.bulk_update(
+        updated, ['score', 'subject', 'user', 'last_count', 'last_comment_count', 'updated_at']
+    )
+    return len(rows)
+
+
+def ranking(user, subject=None):
+    """userが見られる動画のランキング（VideoTrendのクエリセット）"""
+    from .models import VideoTrend
+
+    queryset = VideoTrend.objects.select_related('video', 'subject').filter(score__gt=0)
+    if not user.is_superuser:
+        queryset = queryset.filter(user=user)
+    if subject is not None:
+        queryset = queryset.filter(subject=subject)
+    return queryset.order_by('-score')[:SIZE]
@@ -0,0 +1,202 @@
+"""大きな動画ファイルの分割（レジューム可能）アップロード
+
+クライアントはUploadSessionを作り、ファイルを先頭から順にチャンクで送る。
+チャンクはリクエストから少しずつ読んで一時ファイルへ追記するので、
+ファイルの大きさに関係なくメモリ使用量は一定。途中で切れても、
+セッションのoffsetから送り直せばよい。
+
+全て受信したら一時ファイルをuploads/%Y/%m/%d/などの保存先
+（ContentAddressedStorageの場合はハッシュで決まる保存先）へ移動し、
+フォームからはファイルを読み直さずにVideo.upload/Comment.reply_videoへ紐づける。
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+# 一時ファイルの置き場所
+TEMP_DIR = getattr(settings, 'CHUNKED_UPLOAD_TEMP_DIR', os.path.join(settings.MEDIA_ROOT, 'chunked_uploads'))
+# クライアントに勧める1チャンクの大きさ
+CHUNK_SIZE = getattr(settings, 'CHUNKED_UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024)
+# 受け付ける最大のファイルサイズ
+MAX_SIZE = getattr(settings, 'CHUNKED_UPLOAD_MAX_SIZE', 10 * 1024 * 1024 * 1024)
+# リクエストから1回に読むバイト数
+READ_SIZE = 64 * 1024
+
+# 受信途中のハッシュを覚えておくセッションの数と秒数。
+# 覚えていないセッション（別プロセスで受信した、放置されたなど）は一時ファイルから計算し直す
+HASHER_CACHE_SIZE = 64
+HASHER_CACHE_SECONDS = 60 * 60
+
+# 受信途中のハッシュ。{セッションID: (受信済みバイト数, hashlibオブジェクト, 最後に使った時刻)}
+# 古い順に並べ、HASHER_CACHE_SIZE・HASHER_CACHE_SECONDSを超えたものから捨てる
+_hashers = OrderedDict()
+_lock = threading.Lock()
+
+
+class UploadError(Exception):
+    """クライアントに返すエラー。statusはHTTPステータス"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def target_field(target):
+    """アップロード先のモデルフィールド"""
+    from .models import Comment, UploadSession, Video
+
+    model, name = {
+        UploadSession.VIDEO: (Video, 'upload'),
+        UploadSession.REPLY_VIDEO: (Comment, 'reply_video'),
+    }[target]
+    return model._meta.get_field(name)
+
+
+def part_path(session):
+    return os.path.join(TEMP_DIR, '{0}.part'.format(session.pk))
+
+
+def create_session(user, target, filename, size):
+    """アップロードを始める"""
+    from .models import UploadSession
+
+    if target not in dict(UploadSession.TARGET_CHOICES):
+        raise UploadError('アップロード先が正しくありません')
+    filename = os.path.basename(filename or '')
+    if not filename:
+        raise UploadError('ファイル名を指定してください')
+    if size <= 0 or size > MAX_SIZE:
+        raise UploadError('ファイルサイズが正しくありません')
+
+    session = UploadSession.objects.create(user=user, target=target, filename=filename, size=size)
+    os.makedirs(TEMP_DIR, exist_ok=True)
+    open(part_path(session), 'wb').close()
+    return session
+
+
+def _remember_hasher(session, hasher):
+    now = time.monotonic()
+    with _lock:
+        _hashers[session.pk] = (session.offset, hasher, now)
+        _hashers.move_to_end(session.pk)
+        while _hashers:
+            oldest = next(iter(_hashers.values()))
+            if len(_hashers) <= HASHER_CACHE_SIZE and now - oldest[2] < HASHER_CACHE_SECONDS:
+                break
+            _hashers.popitem(last=False)
+
+
+def _forget_hasher(session):
+    with _lock:
+        _hashers.pop(session.pk, None)
+
+
+def _hasher(session):
+    """offsetまでを読み込んだハッシュを返す。覚えていなければ一時ファイルから計算し直す"""
+    with _lock:
+        entry = _hashers.pop(session.pk, None)
+    if entry is not None and entry[0] == session.offset:
+        return entry[1]
+    hasher = hashlib.sha256()
+    remaining = session.offset
+    with open(part_path(session), 'rb') as f:
+        while remaining > 0:
+            data = f.read(min(READ_SIZE, remaining))
+            if not data:
+                break
+            hasher.update(data)
+            remaining -= len(data)
+    return hasher
+
+
+def write_chunk(session, stream, start, length):
+    """streamからlengthバイトを読み、start位置に書き込む
+
+    受信できた分だけoffsetを進めるので、途中で接続が切れても続きから送り直せる。
+    書き込む前にセッションの行をロックするので、同じセッションに同時にチャンクが
+    送られた場合は後から来た方が先の書き込みを待ち、offsetが合わずに失敗する。
+    """
+    from .models import UploadSession
+
+    with transaction.atomic():
+        locked = UploadSession.objects.select_for_update().get(pk=session.pk)
+        session.offset = locked.offset
+        session.file_name = locked.file_name
+        if session.is_complete:
+            raise UploadError('アップロードは完了しています', status=409)
+        if start != session.offset:
+            raise UploadError('offsetが一致しません', status=409)
+        if length <= 0 or start + length > session.size:
+            raise UploadError('チャンクの範囲が正しくありません')
+
+        hasher = _hasher(session)
+        received = 0
+        with open(part_path(session), 'r+b') as f:
+            f.seek(start)
+            # 前回途中で切れたときの書きかけを捨てる
+            f.truncate()
+            while received < length:
+                data = stream.read(min(READ_SIZE, length - received))
+                if not data:
+                    break
+                f.write(data)
+                hasher.update(data)
+                received += len(data)
+
+        UploadSession.objects.filter(pk=session.pk).update(offset=start + received, updated_at=timezone.now())
+    session.offset = start + received
+    if session.offset < session.size:
+        _remember_hasher(session, hasher)
+
+    if received < length:
+        raise UploadError('チャンクが途中で切れました')
+    if session.offset == session.size:
+        finalize(session, hasher.hexdigest())
+    return session
+
+
+def finalize(session, sha256):
+    """一時ファイルを保存先へ移動する。中身は読み直さない"""
+    field = target_field(session.target)
+    storage = field.storage
+    if hasattr(storage, 'adopt'):
+        # ContentAddressedStorageなら受信中に計算したハッシュで保存先を決める
+        name = storage.adopt(part_path(session), session.filename, sha256)
+    else:
+        name = field.generate_filename(None, session.filename)
+        name = storage.get_available_name(name, max_length=field.max_length)
+        path = storage.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(part_path(session), path)
+        if settings.FILE_UPLOAD_PERMISSIONS is not None:
+            os.chmod(path, settings.FILE_UPLOAD_PERMISSIONS)
+
+    session.sha256 = sha256
+    session.file_name = name
+    session.save(update_fields=['sha256', 'file_name', 'updated_at'])
+    _forget_hasher(session)
+
+
+def attach(session, instance):
+    """完了したアップロードをinstanceのファイルフィールドに設定し、セッションを消す"""
+    field = target_field(session.target)
+    setattr(instance, field.attname, session.file_name)
+    session.delete()
+
+
+def discard(session):
+    """途中のアップロードを取り消す。完了していてまだ紐づけていないファイルも消す"""
+    try:
+        os.remove(part_path(session))
+    except FileNotFoundError:
+        pass
+    if session.file_name:
+        target_field(session.target).storage.delete(session.file_name)
+    _forget_hasher(session)
+    session.delete()
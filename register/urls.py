@@ -29,12 +29,20 @@ urlpatterns = [
     path('index/', views.IndexView.as_view(), name='second_index'),
 
     path('upload/', views.CreateView.as_view(), name='upload'),
+    path('upload/sessions/', views.UploadSessionCreate.as_view(), name='upload_session_create'),
+    path('upload/sessions/<uuid:pk>/', views.UploadSessionDetail.as_view(), name='upload_session'),
     path('play/<int:pk>/', views.PlayView.as_view(), name='play'),
+    path('play/<int:pk>/progress/', views.WatchProgressView.as_view(), name='watch_progress'),
+    path('stream/<int:pk>/', views.StreamView.as_view(), name='stream'),
     path('subject/<int:pk>/', views.SubjectView.as_view(), name='subject'),
+    path('trending/', views.TrendingView.as_view(), name='trending'),
+    path('trending/<int:pk>/', views.TrendingView.as_view(), name='subject_trending'),
 
     path('delete/<int:pk>/', views.DeleteView.as_view(), name='delete'),
     path('comment/<int:video_pk>/',views.CommentView.as_view(), name='comment'),
     path('allvideolist/', views.AllVideosView.as_view(), name='all_videos'),
     path('commentdelete/<int:pk>/', views.CommentDeleteView.as_view(), name='comment_delete'),
+    path('metrics/', views.MetricsView.as_view(), name='metrics'),
+    path('stats/', views.StatsView.as_view(), name='stats'),
 
 ]
\ No newline at end of file
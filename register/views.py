@@ -1,3 +1,5 @@
+from datetime import timedelta
+
 from django.conf import settings
 from django.contrib.auth import get_user_model, login, logout, authenticate
 from django.contrib.auth.decorators import login_required
@@ -7,21 +9,28 @@ from django.contrib.auth.views import (
     PasswordResetView, PasswordResetDoneView, PasswordResetConfirmView, PasswordResetCompleteView
 )
 from django.contrib.sites.shortcuts import get_current_site
-from django.core.mail import send_mail
+from django.core.exceptions import PermissionDenied
 from django.core.signing import BadSignature, SignatureExpired, loads, dumps
-from django.http import HttpResponseBadRequest
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseBadRequest, JsonResponse
 from django.shortcuts import redirect, resolve_url, render
 from django.template.loader import render_to_string
 from django.urls import reverse_lazy
+from django.utils import timezone
 from django.views import generic
+from . import (
+    conditional, counters, digest, metrics, page_cache, progress, reference, search, sendfile, stats, trending,
+    uploads,
+)
+from .mail import enqueue_mail
 from .forms import (
     LoginForm, UserCreateForm, UserUpdateForm, MyPasswordChangeForm,
     MyPasswordResetForm, MySetPasswordForm, EmailChangeForm,
     VideoCreateForm, SearchForm, CommentCreateForm
 )
-from .models import Video, Subject, Comment
+from .models import Video, Subject, Comment, UploadSession
+from .pagination import paginate_keyset
 from django.shortcuts import get_object_or_404
-from django.db.models import Q
 
 
 User = get_user_model()
@@ -64,7 +73,7 @@ class UserCreate(generic.CreateView):
         subject = render_to_string('register/mail_template/create/subject.txt', context)
         message = render_to_string('register/mail_template/create/message.txt', context)
 
-        user.email_user(subject, message)
+        enqueue_mail(subject, message, [user.email])
         return redirect('register:user_create_done')
 
 
@@ -117,6 +126,52 @@ class OnlyYouMixin(UserPassesTestMixin):
         return user.pk == self.kwargs['pk'] or user.is_superuser
 
 
+class MetricsView(UserPassesTestMixin, generic.View):
+    """ページごとの処理時間・SQL数の集計（スタッフのみ）"""
+    raise_exception = True
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get(self, request):
+        return JsonResponse(metrics.report(), json_dumps_params={'ensure_ascii': False})
+
+
+class StatsView(UserPassesTestMixin, generic.TemplateView):
+    """ユーザー・科目・講師ごとの利用状況（スタッフのみ）。集計済みの表だけを読む（stats.py）"""
+    template_name = 'register/stats.html'
+    raise_exception = True
+    PERIODS = (7, 30, 90)
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        days = self.request.GET.get('days')
+        days = int(days) if days in {str(period) for period in self.PERIODS} else 30
+        by_kind, daily = stats.summary(timezone.localdate() - timedelta(days=days - 1))
+
+        user_pks = [row['key'] for row in by_kind['user']]
+        names = {
+            'user': dict(User.objects.filter(pk__in=user_pks).values_list('pk', 'email')),
+            'subject': {subject.pk: str(subject) for subject in reference.get_subjects()},
+            'lecturer': {lecturer.pk: lecturer.lecture_name for lecturer in reference.get_lecturers()},
+        }
+        for kind, rows in by_kind.items():
+            for row in rows:
+                row['name'] = names[kind].get(row['key'], '(削除済み)')
+        context.update({
+            'days': days,
+            'periods': self.PERIODS,
+            'user_stats': by_kind['user'],
+            'subject_stats': by_kind['subject'],
+            'lecturer_stats': by_kind['lecturer'],
+            'daily_stats': daily,
+        })
+        return context
+
+
 class UserDetail(OnlyYouMixin, generic.DetailView):
     """ユーザーの詳細ページ"""
     model = User
@@ -192,7 +247,7 @@ class EmailChange(LoginRequiredMixin, generic.FormView):
 
         subject = render_to_string('register/mail_template/email_change/subject.txt', context)
         message = render_to_string('register/mail_template/email_change/message.txt', context)
-        send_mail(subject, message, None, [new_email])
+        enqueue_mail(subject, message, [new_email])
 
         return redirect('register:email_change_done')
 
@@ -228,17 +283,93 @@ class EmailChangeComplete(LoginRequiredMixin, generic.TemplateView):
             return super().get(request, **kwargs)
 
 
+class KeysetPaginationMixin:
+    """ListViewの一覧をOFFSETではなくカーソルでページ分割する"""
+    paginate_by = getattr(settings, 'VIDEO_LIST_PAGE_SIZE', 24)
+
+    def paginate_queryset(self, queryset, page_size):
+        page = paginate_keyset(self.request, queryset, page_size)
+        return None, page, page.object_list, page.has_next or not page.is_first
+
+
+class ConditionalGetMixin:
+    """表示内容が変わっていなければ描画せずに304を返す（conditional.py）"""
+    # 管理者用のページか（Cache-Controlを変える）
+    admin_page = False
+
+    def get_cache_scopes(self):
+        """表示内容のバージョン（page_cache.py）。既定は全動画の一覧"""
+        return [page_cache.VIDEOS]
+
+    def get_validators(self):
+        """(ETagの元になる値のタプル, Last-Modified)"""
+        # 動画の表を集計せず、キャッシュのバージョンを1回読むだけで済ませる
+        self.versions = tuple(page_cache.get_versions(self.get_cache_scopes()))
+        return self.versions, None
+
+    def not_modified(self):
+        """304を返すときに、描画の代わりに行う処理"""
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # 一覧のカードをまとめてキャッシュするときのキー（テンプレートの{% cache %}）
+        context['content_version'] = ':'.join(getattr(self, 'versions', ()))
+        return context
+
+    def get(self, request, *args, **kwargs):
+        validators = self.get_validators()
+        if validators is None:
+            return super().get(request, *args, **kwargs)
+        parts, last_modified = validators
+        etag = conditional.make_etag(request, *parts)
+        response = conditional.not_modified(request, etag, last_modified)
+        if response is not None:
+            self.not_modified()
+        else:
+            response = super().get(request, *args, **kwargs)
+        return conditional.set_headers(request, response, etag, last_modified, admin=self.admin_page)
+
+
+class AnonymousPageCacheMixin:
+    """ログインしていないユーザーへのGETのレスポンスを丸ごとキャッシュする（page_cache.py）
+
+    ConditionalGetMixinの後ろに置き、ETagに使ったバージョン（self.versions）をキーに含める。
+    """
+
+    def get(self, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return super().get(request, *args, **kwargs)
+        response = page_cache.get_response(request, self.versions)
+        if response is None:
+            response = page_cache.set_response(request, self.versions, super().get(request, *args, **kwargs))
+        return response
+
+
 @login_required
 def videolistfunc(request):
     # user はVideoモデルが保有する変数userのこと、このuserが現在ログインしているユーザー（request.user）と一致するかどうかを下の行で調べている。
-    object_list = Video.objects.order_by('-created_at').filter(user=request.user)
-    return render(request, 'register/video_list.html', {'object_list': object_list})
-
-
-class IndexView(generic.ListView):
+    queryset = Video.objects.for_listing().filter(user=request.user)
+    versions = page_cache.get_versions([page_cache.user_scope(request.user.pk)])
+    etag = conditional.make_etag(request, *versions)
+    response = conditional.not_modified(request, etag, None)
+    if response is None:
+        page = paginate_keyset(request, queryset, KeysetPaginationMixin.paginate_by)
+        response = render(request, 'register/video_list.html', {
+            'content_version': ':'.join(versions),
+            'object_list': page.object_list,
+            'page_obj': page,
+            'is_paginated': page.has_next or not page.is_first,
+        })
+    return conditional.set_headers(request, response, etag, None)
+
+
+class IndexView(ConditionalGetMixin, KeysetPaginationMixin, generic.ListView):
     model = Video
     template_name = "register/video_list.html"
 
+    def get_cache_scopes(self):
+        return [page_cache.user_scope(self.request.user.pk)]
+
     def get_context_data(self):
         # queryset = Video.objects.filter(user=self.request.user)
         context = super().get_context_data()
@@ -251,7 +382,7 @@ class IndexView(generic.ListView):
         form.is_valid()
 
         # queryset = super().get_queryset()
-        queryset = Video.objects.order_by('-created_at').filter(user=self.request.user)
+        queryset = Video.objects.for_listing().filter(user=self.request.user)
 
         subject = form.cleaned_data['subject']
         if subject:
@@ -259,27 +390,51 @@ class IndexView(generic.ListView):
         return queryset
 
     def get_queryset(self):
-        queryset = Video.objects.order_by('-created_at').filter(user=self.request.user)
+        queryset = Video.objects.for_listing().filter(user=self.request.user)
         keyword = self.request.GET.get('keyword')
         if keyword:
-            queryset = queryset.filter(
-                Q(description__icontains=keyword) | Q(title__icontains=keyword))
+            queryset = search.search(queryset, keyword)
         return queryset
 
 
-class SubjectView(generic.ListView):
+class SubjectView(ConditionalGetMixin, KeysetPaginationMixin, generic.ListView):
     model = Video
 
+    def get_cache_scopes(self):
+        return [page_cache.user_scope(self.request.user.pk)]
+
     def get_queryset(self):
         subject = get_object_or_404(Subject, pk=self.kwargs['pk'])
-        queryset = Video.objects.order_by('-created_at').filter(user=self.request.user).filter(subject=subject)
+        queryset = Video.objects.for_listing().filter(user=self.request.user).filter(subject=subject)
         return queryset
 
 
+class TrendingView(LoginRequiredMixin, generic.ListView):
+    """最近よく見られている動画のランキング。科目を指定するとその科目だけ（trending.py）"""
+    template_name = 'register/trending_list.html'
+    context_object_name = 'trend_list'
+
+    def get_queryset(self):
+        self.subject = None
+        if 'pk' in self.kwargs:
+            self.subject = get_object_or_404(Subject, pk=self.kwargs['pk'])
+        return trending.ranking(self.request.user, self.subject)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['subject'] = self.subject
+        return context
+
+
 class CreateView(generic.CreateView):
     model = Video
     form_class = VideoCreateForm
 
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs['uploader'] = self.request.user
+        return kwargs
+
     def form_valid(self, form):
         video = form.save(commit=False)
         video.save()
@@ -299,36 +454,182 @@ class CreateView(generic.CreateView):
         subject = render_to_string('register/mail_template/video_upload_reminder_messages/subject')
         message = render_to_string('register/mail_template/video_upload_reminder_messages/message', context)
 
-        send_mail(subject, message, None, [user_email])
+        enqueue_mail(subject, message, [user_email])
         return redirect('register:index')
 
     # success_url = reverse_lazy('register:index')
 
 
-class PlayView(generic.DetailView):
+class PlayView(LoginRequiredMixin, ConditionalGetMixin, generic.DetailView):
+    """動画の再生ページ。動画ファイルの配信（sendfile.can_access）と同じく、持ち主とスーパーユーザーだけ見られる"""
     model = Video
 
+    def get_queryset(self):
+        return Video.objects.for_detail().viewable_by(self.request.user)
+
+    def get_validators(self):
+        row = Video.objects.viewable_by(self.request.user).filter(pk=self.kwargs['pk']).values_list(
+            'updated_at', 'count', 'comment_count', 'viewer_count', 'completed_count', 'hls_status'
+        ).first()
+        if row is None:
+            # 404はDetailViewに任せる
+            return None
+        # コメントの編集はVideoの行を変えないので、コメント欄のバージョンも含める
+        parts = row + (page_cache.get_version(page_cache.video_scope(self.kwargs['pk'])),)
+        # 続きから再生する位置が変わったら描画し直す
+        self.position = progress.get_position(self.request.user.pk, self.kwargs['pk'])
+        parts += (int(self.position),)
+        return parts, row[0]
+
+    def not_modified(self):
+        counters.increment(self.kwargs['pk'])
+
     def get_object(self, queryset=None):
         obj = super().get_object(queryset)
-        obj.count += 1
-
-        obj.save()
+        # 再生回数はバッファに加算し、まとめてDBへ書き込む（counters.flush）
+        obj.count += counters.increment(obj.pk)
         return obj
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # コメント欄はキャッシュが無いときだけ読み込む
+        context['comments'] = self.object.comment_set.select_related('lecturer').order_by('created_at', 'pk')
+        context['comments_version'] = page_cache.get_version(page_cache.video_scope(self.object.pk))
+        context['resume_position'] = progress.resume_position(self.position, self.object.duration)
+        context['heartbeat_interval'] = progress.HEARTBEAT_INTERVAL
+        return context
+
+
+class WatchProgressView(LoginRequiredMixin, generic.View):
+    """再生中のプレイヤーから一定間隔で送られる視聴位置を記録する（progress.py）"""
+
+    def post(self, request, pk):
+        try:
+            position = float(request.POST['position'])
+            duration = float(request.POST.get('duration') or 0)
+        except (KeyError, ValueError):
+            return JsonResponse({'error': '視聴位置が正しくありません'}, status=400)
+        if not (0 <= position < float('inf')) or not (0 <= duration < float('inf')):
+            return JsonResponse({'error': '視聴位置が正しくありません'}, status=400)
+        progress.record(request.user.pk, pk, position, duration, ended=request.POST.get('ended') == '1')
+        return HttpResponse(status=204)
+
+
+class StreamView(generic.detail.SingleObjectMixin, generic.View):
+    """動画ファイルの配信（Range対応でシーク可能）"""
+    model = Video
+
+    def get(self, request, *args, **kwargs):
+        video = self.get_object()
+        if not sendfile.can_access(request.user, video.upload.name):
+            raise PermissionDenied
+        return sendfile.send(request, video.upload.name, video.upload.storage)
+
+
+class MediaView(generic.View):
+    """MEDIA_URL以下のファイルの配信。アクセスを確認してから送信はWebサーバーに任せる"""
+
+    def get(self, request, name):
+        if not sendfile.can_access(request.user, name):
+            raise PermissionDenied
+        return sendfile.send(request, name)
+
+
+def upload_session_json(session):
+    return {
+        'id': str(session.pk),
+        'url': resolve_url('register:upload_session', pk=session.pk),
+        'size': session.size,
+        'offset': session.offset,
+        'chunk_size': uploads.CHUNK_SIZE,
+        'complete': session.is_complete,
+        'sha256': session.sha256,
+    }
+
+
+class UploadSessionCreate(LoginRequiredMixin, generic.View):
+    """分割アップロードの開始"""
+
+    def post(self, request, *args, **kwargs):
+        try:
+            size = int(request.POST.get('size', ''))
+        except ValueError:
+            return JsonResponse({'error': 'ファイルサイズが正しくありません'}, status=400)
+        try:
+            session = uploads.create_session(
+                request.user, request.POST.get('target'), request.POST.get('filename'), size
+            )
+        except uploads.UploadError as e:
+            return JsonResponse({'error': str(e)}, status=e.status)
+        return JsonResponse(upload_session_json(session), status=201)
+
+
+class UploadSessionDetail(LoginRequiredMixin, generic.View):
+    """分割アップロードの状態確認（GET）・チャンク送信（PUT）・取り消し（DELETE）
+
+    PUTの本文はファイルの一部で、Content-Range: bytes 開始-終了/全体 で位置を指定する。
+    """
+
+    def get_session(self):
+        return get_object_or_404(UploadSession, pk=self.kwargs['pk'], user=self.request.user)
+
+    def get(self, request, *args, **kwargs):
+        return JsonResponse(upload_session_json(self.get_session()))
+
+    def put(self, request, *args, **kwargs):
+        session = self.get_session()
+        try:
+            start, end, total = parse_content_range(request.META.get('HTTP_CONTENT_RANGE', ''))
+        except ValueError:
+            return JsonResponse({'error': 'Content-Rangeが正しくありません'}, status=400)
+        if total != session.size:
+            return JsonResponse({'error': 'ファイルサイズが一致しません'}, status=400)
+        try:
+            # request.bodyは使わず、少しずつ読み込む
+            uploads.write_chunk(session, request, start, end - start + 1)
+        except uploads.UploadError as e:
+            session.refresh_from_db()
+            data = upload_session_json(session)
+            data['error'] = str(e)
+            return JsonResponse(data, status=e.status)
+        return JsonResponse(upload_session_json(session))
+
+    def delete(self, request, *args, **kwargs):
+        uploads.discard(self.get_session())
+        return JsonResponse({})
+
+
+def parse_content_range(header):
+    """'bytes 0-99/1000' を (0, 99, 1000) にする"""
+    unit, _, spec = header.strip().partition(' ')
+    byte_range, _, total = spec.partition('/')
+    start, _, end = byte_range.partition('-')
+    if unit != 'bytes':
+        raise ValueError(header)
+    start, end, total = int(start), int(end), int(total)
+    if start > end or end >= total:
+        raise ValueError(header)
+    return start, end, total
+
 
 class CommentView(generic.CreateView):
     model = Comment
     form_class = CommentCreateForm
 
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs['uploader'] = self.request.user
+        return kwargs
+
     def form_valid(self, form):
         video_pk = self.kwargs['video_pk']
         comment = form.save(commit=False)
-        comment.video = get_object_or_404(Video, pk=video_pk)
-        comment.save()
+        comment.video = get_object_or_404(Video.objects.select_related('user'), pk=video_pk)
+        # コメント数はシグナルがDB上で増やす（signals.py）。コメントの保存と同じトランザクションにする
+        with transaction.atomic():
+            comment.save()
         commenter_email = comment.video.user.email
 
-        comment.video.comment_count += 1
-        comment.video.save()
         if comment.lecturer.lecture_email:
             lecturer_email = comment.lecturer.lecture_email
         else:
@@ -345,9 +646,16 @@ class CommentView(generic.CreateView):
             'lecturer_email': lecturer_email
         }
 
+        recipients = [commenter_email, lecturer_email, seigakusha_email]
+        if digest.is_enabled():
+            # 宛先ごとに溜めておき、send_comment_digestsでまとめて送る
+            site_url = '{0}://{1}'.format(context['protocol'], domain)
+            digest.queue_comment(comment, recipients, site_url)
+            return redirect('register:play', pk=video_pk)
+
         subject = render_to_string('register/mail_template/comment_message/subject.txt', context)
         message = render_to_string('register/mail_template/comment_message/message.txt', context)
-        send_mail(subject, message, None, [commenter_email, lecturer_email, seigakusha_email])
+        enqueue_mail(subject, message, recipients)
         return redirect('register:play', pk=video_pk)
 
 
@@ -361,34 +669,24 @@ class CommentDeleteView(generic.DeleteView):
     template_name = "register/comment_confirm_delete.html"
 
     def get_success_url(self):
-        obj = super().get_object(queryset=None)
-        obj.save()
-        obj.video.comment_count -= 1
-        obj.video.save()
-        pk = obj.video.pk
-        return reverse_lazy("register:play", kwargs={'pk':pk})
+        # コメント数は削除のシグナルがDB上で減らす（signals.py）
+        return reverse_lazy("register:play", kwargs={'pk': self.object.video_id})
 
 
-class AllVideosView(generic.ListView):
+class AllVideosView(ConditionalGetMixin, AnonymousPageCacheMixin, KeysetPaginationMixin, generic.ListView):
     model = Video
+    admin_page = True
     context_object_name = 'all_video_list'
     template_name = "register/all_video_list.html"
 
     def get_queryset(self):
-        queryset = Video.objects.order_by('-created_at')
+        queryset = Video.objects.for_listing()
         master_keyword = self.request.GET.get('master_keyword')
         # self.GET.get('master_keyword')は辞書型のデータ。　keywordで入力された文字列がkeyになり、インスタンスがデータになる。
         # {'keyword': 'インスタンス'}といった感じ。
         if master_keyword:
-            queryset = queryset.filter(
-                Q(description__icontains=master_keyword) | Q(title__icontains=master_keyword)
-                # | Q(user__icontains=master_keyword) userは文字列ではなくユーザーインスタンスだからキーワード検索できない。
-                | Q(user__email__icontains=master_keyword)
+            # タイトル・説明に加えて、アップロード先ユーザーのメールアドレスも検索対象
+            queryset = search.search(
+                queryset, master_keyword, fields=(search.TITLE, search.DESCRIPTION, search.EMAIL)
             )
-        """ 
-        Q(user__email__icontains=master_keyword)について
-        userはForeignkeyなのでUserクラスの属性であるemailにアクセスさせるためには
-        user__emailとする必要がある。この時ハイフン（__）が2つ必要であることに注意。
-        なぜなら、属性名の中に、ハイフン(_)を含むものと区別できなくなってしまうため。
-        """
         return queryset
\ No newline at end of file